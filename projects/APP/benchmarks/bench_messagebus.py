@@ -0,0 +1,117 @@
+"""
+Messages per second through MessageBus.handle, with no-op handlers injected by
+bootstrap.inject_dependencies, so only the bus and the injection are measured.
+With --baseline it also measures the way the bus used to work - handlers wrapped in
+a lambda and an isinstance chain per message - to compare against.
+
+    python benchmarks/bench_messagebus.py [--messages N] [--repeat N] [--baseline]
+"""
+import argparse
+import inspect
+import time
+from collections import deque
+
+from allocation import bootstrap
+from allocation.domain import commands, events
+from allocation.service_layer import messagebus
+
+
+class NullUnitOfWork:
+    def __init__(self):
+        self.new_events = []
+
+    def collect_new_events(self):
+        while self.new_events:
+            yield self.new_events.pop(0)
+
+
+# pylint: disable=unused-argument
+def allocate(cmd, uow, notifications, publish):
+    uow.new_events.append(events.Allocated(cmd.orderid, cmd.sku, cmd.qty, "batch1"))
+
+
+def publish_allocated_event(event, publish):
+    pass
+
+
+def add_allocation_to_read_model(event, uow, cache):
+    pass
+
+
+def inject_with_lambda(handler, dependencies):
+    params = inspect.signature(handler).parameters
+    deps = {
+        name: dependency for name, dependency in dependencies.items() if name in params
+    }
+    return lambda message: handler(message, **deps)
+
+
+class IsinstanceMessageBus(messagebus.MessageBus):
+    def handle(self, message):
+        queue = deque([message])
+        try:
+            while queue:
+                message = queue.popleft()
+                if isinstance(message, events.Event):
+                    if self.batch_event_handlers is None:
+                        self.handle_event(message, queue)
+                    else:
+                        batch = [message]
+                        while queue and type(queue[0]) is type(message):
+                            batch.append(queue.popleft())
+                        self.handle_events(batch, queue)
+                elif isinstance(message, commands.Command):
+                    self.handle_command(message, queue)
+                else:
+                    raise Exception(f"{message} was not an Event or Command")
+        finally:
+            self.flush()
+
+
+def make_bus(baseline=False):
+    bus_class = IsinstanceMessageBus if baseline else messagebus.MessageBus
+    inject = inject_with_lambda if baseline else bootstrap.inject_dependencies
+    uow = NullUnitOfWork()
+    dependencies = {"uow": uow, "notifications": None, "publish": None, "cache": None}
+    return bus_class(
+        uow=uow,
+        event_handlers={
+            events.Allocated: [
+                inject(publish_allocated_event, dependencies),
+                inject(add_allocation_to_read_model, dependencies),
+            ]
+        },
+        command_handlers={commands.Allocate: inject(allocate, dependencies)},
+    )
+
+
+def messages_per_second(bus, messages, repeat):
+    command = commands.Allocate("o1", "SKU", 1)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(messages):
+            bus.handle(command)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    # every command leads to one event
+    return 2 * messages / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--baseline", action="store_true")
+    args = parser.parse_args()
+
+    variants = [("current", False)]
+    if args.baseline:
+        variants.insert(0, ("baseline", True))
+    for name, baseline in variants:
+        rate = messages_per_second(make_bus(baseline), args.messages, args.repeat)
+        print(f"{name}: {rate:,.0f} messages/s (best of {args.repeat})")
+
+
+if __name__ == "__main__":
+    main()
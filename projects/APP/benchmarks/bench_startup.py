@@ -0,0 +1,44 @@
+"""
+Seconds a fresh interpreter takes to import allocation.entrypoints.flask_app, which
+is what a web worker pays on every cold start.
+
+    python benchmarks/bench_startup.py [--runs N] [--module NAME]
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+TIMER = """
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+
+def time_import(module):
+    output = subprocess.run(
+        [sys.executable, "-c", TIMER.format(module=module)],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return float(output.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--module", default="allocation.entrypoints.flask_app")
+    args = parser.parse_args()
+
+    timings = [time_import(args.module) for _ in range(args.runs)]
+    print(
+        f"import {args.module}: best {min(timings) * 1000:.0f}ms,"
+        f" median {statistics.median(timings) * 1000:.0f}ms ({args.runs} runs)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import abc
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from allocation import config
+from redis.exceptions import WatchError
+
+# seconds a cached entry is served for, in case an invalidation was missed
+DEFAULT_TTL = 60.0
+# entries the in-process cache keeps before dropping the least recently used
+DEFAULT_MAXSIZE = 10_000
+# seconds Redis keeps a key's invalidation count, far longer than any read takes
+DEFAULT_GENERATION_TTL = 3600
+
+
+class AbstractCache(abc.ABC):
+    """
+    Each key has a generation that every invalidate moves on. A reader takes the
+    generation before reading what it will cache and passes it to set, which then
+    stores nothing if the key was invalidated in between - otherwise a read that
+    raced with a change would cache the old value for the whole ttl.
+    """
+
+    @abc.abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def generation(self, key: str) -> int:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def set(self, key: str, value: Any, generation: Optional[int] = None) -> bool:
+        """
+        Stores value, unless generation is given and key has been invalidated since;
+        returns whether it was stored.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def invalidate(self, key: str):
+        raise NotImplementedError
+
+
+class LocalCache(AbstractCache):
+    """
+    An in-process LRU cache whose entries also expire after ttl seconds.
+    Only the process that invalidates an entry sees it go - use RedisCache to
+    share one cache between processes.
+    """
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, ttl=DEFAULT_TTL, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()  # type: OrderedDict[str, tuple]
+        # key -> the invalidation count when it was last invalidated, for at most
+        # maxsize keys; a key that was dropped reports the highest count dropped, which
+        # can only make set more careful
+        self._invalidated = OrderedDict()  # type: OrderedDict[str, int]
+        self._invalidations = 0
+        self._forgotten = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= self._clock():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def generation(self, key):
+        with self._lock:
+            return self._invalidated.get(key, self._forgotten)
+
+    def set(self, key, value, generation=None):
+        with self._lock:
+            if (
+                generation is not None
+                and self._invalidated.get(key, self._forgotten) != generation
+            ):
+                return False
+            self._entries[key] = (self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            return True
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._invalidations += 1
+            self._invalidated[key] = self._invalidations
+            self._invalidated.move_to_end(key)
+            while len(self._invalidated) > self.maxsize:
+                _, forgotten = self._invalidated.popitem(last=False)
+                self._forgotten = max(self._forgotten, forgotten)
+
+
+class RedisCache(AbstractCache):
+    """
+    A cache shared by every process through Redis, holding JSON values.
+    """
+
+    def __init__(
+        self,
+        prefix="allocations:",
+        ttl=DEFAULT_TTL,
+        client=None,
+        generation_ttl=DEFAULT_GENERATION_TTL,
+    ):
+        self.prefix = prefix
+        self.ttl = ttl
+        self.generation_ttl = generation_ttl
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            from allocation.adapters import redis_eventpublisher
+
+            self._client = redis_eventpublisher.get_client()
+        return self._client
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else json.loads(value)
+
+    def generation(self, key):
+        return int(self.client.get(self._generation_key(key)) or 0)
+
+    def set(self, key, value, generation=None):
+        data, ttl = json.dumps(value), max(1, int(self.ttl))
+        if generation is None:
+            self.client.set(self.prefix + key, data, ex=ttl)
+            return True
+        # WATCH makes the SET fail if an invalidate moves the generation on meanwhile
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(self._generation_key(key))
+                if int(pipe.get(self._generation_key(key)) or 0) != generation:
+                    return False
+                pipe.multi()
+                pipe.set(self.prefix + key, data, ex=ttl)
+                pipe.execute()
+                return True
+            except WatchError:
+                return False
+
+    def invalidate(self, key):
+        with self.client.pipeline() as pipe:
+            pipe.delete(self.prefix + key)
+            pipe.incr(self._generation_key(key))
+            pipe.expire(self._generation_key(key), self.generation_ttl)
+            pipe.execute()
+
+    def _generation_key(self, key):
+        return f"{self.prefix}generation:{key}"
+
+
+def default_cache() -> AbstractCache:
+    """
+    Returns the cache config.get_cache_backend() asks for; a RedisCache only connects
+    on first use.
+    """
+    backend = config.get_cache_backend()
+    if backend == "redis":
+        return RedisCache()
+    if backend == "local":
+        return LocalCache()
+    raise ValueError(f"Unknown cache backend {backend!r}, expected redis or local")
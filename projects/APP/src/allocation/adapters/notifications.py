@@ -1,9 +1,18 @@
 # pylint: disable=too-few-public-methods
 import abc
+import logging
+import os
+import queue
 import smtplib
+import threading
+import time
+import weakref
+from typing import Dict, Optional, Tuple
 
 from allocation import config
 
+logger = logging.getLogger(__name__)
+
 
 class AbstractNotifications(abc.ABC):
     @abc.abstractmethod
@@ -11,19 +20,209 @@ class AbstractNotifications(abc.ABC):
         raise NotImplementedError
 
 
-DEFAULT_HOST = config.get_email_host_and_port()["host"]
-DEFAULT_PORT = config.get_email_host_and_port()["port"]
+# SMTP connections kept open for reuse
+DEFAULT_POOL_SIZE = 2
+# seconds during which repeats of a message to the same destination go into one digest
+DEFAULT_COALESCE_WINDOW = 60.0
+
+
+_email_notifications = weakref.WeakSet()  # type: weakref.WeakSet[EmailNotifications]
+
+
+def reset_after_fork():
+    """
+    Gives every EmailNotifications in a forked child an empty pool, so it does not
+    talk SMTP over the parent's sockets, and drops the digests the parent will send;
+    registered with os.register_at_fork below.
+    """
+    for notifications in list(_email_notifications):
+        notifications._reset()
 
 
 class EmailNotifications(AbstractNotifications):
-    def __init__(self, smtp_host=DEFAULT_HOST, port=DEFAULT_PORT):
-        self.server = smtplib.SMTP(smtp_host, port=port)
-        self.server.noop()
+    """
+    Sends notifications over a small pool of SMTP connections, which are opened on
+    first use and reopened when the server has dropped them.
+
+    The first copy of a message goes out straight away; identical copies to the same
+    destination within coalesce_window seconds (such as the OutOfStock email for one
+    sku, once per failed order line) are only counted, and go out as one digest once
+    the window has passed - from a timer thread (unless digest_timer is False), on a
+    later send, or on flush(). close() sends whatever is still pending.
+    """
+
+    def __init__(
+        self,
+        smtp_host=None,
+        port=None,
+        pool_size=DEFAULT_POOL_SIZE,
+        coalesce_window=DEFAULT_COALESCE_WINDOW,
+        smtp_factory=smtplib.SMTP,
+        clock=time.monotonic,
+        digest_timer=True,
+    ):
+        if smtp_host is None or port is None:
+            email_config = config.get_email_host_and_port()
+            smtp_host = smtp_host or email_config["host"]
+            port = port or email_config["port"]
+        self.smtp_host = smtp_host
+        self.port = port
+        self.coalesce_window = coalesce_window
+        self.digest_timer = digest_timer
+        self._smtp_factory = smtp_factory
+        self._clock = clock
+
+        self.pool_size = pool_size
+        self.sent = 0
+        self.coalesced = 0
+        self.failed = 0
+        self._reset()
+        _email_notifications.add(self)
+
+    def _reset(self):
+        self._idle = queue.LifoQueue()  # type: queue.LifoQueue[smtplib.SMTP]
+        self._slots = threading.BoundedSemaphore(self.pool_size)
+        # (destination, message) -> (when its window closes, repeats in the window)
+        self._windows = {}  # type: Dict[Tuple[str, str], Tuple[float, int]]
+        self._timer = None  # type: Optional[threading.Timer]
+        self._lock = threading.Lock()
 
     def send(self, destination, message):
+        self._send_due_digests()
+        now = self._clock()
+        key = (destination, message)
+        with self._lock:
+            window = self._windows.get(key)
+            if window is not None and now < window[0]:
+                self._windows[key] = (window[0], window[1] + 1)
+                self.coalesced += 1
+                self._schedule_digests(window[0])
+                return
+            self._windows[key] = (now + self.coalesce_window, 0)
+        try:
+            self._sendmail(destination, message)
+        except Exception:
+            # nothing went out, so a retry must not be taken for a repeat
+            with self._lock:
+                self._windows.pop(key, None)
+            raise
+
+    def flush(self):
+        """
+        Sends the digests of every open window, due or not.
+        """
+        self._send_due_digests(everything=True)
+
+    def close(self):
+        with self._lock:
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+        self.flush()
+        while True:
+            try:
+                server = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                server.quit()
+            except smtplib.SMTPException:
+                server.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sent": self.sent,
+                "coalesced": self.coalesced,
+                "failed": self.failed,
+            }
+
+    def _schedule_digests(self, at):
+        # called with self._lock held; one timer at a time, for the earliest window
+        if not self.digest_timer or self._timer is not None:
+            return
+        self._timer = threading.Timer(
+            max(0.0, at - self._clock()), self._send_scheduled_digests
+        )
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _send_scheduled_digests(self):
+        with self._lock:
+            self._timer = None
+        self._send_due_digests()
+        with self._lock:
+            pending = [
+                closes_at for closes_at, repeats in self._windows.values() if repeats
+            ]
+            if pending:
+                self._schedule_digests(min(pending))
+
+    def _send_due_digests(self, everything=False):
+        now = self._clock()
+        digests = []
+        with self._lock:
+            for key, (closes_at, repeats) in list(self._windows.items()):
+                if everything or closes_at <= now:
+                    del self._windows[key]
+                    if repeats:
+                        digests.append((key, repeats))
+        for key, repeats in digests:
+            destination, message = key
+            try:
+                self._sendmail(
+                    destination,
+                    f"{message}\n(repeated {repeats} more time{'s' if repeats > 1 else ''}"
+                    f" within {self.coalesce_window:g} seconds)",
+                )
+            except Exception:  # pylint: disable=broad-except
+                # a digest failing must not lose it, hold up the others or fail a send;
+                # it is tried again once another window has passed
+                logger.exception("Exception sending digest to %s", destination)
+                with self._lock:
+                    closes_at, more = self._windows.get(
+                        key, (self._clock() + self.coalesce_window, 0)
+                    )
+                    self._windows[key] = (closes_at, more + repeats)
+
+    def _sendmail(self, destination, message):
         msg = f"Subject: allocation service notification\n{message}"
-        self.server.sendmail(
+        with self._slots:
+            server = None
+            try:
+                server = self._checkout()
+                try:
+                    self._deliver(server, destination, msg)
+                except smtplib.SMTPServerDisconnected:
+                    # the server dropped an idle connection; reconnect and try once more
+                    server.close()
+                    server = self._connect()
+                    self._deliver(server, destination, msg)
+            except (smtplib.SMTPException, OSError):
+                if server is not None:
+                    server.close()
+                with self._lock:
+                    self.failed += 1
+                raise
+            self._idle.put(server)
+        with self._lock:
+            self.sent += 1
+
+    def _deliver(self, server, destination, msg):
+        server.sendmail(
             from_addr="allocations@example.com",
             to_addrs=[destination],
             msg=msg,
         )
+
+    def _checkout(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def _connect(self):
+        return self._smtp_factory(self.smtp_host, port=self.port)
+
+
+os.register_at_fork(after_in_child=reset_after_fork)
@@ -1,7 +1,18 @@
 import logging
 
 from allocation.domain import model
-from sqlalchemy import Column, Date, ForeignKey, Integer, MetaData, String, Table, event
+from sqlalchemy import (
+    Column,
+    Date,
+    Float,
+    ForeignKey,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    Text,
+    event,
+)
 from sqlalchemy.orm import registry, relationship
 
 logger = logging.getLogger(__name__)
@@ -47,13 +58,41 @@ allocations = Table(
 allocations_view = Table(
     "allocations_view",
     mapper_registry.metadata,
-    Column("orderid", String(255)),
+    Column("orderid", String(255), index=True),
     Column("sku", String(255)),
     Column("batchref", String(255)),
 )
 
+# side effects of committed events, waiting to be delivered by the outbox worker
+outbox = Table(
+    "outbox",
+    mapper_registry.metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("handler", String(255), nullable=False),
+    Column("event_type", String(255), nullable=False),
+    Column("payload", Text, nullable=False),
+    Column("attempts", Integer, nullable=False, server_default="0"),
+    Column("available_at", Float, nullable=False),
+    Column("last_error", Text, nullable=True),
+)
+
+
+# how a Product's batches and their allocations are loaded:
+# lazy - a query per collection, on first access (1 + 1 + one per batch)
+# selectin - one extra SELECT ... WHERE IN per collection, whatever the number of products
+# joined - everything in the same query as the products, with LEFT OUTER JOINs
+LOADING_STRATEGIES = {"lazy": "select", "selectin": "selectin", "joined": "joined"}
+DEFAULT_LOADING_STRATEGY = "selectin"
+
+
+def start_mappers(loading=DEFAULT_LOADING_STRATEGY):
+    if loading not in LOADING_STRATEGIES:
+        raise ValueError(
+            f"Unknown loading strategy {loading!r},"
+            f" expected one of {', '.join(LOADING_STRATEGIES)}"
+        )
+    lazy = LOADING_STRATEGIES[loading]
 
-def start_mappers():
     logger.info("Starting mappers")
     lines_mapper = mapper_registry.map_imperatively(model.OrderLine, order_lines)
     batches_mapper = mapper_registry.map_imperatively(
@@ -64,16 +103,46 @@ def start_mappers():
                 lines_mapper,
                 secondary=allocations,
                 collection_class=set,
+                lazy=lazy,
             )
         },
     )
     mapper_registry.map_imperatively(
         model.Product,
         products,
-        properties={"batches": relationship(batches_mapper)},
+        properties={"batches": relationship(batches_mapper, lazy=lazy)},
+        # the domain bumps version_number itself; every flush of a changed product
+        # then updates it WHERE version_number still has the value that was loaded,
+        # and fails with a StaleDataError when another transaction got there first
+        version_id_col=products.c.version_number,
+        version_id_generator=False,
     )
 
 
 @event.listens_for(model.Product, "load")
 def receive_load(product, _):
     product.events = []
+    product._eta_index = None
+
+
+@event.listens_for(model.Product, "refresh")
+@event.listens_for(model.Product, "expire")
+def receive_expire(product, *_):
+    # the batches may come back with other quantities, so the index is rebuilt on next
+    # use; expire also fires for instances already garbage collected, as None
+    if product is not None:
+        product._eta_index = None
+
+
+@event.listens_for(model.Batch, "load")
+def receive_batch_load(batch, _):
+    # __init__ is skipped on load, so the allocated total is counted on first use instead
+    batch._allocated_quantity = None
+
+
+@event.listens_for(model.Batch, "refresh")
+@event.listens_for(model.Batch, "expire")
+def receive_batch_expire(batch, *_):
+    # expired allocations may reload with lines another transaction added
+    if batch is not None:
+        batch._allocated_quantity = None
@@ -1,16 +1,123 @@
 import json
 import logging
+import os
+import threading
+import weakref
 from dataclasses import asdict
 
 import redis
 from allocation import config
 from allocation.domain import events
 
+# the faster codecs are optional
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 logger = logging.getLogger(__name__)
 
-r = redis.Redis(**config.get_redis_host_and_port())
+# codec name -> (encode, decode); a codec other than json is published on
+# "<channel>.<codec>", so consumers pick the encoding by the channel they subscribe to
+CODECS = {"json": (json.dumps, json.loads)}
+if orjson is not None:
+    CODECS["orjson"] = (orjson.dumps, orjson.loads)
+if msgpack is not None:
+    CODECS["msgpack"] = (msgpack.packb, msgpack.unpackb)
+
+_client = None
+_client_lock = threading.Lock()
+_publishers = weakref.WeakSet()  # type: weakref.WeakSet[RedisPublisher]
+
+
+def get_client() -> redis.Redis:
+    """
+    Returns the shared Redis client, created (with its connection pool) on first use.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            pool = redis.ConnectionPool(**config.get_redis_host_and_port())
+            _client = redis.Redis(connection_pool=pool)
+        return _client
+
+
+def reset_after_fork():
+    """
+    Drops the parent's client and whatever its publishers had buffered in a forked
+    child, which would otherwise share the parent's sockets and publish its events
+    twice; registered with os.register_at_fork below.
+    """
+    global _client, _client_lock
+    _client = None
+    _client_lock = threading.Lock()
+    for publisher in list(_publishers):
+        publisher._buffer = []
+        publisher._lock = threading.Lock()
+
+
+def channel_name(channel, codec):
+    return channel if codec == "json" else f"{channel}.{codec}"
+
+
+def decode(channel, data):
+    """
+    Decodes a message received on a channel, using the codec named by its suffix.
+    """
+    if isinstance(channel, bytes):
+        channel = channel.decode()  # redis-py delivers channel names as bytes
+    _, _, suffix = channel.rpartition(".")
+    _, loads = CODECS.get(suffix, CODECS["json"])
+    return loads(data)
 
 
 def publish(channel, event: events.Event):
     logging.info("publishing: channel=%s, event=%s", channel, event)
-    r.publish(channel, json.dumps(asdict(event)))
+    get_client().publish(channel, json.dumps(asdict(event)))
+
+
+class RedisPublisher:
+    """
+    A publish function that buffers events and sends them with a single pipelined
+    round trip on flush(), which the message bus calls once it has handled a message -
+    so allocating hundreds of lines publishes once instead of hundreds of times.
+
+    The buffer is shared, so a flush also sends whatever other threads had buffered;
+    events can go out a little early that way, but never get stuck.
+    """
+
+    def __init__(self, codec="json", client=None):
+        if codec not in CODECS:
+            raise ValueError(
+                f"Unknown or unavailable codec {codec!r}, expected one of {', '.join(CODECS)}"
+            )
+        self.codec = codec
+        self._encode, _ = CODECS[codec]
+        self._client = client
+        self._buffer = []
+        self._lock = threading.Lock()
+        _publishers.add(self)
+
+    def __call__(self, channel, event: events.Event):
+        logging.debug("buffering: channel=%s, event=%s", channel, event)
+        with self._lock:
+            self._buffer.append((channel_name(channel, self.codec), event))
+
+    def flush(self):
+        with self._lock:
+            buffer, self._buffer = self._buffer, []
+        if not buffer:
+            return
+        logging.info("publishing %s events", len(buffer))
+        pipe = (self._client or get_client()).pipeline(transaction=False)
+        for channel, event in buffer:
+            pipe.publish(channel, self._encode(asdict(event)))
+        pipe.execute()
+
+
+os.register_at_fork(after_in_child=reset_after_fork)
@@ -1,8 +1,12 @@
 import abc
-from typing import Set
+import threading
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Set
 
 from allocation.adapters import orm
 from allocation.domain import model
+from sqlalchemy import select
+from sqlalchemy.orm.util import identity_key
 
 
 class AbstractRepository(abc.ABC):
@@ -19,6 +23,11 @@ class AbstractRepository(abc.ABC):
             self.seen.add(product)
         return product
 
+    def get_many(self, skus: Iterable[str]) -> List[model.Product]:
+        products = self._get_many(list(skus))
+        self.seen.update(products)
+        return products
+
     def get_by_batchref(self, batchref) -> model.Product:
         product = self._get_by_batchref(batchref)
         if product:
@@ -33,22 +42,116 @@ class AbstractRepository(abc.ABC):
     def _get(self, sku) -> model.Product:
         raise NotImplementedError
 
+    def _get_many(self, skus: List[str]) -> List[model.Product]:
+        products = (self._get(sku) for sku in skus)
+        return [product for product in products if product]
+
     @abc.abstractmethod
     def _get_by_batchref(self, batchref) -> model.Product:
         raise NotImplementedError
 
 
+class ProductCache:
+    """
+    A process-wide LRU of Product aggregates, kept between units of work so a hot sku
+    is not reloaded with all its batches and allocations every time.
+
+    Entries are checked out by one unit of work at a time and checked back in once it
+    has finished cleanly; a repository only uses an entry whose version_number still
+    matches the database, so changes made elsewhere are never missed.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._products = OrderedDict()  # type: OrderedDict[str, model.Product]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def __len__(self):
+        return len(self._products)
+
+    def checkout(self, sku) -> Optional[model.Product]:
+        with self._lock:
+            return self._products.pop(sku, None)
+
+    def checkin(self, product: model.Product):
+        with self._lock:
+            self._products[product.sku] = product
+            self._products.move_to_end(product.sku)
+            while len(self._products) > self.maxsize:
+                self._products.popitem(last=False)
+
+    def evict(self, sku):
+        with self._lock:
+            self._products.pop(sku, None)
+
+    def clear(self):
+        with self._lock:
+            self._products.clear()
+
+    def record(self, hit=False, stale=False):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            if stale:
+                self.stale += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._products),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+            }
+
+
 class SqlAlchemyRepository(AbstractRepository):
-    def __init__(self, session):
+    def __init__(self, session, cache: Optional[ProductCache] = None):
         super().__init__()
         self.session = session
+        self.cache = cache
 
     def _add(self, product):
         self.session.add(product)
 
     def _get(self, sku):
+        if self.cache is not None:
+            product = self._get_cached(sku)
+            if product is not None:
+                return product
         return self.session.query(model.Product).filter_by(sku=sku).first()
 
+    def _get_cached(self, sku):
+        if identity_key(model.Product, sku) in self.session.identity_map:
+            return None  # already loaded in this session, which the query will return
+        product = self.cache.checkout(sku)
+        if product is None or product.events:
+            # not cached, or its events have not been collected yet by another bus
+            self.cache.record(hit=False)
+            return None
+        version = self.session.execute(
+            select(orm.products.c.version_number).where(orm.products.c.sku == sku)
+        ).scalar()
+        if version != product.version_number:
+            self.cache.record(hit=False, stale=True)
+            return None
+        self.cache.record(hit=True)
+        # re-attaches the product, with its batches and lines, without loading anything
+        self.session.add(product)
+        return product
+
+    def _get_many(self, skus):
+        if not skus:
+            return []
+        return (
+            self.session.query(model.Product).filter(orm.products.c.sku.in_(skus)).all()
+        )
+
     def _get_by_batchref(self, batchref):
         return (
             self.session.query(model.Product)
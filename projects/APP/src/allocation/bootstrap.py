@@ -1,45 +1,141 @@
+import atexit
+import functools
 import inspect
-from typing import Callable
+from typing import Callable, Union
 
 from allocation.adapters import orm, redis_eventpublisher
+from allocation.adapters.cache import AbstractCache
 from allocation.adapters.notifications import AbstractNotifications, EmailNotifications
-from allocation.service_layer import handlers, messagebus, unit_of_work
+from allocation.service_layer import handlers, messagebus, outbox, unit_of_work
 
 
 def bootstrap(
     start_orm: bool = True,
-    uow: unit_of_work.AbstractUnitOfWork = unit_of_work.SqlAlchemyUnitOfWork(),
+    uow: unit_of_work.AbstractUnitOfWork = None,
     notifications: AbstractNotifications = None,
-    publish: Callable = redis_eventpublisher.publish,
-) -> messagebus.MessageBus:
-    if notifications is None:
-        notifications = EmailNotifications()
+    publish: Callable = None,
+    cache: AbstractCache = None,
+    batch_events: bool = False,
+    async_bus: bool = False,
+    use_outbox: bool = False,
+) -> Union[messagebus.MessageBus, messagebus.AsyncMessageBus]:
+    if uow is None:
+        uow = unit_of_work.SqlAlchemyUnitOfWork()
+
+    event_handlers = handlers.EVENT_HANDLERS
+    if use_outbox:
+        # the unit of work records these side effects for the outbox worker instead
+        event_handlers = {
+            event_type: [
+                handler
+                for handler in handlers_for_type
+                if handler not in handlers.OUTBOX_HANDLERS.get(event_type, [])
+            ]
+            for event_type, handlers_for_type in event_handlers.items()
+        }
+        uow.outbox_handlers = {
+            event_type: [handler.__name__ for handler in handlers_for_type]
+            for event_type, handlers_for_type in handlers.OUTBOX_HANDLERS.items()
+        }
+    elif notifications is None:
+        notifications = default_notifications()
+
+    if publish is None:
+        publish = redis_eventpublisher.RedisPublisher()
+    # a buffering publisher sends its events once the bus is done with each message
+    flushers = [publish.flush] if hasattr(publish, "flush") else []
 
     if start_orm:
         orm.start_mappers()
 
-    dependencies = {"uow": uow, "notifications": notifications, "publish": publish}
+    dependencies = {
+        "uow": uow,
+        "notifications": notifications,
+        "publish": publish,
+        "cache": cache,
+    }
     injected_event_handlers = {
         event_type: [
-            inject_dependencies(handler, dependencies) for handler in event_handlers
+            inject_dependencies(handler, dependencies) for handler in handlers_for_type
         ]
-        for event_type, event_handlers in handlers.EVENT_HANDLERS.items()
+        for event_type, handlers_for_type in event_handlers.items()
     }
     injected_command_handlers = {
         command_type: inject_dependencies(handler, dependencies)
         for command_type, handler in handlers.COMMAND_HANDLERS.items()
     }
+    if async_bus:
+        return messagebus.AsyncMessageBus(
+            uow=uow,
+            event_handlers=injected_event_handlers,
+            command_handlers=injected_command_handlers,
+            flushers=flushers,
+        )
+
+    injected_batch_event_handlers = None
+    if batch_events:
+        injected_batch_event_handlers = {
+            event_type: [
+                inject_dependencies(
+                    handlers.BATCH_EVENT_HANDLERS[handler], dependencies
+                )
+                if handler in handlers.BATCH_EVENT_HANDLERS
+                else None
+                for handler in handlers_for_type
+            ]
+            for event_type, handlers_for_type in event_handlers.items()
+        }
 
     return messagebus.MessageBus(
         uow=uow,
         event_handlers=injected_event_handlers,
         command_handlers=injected_command_handlers,
+        batch_event_handlers=injected_batch_event_handlers,
+        flushers=flushers,
     )
 
 
+def outbox_worker(
+    session_factory=None,
+    notifications: AbstractNotifications = None,
+    publish: Callable = redis_eventpublisher.publish,
+) -> outbox.OutboxWorker:
+    if session_factory is None:
+        session_factory = unit_of_work.default_session_factory()
+    if notifications is None:
+        notifications = default_notifications()
+
+    dependencies = {"notifications": notifications, "publish": publish}
+    injected_handlers = {
+        handler.__name__: inject_dependencies(handler, dependencies)
+        for handlers_for_type in handlers.OUTBOX_HANDLERS.values()
+        for handler in handlers_for_type
+    }
+    return outbox.OutboxWorker(session_factory, injected_handlers)
+
+
+def default_notifications() -> EmailNotifications:
+    """
+    An EmailNotifications that sends its pending digests and closes its connections
+    when the process exits.
+    """
+    notifications = EmailNotifications()
+    atexit.register(notifications.close)
+    return notifications
+
+
 def inject_dependencies(handler, dependencies):
+    """
+    Binds the dependencies handler asks for with functools.partial, so calling it
+    does not build a kwargs dict per message, and copies its name and docstring
+    so profiles and logs show the handler instead of a wrapper.
+    """
     params = inspect.signature(handler).parameters
     deps = {
         name: dependency for name, dependency in dependencies.items() if name in params
     }
-    return lambda message: handler(message, **deps)
+    # a partial of an `async def` still passes asyncio.iscoroutinefunction
+    injected = functools.update_wrapper(functools.partial(handler, **deps), handler)
+    # the async bus must not run two handlers sharing the unit of work at once
+    injected.uses_uow = "uow" in deps
+    return injected
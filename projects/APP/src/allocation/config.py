@@ -21,6 +21,12 @@ def get_redis_host_and_port():
     return dict(host=host, port=port)
 
 
+def get_cache_backend():
+    # "redis" shares the read model cache between the web and consumer processes, so
+    # an invalidation in one reaches the others; "local" keeps it in each process
+    return os.environ.get("CACHE_BACKEND", "redis")
+
+
 def get_email_host_and_port():
     host = os.environ.get("EMAIL_HOST", "localhost")
     port = 11025 if host == "localhost" else 1025
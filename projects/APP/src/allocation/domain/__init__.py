@@ -1,8 +1,9 @@
 from __future__ import annotations
 
+from bisect import bisect_right
 from dataclasses import dataclass
 from datetime import date
-from typing import List, Optional, Set
+from typing import Dict, List, Optional, Set
 
 from . import commands, events
 
@@ -13,31 +14,124 @@ class Product:
         self.batches = batches
         self.version_number = version_number
         self.events = []  # type: List[events.Event]
+        self._eta_index = None  # type: Optional[EtaIndex]
+
+    def add_batch(self, batch: Batch):
+        self.batches.append(batch)
+        if self._eta_index is not None:
+            self._eta_index.add(batch)
+        self.version_number += 1
 
     def allocate(self, line: OrderLine) -> str:
-        try:
-            batch = next(b for b in sorted(self.batches) if b.can_allocate(line))
-            batch.allocate(line)
-            self.version_number += 1
-            self.events.append(
-                events.Allocated(
-                    orderid=line.orderid,
-                    sku=line.sku,
-                    qty=line.qty,
-                    batchref=batch.reference,
-                )
-            )
-            return batch.reference
-        except StopIteration:
+        index = self.eta_index
+        batch = index.first_fit(line)
+        if batch is None:
             self.events.append(events.OutOfStock(line.sku))
             return None
 
+        batch.allocate(line)
+        index.update(batch)
+        self.version_number += 1
+        self.events.append(
+            events.Allocated(
+                orderid=line.orderid,
+                sku=line.sku,
+                qty=line.qty,
+                batchref=batch.reference,
+            )
+        )
+        return batch.reference
+
     def change_batch_quantity(self, ref: str, qty: int):
         batch = next(b for b in self.batches if b.reference == ref)
         batch._purchased_quantity = qty
         while batch.available_quantity < 0:
             line = batch.deallocate_one()
             self.events.append(events.Deallocated(line.orderid, line.sku, line.qty))
+        self.eta_index.update(batch)
+        self.version_number += 1
+
+    @property
+    def eta_index(self) -> EtaIndex:
+        # built on first use (the ORM skips __init__) and rebuilt if batches was
+        # appended to directly instead of through add_batch
+        if self._eta_index is None or len(self._eta_index) != len(self.batches):
+            self._eta_index = EtaIndex(self.batches)
+        return self._eta_index
+
+
+def eta_key(batch: Batch):
+    # warehouse stock (no eta) first, then shipments soonest first
+    return (batch.eta is not None, batch.eta)
+
+
+class EtaIndex:
+    """
+    A Product's batches kept in allocation order, alongside a max-tree of their
+    available quantities, so the first batch able to take a line is found in
+    O(log n) instead of sorting and scanning every batch.
+    """
+
+    def __init__(self, batches: List[Batch]):
+        self._batches = sorted(batches, key=eta_key)
+        self._keys = [eta_key(b) for b in self._batches]
+        self._rebuild()
+
+    def __len__(self):
+        return len(self._batches)
+
+    def __iter__(self):
+        return iter(self._batches)
+
+    def add(self, batch: Batch):
+        key = eta_key(batch)
+        position = bisect_right(self._keys, key)
+        self._keys.insert(position, key)
+        self._batches.insert(position, batch)
+        self._rebuild()
+
+    def update(self, batch: Batch):
+        node = self._size + self._positions[batch.reference]
+        self._tree[node] = batch.available_quantity
+        node //= 2
+        while node:
+            self._tree[node] = max(self._tree[2 * node], self._tree[2 * node + 1])
+            node //= 2
+
+    def first_fit(self, line: OrderLine) -> Optional[Batch]:
+        position = self._first_with_capacity(line.qty, 0)
+        while position is not None:
+            batch = self._batches[position]
+            if batch.can_allocate(line):
+                return batch
+            self.update(batch)  # changed behind our back, or another sku
+            position = self._first_with_capacity(line.qty, position + 1)
+        return None
+
+    def _rebuild(self):
+        positions = enumerate(self._batches)
+        self._positions = {b.reference: p for p, b in positions}  # type: Dict[str, int]
+        self._size = 1
+        while self._size < len(self._batches):
+            self._size *= 2
+        self._tree = [float("-inf")] * (2 * self._size)
+        for position, batch in enumerate(self._batches):
+            self._tree[self._size + position] = batch.available_quantity
+        for node in range(self._size - 1, 0, -1):
+            self._tree[node] = max(self._tree[2 * node], self._tree[2 * node + 1])
+
+    def _first_with_capacity(self, qty: int, start: int, node=1, low=0, high=None):
+        if high is None:
+            high = self._size
+        if high <= start or self._tree[node] < qty:
+            return None
+        if high - low == 1:
+            return low if low < len(self._batches) else None
+        middle = (low + high) // 2
+        position = self._first_with_capacity(qty, start, 2 * node, low, middle)
+        if position is None:
+            position = self._first_with_capacity(qty, start, 2 * node + 1, middle, high)
+        return position
 
 
 @dataclass(unsafe_hash=True)
@@ -54,6 +148,7 @@ class Batch:
         self.eta = eta
         self._purchased_quantity = qty
         self._allocations = set()  # type: Set[OrderLine]
+        self._allocated_quantity = 0  # type: Optional[int]
 
     def __repr__(self):
         return f"<Batch {self.reference}>"
@@ -74,15 +169,22 @@ class Batch:
         return self.eta > other.eta
 
     def allocate(self, line: OrderLine):
-        if self.can_allocate(line):
+        if self.can_allocate(line) and line not in self._allocations:
+            self._allocated_quantity = self.allocated_quantity + line.qty
             self._allocations.add(line)
 
     def deallocate_one(self) -> OrderLine:
-        return self._allocations.pop()
+        allocated_quantity = self.allocated_quantity
+        line = self._allocations.pop()
+        self._allocated_quantity = allocated_quantity - line.qty
+        return line
 
     @property
     def allocated_quantity(self) -> int:
-        return sum(line.qty for line in self._allocations)
+        # a running total; None means it has not been counted since the batch was loaded
+        if self._allocated_quantity is None:
+            self._allocated_quantity = sum(line.qty for line in self._allocations)
+        return self._allocated_quantity
 
     @property
     def available_quantity(self) -> int:
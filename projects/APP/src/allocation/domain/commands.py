@@ -1,7 +1,7 @@
 # pylint: disable=too-few-public-methods
 from dataclasses import dataclass
 from datetime import date
-from typing import Optional
+from typing import List, Optional
 
 
 class Command:
@@ -15,6 +15,11 @@ class Allocate(Command):
     qty: int
 
 
+@dataclass
+class AllocateMany(Command):
+    lines: List[Allocate]
+
+
 @dataclass
 class CreateBatch(Command):
     ref: str
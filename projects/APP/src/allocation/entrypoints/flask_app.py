@@ -1,12 +1,38 @@
+import os
+import threading
 from datetime import datetime
 
 from allocation import bootstrap, views
+from allocation.adapters.cache import default_cache
 from allocation.domain import commands
 from allocation.service_layer.handlers import InvalidSku
 from flask import Flask, jsonify, request
 
 app = Flask(__name__)
-bus = bootstrap.bootstrap()
+cache = default_cache()
+_bus = None
+_bus_lock = threading.Lock()
+
+
+def get_bus():
+    """
+    Returns the message bus, bootstrapped by the first request instead of on import,
+    so starting a worker opens no database, SMTP or Redis connections.
+    """
+    global _bus
+    if _bus is None:
+        with _bus_lock:
+            if _bus is None:
+                _bus = bootstrap.bootstrap(cache=cache)
+    return _bus
+
+
+def _reset_after_fork():
+    global _bus_lock
+    _bus_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
 
 
 @app.route("/add_batch", methods=["POST"])
@@ -17,7 +43,7 @@ def add_batch():
     cmd = commands.CreateBatch(
         request.json["ref"], request.json["sku"], request.json["qty"], eta
     )
-    bus.handle(cmd)
+    get_bus().handle(cmd)
     return "OK", 201
 
 
@@ -27,7 +53,23 @@ def allocate_endpoint():
         cmd = commands.Allocate(
             request.json["orderid"], request.json["sku"], request.json["qty"]
         )
-        bus.handle(cmd)
+        get_bus().handle(cmd)
+    except InvalidSku as e:
+        return {"message": str(e)}, 400
+
+    return "OK", 202
+
+
+@app.route("/allocate_many", methods=["POST"])
+def allocate_many_endpoint():
+    try:
+        cmd = commands.AllocateMany(
+            [
+                commands.Allocate(line["orderid"], line["sku"], line["qty"])
+                for line in request.json["lines"]
+            ]
+        )
+        get_bus().handle(cmd)
     except InvalidSku as e:
         return {"message": str(e)}, 400
 
@@ -36,7 +78,7 @@ def allocate_endpoint():
 
 @app.route("/allocations/<orderid>", methods=["GET"])
 def allocations_view_endpoint(orderid):
-    result = views.allocations(orderid, bus.uow)
+    result = views.allocations(orderid, get_bus().uow, cache)
     if not result:
         return "not found", 404
     return jsonify(result), 200
@@ -0,0 +1,15 @@
+import logging
+
+from allocation import bootstrap
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    logger.info("Outbox worker starting")
+    worker = bootstrap.outbox_worker()
+    worker.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,42 @@
+import argparse
 import json
 import logging
+import os
+import socket
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple
 
 import redis
-from allocation import bootstrap, config
+from allocation import bootstrap, views
+from allocation.adapters import orm, redis_eventpublisher
+from allocation.adapters.cache import default_cache
 from allocation.domain import commands
+from allocation.service_layer import messagebus
 
 logger = logging.getLogger(__name__)
 
-r = redis.Redis(**config.get_redis_host_and_port())
+STREAM = "change_batch_quantity"
+CONSUMER_GROUP = "allocation"
+# messages read from the stream per XREADGROUP call
+DEFAULT_COUNT = 500
+# milliseconds XREADGROUP waits for new messages
+DEFAULT_BLOCK = 1000
+# products handled in parallel
+DEFAULT_MAX_WORKERS = 4
+# milliseconds a message stays pending before another consumer may claim it
+DEFAULT_CLAIM_IDLE = 60_000
+# deliveries after which a message that keeps failing is dead-lettered
+DEFAULT_MAX_DELIVERIES = 5
 
 
 def main():
     logger.info("Redis pubsub starting")
-    bus = bootstrap.bootstrap()
-    pubsub = r.pubsub(ignore_subscribe_messages=True)
+    # the same cache as the web app, so the read model rows this changes are dropped
+    bus = bootstrap.bootstrap(cache=default_cache())
+    pubsub = redis_eventpublisher.get_client().pubsub(ignore_subscribe_messages=True)
     pubsub.subscribe("change_batch_quantity")
 
     for m in pubsub.listen():
@@ -27,5 +50,270 @@ def handle_change_batch_quantity(m, bus):
     bus.handle(cmd)
 
 
+def main_streams(consumer: str = None):
+    logger.info("Redis streams consumer starting")
+    orm.start_mappers()  # once, for all the workers' buses
+    cache = default_cache()
+    stream_consumer = StreamConsumer(
+        redis_eventpublisher.get_client(),
+        lambda: bootstrap.bootstrap(start_orm=False, cache=cache),
+        consumer=consumer or default_consumer_name(),
+    )
+    stream_consumer.run()
+
+
+def default_consumer_name() -> str:
+    # unique per process, so no two processes read as the same group member
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class StreamConsumer:
+    """
+    Consumes ChangeBatchQuantity messages ({"batchref": ..., "qty": ...} entries added
+    with XADD) from a Redis stream as one member of a consumer group, so several
+    processes can share the load.
+
+    Each read takes up to count messages, keeps only the last quantity for each
+    batchref, and hands the products to parallel workers, each with its own bus.
+    A message is acknowledged once the change it led to has been committed, so
+    delivery is at least once: this consumer re-reads its own unacknowledged messages
+    when it starts, and every claim_idle milliseconds claims those other consumers
+    have left pending that long (say their process died).
+
+    A change is never applied after a newer one for the same batch: the id of the
+    last message applied for each batchref is kept in the "<stream>.applied" hash, and
+    older messages (such as a failed one reclaimed later) are acknowledged unapplied.
+
+    Messages that can never succeed go to the dead-letter stream ("<stream>.dead",
+    with the original id and a reason) and are acknowledged: those for a batchref
+    that does not exist, and those that have failed max_deliveries times.
+    """
+
+    def __init__(
+        self,
+        client: redis.Redis,
+        bus_factory: Callable[[], messagebus.MessageBus],
+        stream: str = STREAM,
+        group: str = CONSUMER_GROUP,
+        consumer: str = None,
+        count: int = DEFAULT_COUNT,
+        block: int = DEFAULT_BLOCK,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        claim_idle: int = DEFAULT_CLAIM_IDLE,
+        max_deliveries: int = DEFAULT_MAX_DELIVERIES,
+    ):
+        self.client = client
+        self.bus_factory = bus_factory
+        self.stream = stream
+        self.dead_letter_stream = f"{stream}.dead"
+        self.applied_key = f"{stream}.applied"
+        self.group = group
+        self.consumer = consumer or default_consumer_name()
+        self.count = count
+        self.block = block
+        self.max_workers = max_workers
+        self.claim_idle = claim_idle
+        self.max_deliveries = max_deliveries
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="stream-consumer"
+        )
+        try:
+            self.client.xgroup_create(stream, group, id="0", mkstream=True)
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def run(self, should_stop: Callable[[], bool] = None):
+        # start with whatever this consumer read before but never acknowledged
+        ids = self.consume(start="0")
+        while ids:
+            ids = self.consume(start=ids[-1])
+        next_claim = 0.0
+        while not (should_stop and should_stop()):
+            if time.monotonic() >= next_claim:
+                self.reclaim()
+                next_claim = time.monotonic() + self.claim_idle / 1000
+            self.consume()
+
+    def consume(self, start: str = ">") -> List[bytes]:
+        """
+        Reads and handles one batch of messages, returning their ids. start is ">" for
+        new messages, or an id to re-read this consumer's pending messages after it.
+        """
+        response = self.client.xreadgroup(
+            self.group,
+            self.consumer,
+            {self.stream: start},
+            count=self.count,
+            block=self.block if start == ">" else None,
+        )
+        entries = [entry for _, stream_entries in response for entry in stream_entries]
+        self._handle(entries)
+        return [entry_id for entry_id, _ in entries]
+
+    def reclaim(self) -> List[bytes]:
+        """
+        Claims the messages any consumer has left pending for claim_idle milliseconds
+        or more, and handles them, returning their ids.
+        """
+        claimed = []  # type: List[bytes]
+        start = "0-0"
+        while True:
+            response = self.client.xautoclaim(
+                self.stream,
+                self.group,
+                self.consumer,
+                self.claim_idle,
+                start_id=start,
+                count=self.count,
+            )
+            start = _text(response[0])
+            # entries deleted from the stream since they were read come back empty
+            entries = [(entry_id, fields) for entry_id, fields in response[1] if fields]
+            self._handle(entries)
+            claimed.extend(entry_id for entry_id, _ in entries)
+            if start == "0-0":
+                return claimed
+
+    def _handle(self, entries):
+        if not entries:
+            return
+
+        # ChangeBatchQuantity sets an absolute quantity, so only the last one counts
+        latest = {}  # type: Dict[str, int]
+        ids_by_batchref = defaultdict(list)  # type: Dict[str, List[bytes]]
+        fields_by_id = dict(entries)
+        for entry_id, fields in sorted(entries, key=lambda entry: _order(entry[0])):
+            batchref = _text(fields[b"batchref"])
+            latest[batchref] = int(fields[b"qty"])
+            ids_by_batchref[batchref].append(entry_id)
+
+        # a newer change has been applied since these were sent
+        refs = list(latest)
+        applied = dict(zip(refs, self.client.hmget(self.applied_key, refs)))
+        superseded = [
+            ref
+            for ref in refs
+            if applied[ref] is not None
+            and _order(ids_by_batchref[ref][-1]) <= _order(applied[ref])
+        ]
+        if superseded:
+            self.client.xack(
+                self.stream,
+                self.group,
+                *[entry_id for ref in superseded for entry_id in ids_by_batchref[ref]],
+            )
+            for ref in superseded:
+                del latest[ref]
+
+        # batches of one product must be changed in turn, different products need not
+        bus = self._bus()
+        skus = views.batch_skus(latest, bus.uow)
+        unknown = [batchref for batchref in latest if batchref not in skus]
+        if unknown:
+            self._dead_letter(
+                [entry_id for ref in unknown for entry_id in ids_by_batchref[ref]],
+                fields_by_id,
+                "unknown batchref",
+            )
+        batchrefs_by_sku = defaultdict(list)  # type: Dict[str, List[str]]
+        for batchref in latest:
+            if batchref in skus:
+                batchrefs_by_sku[skus[batchref]].append(batchref)
+
+        futures = [
+            self._executor.submit(self._handle_product, batchrefs, latest)
+            for batchrefs in batchrefs_by_sku.values()
+        ]
+        failed = []  # type: List[bytes]
+        for batchrefs, future in zip(batchrefs_by_sku.values(), futures):
+            handled = future.result()
+            ids = [entry_id for ref in handled for entry_id in ids_by_batchref[ref]]
+            if ids:
+                pipe = self.client.pipeline()
+                pipe.hset(
+                    self.applied_key,
+                    mapping={ref: ids_by_batchref[ref][-1] for ref in handled},
+                )
+                pipe.xack(self.stream, self.group, *ids)
+                pipe.execute()
+            failed.extend(
+                entry_id
+                for ref in batchrefs
+                if ref not in handled
+                for entry_id in ids_by_batchref[ref]
+            )
+        poison = [
+            entry_id
+            for entry_id in failed
+            if self._times_delivered(entry_id) >= self.max_deliveries
+        ]
+        if poison:
+            self._dead_letter(
+                poison, fields_by_id, f"failed {self.max_deliveries} times"
+            )
+
+    def _times_delivered(self, entry_id: bytes) -> int:
+        pending = self.client.xpending_range(
+            self.stream, self.group, min=entry_id, max=entry_id, count=1
+        )
+        return pending[0]["times_delivered"] if pending else 0
+
+    def _dead_letter(self, ids: List[bytes], fields_by_id, reason: str):
+        logger.error("Dead-lettering %d messages: %s", len(ids), reason)
+        pipe = self.client.pipeline()
+        for entry_id in ids:
+            pipe.xadd(
+                self.dead_letter_stream,
+                {**fields_by_id[entry_id], b"id": entry_id, b"reason": reason},
+            )
+        pipe.xack(self.stream, self.group, *ids)
+        pipe.execute()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def _handle_product(self, batchrefs: List[str], latest: Dict[str, int]):
+        bus = self._bus()
+        handled = []
+        for batchref in batchrefs:
+            cmd = commands.ChangeBatchQuantity(ref=batchref, qty=latest[batchref])
+            try:
+                bus.handle(cmd)
+            except Exception:
+                logger.exception(
+                    "Exception handling %s, leaving it unacknowledged", cmd
+                )
+                continue
+            handled.append(batchref)
+        return handled
+
+    def _bus(self) -> messagebus.MessageBus:
+        # a bus (and so a unit of work) per thread, as sessions cannot be shared
+        bus = getattr(self._local, "bus", None)
+        if bus is None:
+            bus = self._local.bus = self.bus_factory()
+        return bus
+
+
+def _order(entry_id) -> Tuple[int, int]:
+    milliseconds, sequence = _text(entry_id).split("-")
+    return int(milliseconds), int(sequence)
+
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streams", action="store_true")
+    parser.add_argument(
+        "--consumer", help="consumer group member name (default: host-pid)"
+    )
+    args = parser.parse_args()
+    if args.streams:
+        main_streams(consumer=args.consumer)
+    else:
+        main()
@@ -1,14 +1,16 @@
 # pylint: disable=unused-argument
 from __future__ import annotations
 
+from collections import defaultdict
 from dataclasses import asdict
-from typing import TYPE_CHECKING, Callable, Dict, List, Type
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Type
 
 from allocation.domain import commands, events, model
 from allocation.domain.model import OrderLine
 
 if TYPE_CHECKING:
     from allocation.adapters import notifications
+    from allocation.adapters.cache import AbstractCache
 
     from . import unit_of_work
 
@@ -26,7 +28,7 @@ def add_batch(
         if product is None:
             product = model.Product(cmd.sku, batches=[])
             uow.products.add(product)
-        product.batches.append(model.Batch(cmd.ref, cmd.sku, cmd.qty, cmd.eta))
+        product.add_batch(model.Batch(cmd.ref, cmd.sku, cmd.qty, cmd.eta))
         uow.commit()
 
 
@@ -43,6 +45,28 @@ def allocate(
         uow.commit()
 
 
+def allocate_many(
+    cmd: commands.AllocateMany,
+    uow: unit_of_work.AbstractUnitOfWork,
+):
+    lines_by_sku = defaultdict(list)  # type: Dict[str, List[OrderLine]]
+    for line in cmd.lines:
+        lines_by_sku[line.sku].append(OrderLine(line.orderid, line.sku, line.qty))
+    with uow:
+        # each product is committed on its own, without reloading the ones still to go
+        uow.keep_loaded_on_commit()
+        # load every product before allocating, so an unknown sku fails the whole
+        # command instead of leaving it half committed
+        products = {p.sku: p for p in uow.products.get_many(lines_by_sku)}
+        for sku in lines_by_sku:
+            if sku not in products:
+                raise InvalidSku(f"Invalid sku {sku}")
+        for sku, lines in lines_by_sku.items():
+            for line in lines:
+                products[sku].allocate(line)
+            uow.commit()
+
+
 def reallocate(
     event: events.Deallocated,
     uow: unit_of_work.AbstractUnitOfWork,
@@ -83,6 +107,7 @@ def publish_allocated_event(
 def add_allocation_to_read_model(
     event: events.Allocated,
     uow: unit_of_work.SqlAlchemyUnitOfWork,
+    cache: Optional[AbstractCache] = None,
 ):
     with uow:
         uow.session.execute(
@@ -93,11 +118,37 @@ def add_allocation_to_read_model(
             dict(orderid=event.orderid, sku=event.sku, batchref=event.batchref),
         )
         uow.commit()
+    if cache is not None:
+        cache.invalidate(event.orderid)
+
+
+def add_allocations_to_read_model(
+    batch: List[events.Allocated],
+    uow: unit_of_work.SqlAlchemyUnitOfWork,
+    cache: Optional[AbstractCache] = None,
+):
+    with uow:
+        # a list of parameter sets is sent as one executemany
+        uow.session.execute(
+            """
+            INSERT INTO allocations_view (orderid, sku, batchref)
+            VALUES (:orderid, :sku, :batchref)
+            """,
+            [
+                dict(orderid=event.orderid, sku=event.sku, batchref=event.batchref)
+                for event in batch
+            ],
+        )
+        uow.commit()
+    if cache is not None:
+        for orderid in {event.orderid for event in batch}:
+            cache.invalidate(orderid)
 
 
 def remove_allocation_from_read_model(
     event: events.Deallocated,
     uow: unit_of_work.SqlAlchemyUnitOfWork,
+    cache: Optional[AbstractCache] = None,
 ):
     with uow:
         uow.session.execute(
@@ -108,6 +159,8 @@ def remove_allocation_from_read_model(
             dict(orderid=event.orderid, sku=event.sku),
         )
         uow.commit()
+    if cache is not None:
+        cache.invalidate(event.orderid)
 
 
 EVENT_HANDLERS = {
@@ -116,8 +169,21 @@ EVENT_HANDLERS = {
     events.OutOfStock: [send_out_of_stock_notification],
 }  # type: Dict[Type[events.Event], List[Callable]]
 
+# the side effects that bootstrap(use_outbox=True) takes out of the request and hands
+# to the outbox worker instead
+OUTBOX_HANDLERS = {
+    events.Allocated: [publish_allocated_event],
+    events.OutOfStock: [send_out_of_stock_notification],
+}  # type: Dict[Type[events.Event], List[Callable]]
+
+# the batch-aware versions of event handlers, used when the bus batches events
+BATCH_EVENT_HANDLERS = {
+    add_allocation_to_read_model: add_allocations_to_read_model,
+}  # type: Dict[Callable, Callable]
+
 COMMAND_HANDLERS = {
     commands.Allocate: allocate,
+    commands.AllocateMany: allocate_many,
     commands.CreateBatch: add_batch,
     commands.ChangeBatchQuantity: change_batch_quantity,
 }  # type: Dict[Type[commands.Command], Callable]
@@ -1,18 +1,90 @@
 # pylint: disable=broad-except, attribute-defined-outside-init
 from __future__ import annotations
 
+import asyncio
 import logging
-from typing import TYPE_CHECKING, Callable, Dict, List, Type, Union
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Deque, Dict, List, Optional, Type, Union
 
 from allocation.domain import commands, events
 
-if TYPE_CHECKING:
-    from . import unit_of_work
+from . import unit_of_work
 
 logger = logging.getLogger(__name__)
 
 Message = Union[commands.Command, events.Event]
 
+# seconds an event handler may take before the async bus stops waiting for it
+DEFAULT_HANDLER_TIMEOUT = 10.0
+# threads the async bus runs sync handlers on
+DEFAULT_MAX_WORKERS = 8
+# times a command is tried when its unit of work keeps losing version_number races
+DEFAULT_MAX_ATTEMPTS = 5
+# seconds; the delay before retry n is drawn from [0, base_delay * 2 ** (n - 1)]
+DEFAULT_BASE_DELAY = 0.01
+DEFAULT_MAX_DELAY = 0.5
+
+
+class ConflictRetryPolicy:
+    """
+    Decides whether a command that failed with a ConcurrencyConflict is handled again,
+    and after how long: exponential backoff with full jitter, so the commands that
+    collided on a product do not collide again on their retries.
+
+    Counts commands, conflicts, retries and commands given up on; stats() reports
+    them along with the share of attempts that ended in a conflict.
+    """
+
+    def __init__(
+        self,
+        max_attempts=DEFAULT_MAX_ATTEMPTS,
+        base_delay=DEFAULT_BASE_DELAY,
+        max_delay=DEFAULT_MAX_DELAY,
+        rng=random.random,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._rng = rng
+        self._lock = threading.Lock()
+        self.commands = 0
+        self.conflicts = 0
+        self.retries = 0
+        self.gave_up = 0
+
+    def started(self):
+        with self._lock:
+            self.commands += 1
+
+    def retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        """
+        Returns the seconds to wait before trying again, or None to let error propagate.
+        """
+        if not isinstance(error, unit_of_work.ConcurrencyConflict):
+            return None
+        with self._lock:
+            self.conflicts += 1
+            if error.after_commit or attempt >= self.max_attempts:
+                self.gave_up += 1
+                return None
+            self.retries += 1
+        return self._rng() * min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+
+    def stats(self):
+        with self._lock:
+            attempts = self.commands + self.retries
+            return {
+                "commands": self.commands,
+                "conflicts": self.conflicts,
+                "retries": self.retries,
+                "gave_up": self.gave_up,
+                "conflict_rate": self.conflicts / attempts if attempts else 0.0,
+            }
+
 
 class MessageBus:
     def __init__(
@@ -20,38 +92,294 @@ class MessageBus:
         uow: unit_of_work.AbstractUnitOfWork,
         event_handlers: Dict[Type[events.Event], List[Callable]],
         command_handlers: Dict[Type[commands.Command], Callable],
+        batch_event_handlers: Optional[
+            Dict[Type[events.Event], List[Optional[Callable]]]
+        ] = None,
+        flushers: Optional[List[Callable[[], None]]] = None,
+        retry_policy: Optional[ConflictRetryPolicy] = None,
+        sleep: Callable[[float], None] = time.sleep,
     ):
         self.uow = uow
         self.event_handlers = event_handlers
         self.command_handlers = command_handlers
+        self.retry_policy = retry_policy or ConflictRetryPolicy()
+        self._sleep = sleep
+        # when given, consecutive events of the same type are handled together:
+        # batch_event_handlers[event_type][i] takes the whole list of events in place
+        # of event_handlers[event_type][i], or is None to call that handler per event
+        self.batch_event_handlers = batch_event_handlers
+        # called once a message and everything it led to has been handled, e.g. to
+        # send the events a RedisPublisher buffered
+        self.flushers = flushers or []
+        # message type -> the method handling it, filled in as types are first seen
+        self._dispatch = (
+            {}
+        )  # type: Dict[type, Callable[[Message, Deque[Message]], None]]
 
     def handle(self, message: Message):
-        self.queue = [message]
-        while self.queue:
-            message = self.queue.pop(0)
-            if isinstance(message, events.Event):
-                self.handle_event(message)
-            elif isinstance(message, commands.Command):
-                self.handle_command(message)
-            else:
-                raise Exception(f"{message} was not an Event or Command")
+        # each call gets its own queue, so concurrent calls do not share messages
+        queue = deque([message])  # type: Deque[Message]
+        try:
+            while queue:
+                message = queue.popleft()
+                self._dispatcher(message)(message, queue)
+        finally:
+            self.flush()
 
-    def handle_event(self, event: events.Event):
-        for handler in self.event_handlers[type(event)]:
+    def _dispatcher(self, message: Message):
+        try:
+            return self._dispatch[type(message)]
+        except KeyError:
+            dispatcher = _find_dispatcher(
+                message,
+                event=self._dispatch_event,
+                command=self.handle_command,
+            )
+            self._dispatch[type(message)] = dispatcher
+            return dispatcher
+
+    def _dispatch_event(self, event: events.Event, queue: Deque[Message]):
+        if self.batch_event_handlers is None:
+            self.handle_event(event, queue)
+        else:
+            batch = [event]
+            while queue and type(queue[0]) is type(event):
+                batch.append(queue.popleft())
+            self.handle_events(batch, queue)
+
+    def flush(self):
+        for flush in self.flushers:
             try:
-                logger.debug("handling event %s with handler %s", event, handler)
-                handler(event)
-                self.queue.extend(self.uow.collect_new_events())
+                flush()
             except Exception:
-                logger.exception("Exception handling event %s", event)
-                continue
+                logger.exception("Exception flushing %s", flush)
+
+    def handle_event(self, event: events.Event, queue: Deque[Message]):
+        for handler in self.event_handlers[type(event)]:
+            self._call_event_handler(handler, event, queue)
+
+    def handle_events(self, batch: List[events.Event], queue: Deque[Message]):
+        handlers = self.event_handlers[type(batch[0])]
+        batch_handlers = self.batch_event_handlers.get(type(batch[0]), [])
+        for i, handler in enumerate(handlers):
+            batch_handler = batch_handlers[i] if i < len(batch_handlers) else None
+            if batch_handler is not None:
+                self._call_event_handler(batch_handler, batch, queue)
+            else:
+                for event in batch:
+                    self._call_event_handler(handler, event, queue)
+
+    def _call_event_handler(self, handler, event, queue: Deque[Message]):
+        try:
+            logger.debug("handling event %s with handler %s", event, handler)
+            handler(event)
+            queue.extend(self.uow.collect_new_events())
+        except Exception:
+            logger.exception("Exception handling event %s", event)
 
-    def handle_command(self, command: commands.Command):
+    def handle_command(self, command: commands.Command, queue: Deque[Message]):
         logger.debug("handling command %s", command)
+        self.retry_policy.started()
+        attempt = 1
+        while True:
+            try:
+                handler = self.command_handlers[type(command)]
+                handler(command)
+                queue.extend(self.uow.collect_new_events())
+                return
+            except Exception as e:
+                delay = self.retry_policy.retry_delay(e, attempt)
+                if delay is None:
+                    logger.exception("Exception handling command %s", command)
+                    if _committed_before_failing(e):
+                        self._handle_committed_events(
+                            list(self.uow.collect_new_events())
+                        )
+                    raise
+                logger.info("Retrying command %s in %.3fs after %s", command, delay, e)
+                self._sleep(delay)
+                attempt += 1
+
+    def _handle_committed_events(self, committed: List[events.Event]):
+        # the command failed part way, but what it did commit still needs its events
+        # handled, or the read model and the other services never hear of it
+        queue = deque(committed)  # type: Deque[Message]
+        while queue:
+            message = queue.popleft()
+            self._dispatcher(message)(message, queue)
+
+
+class AsyncMessageBus:
+    """
+    A MessageBus for asyncio: handlers may be `async def` or plain functions, which
+    run on a thread pool so they do not block the event loop.
+
+    Commands are handled strictly one after the other, but the handlers of an event
+    run concurrently, each with a timeout - so publishing an Allocated event to Redis
+    no longer waits on the read model insert, and a slow mail server only delays its
+    own handler. Handlers marked uses_uow (see bootstrap.inject_dependencies) share
+    the one unit of work, so those still take turns.
+    """
+
+    def __init__(
+        self,
+        uow: unit_of_work.AbstractUnitOfWork,
+        event_handlers: Dict[Type[events.Event], List[Callable]],
+        command_handlers: Dict[Type[commands.Command], Callable],
+        handler_timeout: float = DEFAULT_HANDLER_TIMEOUT,
+        executor: Optional[ThreadPoolExecutor] = None,
+        flushers: Optional[List[Callable[[], None]]] = None,
+        retry_policy: Optional[ConflictRetryPolicy] = None,
+    ):
+        self.uow = uow
+        self.event_handlers = event_handlers
+        self.command_handlers = command_handlers
+        self.retry_policy = retry_policy or ConflictRetryPolicy()
+        self.handler_timeout = handler_timeout
+        self.executor = executor or ThreadPoolExecutor(
+            max_workers=DEFAULT_MAX_WORKERS, thread_name_prefix="messagebus"
+        )
+        self.flushers = flushers or []
+        self._dispatch = {}  # type: Dict[type, Callable]
+
+    async def handle(self, message: Message):
+        queue = deque([message])  # type: Deque[Message]
+        try:
+            while queue:
+                message = queue.popleft()
+                await self._dispatcher(message)(message, queue)
+        finally:
+            loop = asyncio.get_running_loop()
+            for flush in self.flushers:
+                try:
+                    await loop.run_in_executor(self.executor, flush)
+                except Exception:
+                    logger.exception("Exception flushing %s", flush)
+
+    def _dispatcher(self, message: Message):
         try:
-            handler = self.command_handlers[type(command)]
-            handler(command)
-            self.queue.extend(self.uow.collect_new_events())
+            return self._dispatch[type(message)]
+        except KeyError:
+            dispatcher = _find_dispatcher(
+                message, event=self.handle_event, command=self.handle_command
+            )
+            self._dispatch[type(message)] = dispatcher
+            return dispatcher
+
+    async def handle_event(self, event: events.Event, queue: Deque[Message]):
+        uow_lock = asyncio.Lock()
+        results = await asyncio.gather(
+            *(
+                self._call_event_handler(handler, event, uow_lock)
+                for handler in self.event_handlers[type(event)]
+            )
+        )
+        for new_events in results:
+            queue.extend(new_events)
+
+    async def _call_event_handler(self, handler, event, uow_lock: asyncio.Lock):
+        logger.debug("handling event %s with handler %s", event, handler)
+        if getattr(handler, "uses_uow", False):
+            call = self._call_with_lock(handler, event, uow_lock)
+        else:
+            call = self._call(handler, event)
+        # a handler running on a thread cannot be interrupted, so a timeout only stops
+        # waiting for it; shielding it keeps the uow lock held until it really finishes
+        task = asyncio.ensure_future(call)
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), self.handler_timeout)
+        except asyncio.TimeoutError:
+            logger.error(
+                "Timed out after %ss handling event %s with handler %s",
+                self.handler_timeout,
+                event,
+                handler,
+            )
+            # whatever events it raises once it does finish are not handled
+            task.add_done_callback(_log_late_failure)
         except Exception:
-            logger.exception("Exception handling command %s", command)
+            logger.exception("Exception handling event %s", event)
+        return []
+
+    async def _call_with_lock(self, handler, message: Message, lock: asyncio.Lock):
+        async with lock:
+            return await self._call(handler, message)
+
+    async def handle_command(self, command: commands.Command, queue: Deque[Message]):
+        logger.debug("handling command %s", command)
+        self.retry_policy.started()
+        attempt = 1
+        while True:
+            try:
+                handler = self.command_handlers[type(command)]
+                queue.extend(await self._call(handler, command))
+                return
+            except Exception as e:
+                delay = self.retry_policy.retry_delay(e, attempt)
+                if delay is None:
+                    logger.exception("Exception handling command %s", command)
+                    if _committed_before_failing(e):
+                        # see MessageBus._handle_committed_events
+                        committed = deque(e.events)  # type: Deque[Message]
+                        while committed:
+                            message = committed.popleft()
+                            await self._dispatcher(message)(message, committed)
+                    raise
+                logger.info("Retrying command %s in %.3fs after %s", command, delay, e)
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def _call(self, handler, message: Message) -> List[events.Event]:
+        """
+        Runs a handler and returns the events it raised, collected on the thread that ran
+        it - the unit of work keeps what a `with uow:` block loaded per thread.
+        """
+        if asyncio.iscoroutinefunction(handler):
+            try:
+                await handler(message)
+            except Exception as e:
+                self._keep_committed_events(e)
+                raise
+            return list(self.uow.collect_new_events())
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, self._call_sync, handler, message
+        )
+
+    def _call_sync(self, handler, message: Message) -> List[events.Event]:
+        try:
+            handler(message)
+        except Exception as e:
+            self._keep_committed_events(e)
             raise
+        return list(self.uow.collect_new_events())
+
+    def _keep_committed_events(self, error: Exception):
+        # collected here, on the thread that ran the handler, for handle_command
+        if _committed_before_failing(error):
+            error.events = list(self.uow.collect_new_events())
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+def _find_dispatcher(message: Message, event: Callable, command: Callable):
+    """
+    Picks the dispatcher for a message type the bus has not seen before, by walking
+    its MRO; the bus caches the result, so later messages need a single dict lookup.
+    """
+    for base in type(message).__mro__:
+        if base is events.Event:
+            return event
+        if base is commands.Command:
+            return command
+    raise Exception(f"{message} was not an Event or Command")
+
+
+def _committed_before_failing(error: Exception) -> bool:
+    return isinstance(error, unit_of_work.ConcurrencyConflict) and error.after_commit
+
+
+def _log_late_failure(task: asyncio.Future):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Handler failed after timing out", exc_info=task.exception())
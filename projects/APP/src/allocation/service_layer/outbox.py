@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import json
+import logging
+import time
+from typing import Callable, Dict, Optional
+
+from allocation.adapters import orm
+from allocation.domain import events
+from sqlalchemy import select
+
+logger = logging.getLogger(__name__)
+
+# messages taken from the outbox per transaction
+DEFAULT_BATCH_SIZE = 100
+# deliveries tried before a message is left in the outbox for someone to look at
+DEFAULT_MAX_ATTEMPTS = 5
+# seconds before the first retry; doubled for every attempt after that
+DEFAULT_RETRY_DELAY = 1.0
+# seconds to wait before looking again when the outbox is empty
+DEFAULT_POLL_INTERVAL = 1.0
+
+
+class OutboxWorker:
+    """
+    Delivers the side effects the unit of work recorded in the outbox table, such as
+    out of stock emails and published events, away from the request that caused them.
+
+    Messages are taken in batches and deleted once delivered. A failed delivery is
+    retried with exponential backoff, up to max_attempts. Delivery is at least once:
+    a message whose handler succeeded may be delivered again if the worker dies
+    before committing the batch.
+    """
+
+    def __init__(
+        self,
+        session_factory,
+        handlers: Dict[str, Callable[[events.Event], None]],
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        retry_delay: float = DEFAULT_RETRY_DELAY,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        clock: Callable[[], float] = time.time,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.session_factory = session_factory
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self._clock = clock
+        self._sleep = sleep
+
+    def drain_once(self) -> int:
+        """
+        Delivers one batch of due messages, returning how many were taken.
+        """
+        outbox = orm.outbox
+        session = self.session_factory()
+        try:
+            rows = session.execute(
+                select(outbox)
+                .where(outbox.c.attempts < self.max_attempts)
+                .where(outbox.c.available_at <= self._clock())
+                .order_by(outbox.c.id)
+                .limit(self.batch_size)
+            ).fetchall()
+
+            delivered, failed = [], []
+            for row in rows:
+                try:
+                    self._deliver(row)
+                    delivered.append(row.id)
+                except Exception as e:
+                    logger.exception("Exception delivering outbox message %s", row.id)
+                    failed.append(
+                        dict(
+                            row_id=row.id,
+                            attempts=row.attempts + 1,
+                            available_at=self._clock()
+                            + self.retry_delay * 2**row.attempts,
+                            last_error=repr(e),
+                        )
+                    )
+
+            if delivered:
+                session.execute(outbox.delete().where(outbox.c.id.in_(delivered)))
+            for failure in failed:
+                session.execute(
+                    outbox.update()
+                    .where(outbox.c.id == failure.pop("row_id"))
+                    .values(**failure)
+                )
+            session.commit()
+            return len(rows)
+        finally:
+            session.close()
+
+    def run(self, should_stop: Optional[Callable[[], bool]] = None):
+        while not (should_stop and should_stop()):
+            if not self.drain_once():
+                self._sleep(self.poll_interval)
+
+    def _deliver(self, row):
+        event_type = getattr(events, row.event_type)
+        event = event_type(**json.loads(row.payload))
+        handler = self.handlers[row.handler]
+        logger.debug("delivering event %s with handler %s", event, row.handler)
+        handler(event)
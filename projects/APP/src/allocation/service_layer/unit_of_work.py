@@ -2,16 +2,43 @@
 from __future__ import annotations
 
 import abc
+import json
+import os
+import threading
+import time
+from dataclasses import asdict
+from typing import Dict, List, Optional, Type
 
 from allocation import config
-from allocation.adapters import repository
-from sqlalchemy import create_engine
+from allocation.adapters import orm, repository
+from allocation.domain import events, model
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm.exc import StaleDataError
 from sqlalchemy.orm.session import Session
 
 
+class ConcurrencyConflict(Exception):
+    """
+    Raised on commit when a product was changed by another transaction since it was
+    loaded; the message bus handles the command again from scratch.
+
+    after_commit is set when the unit of work had already committed other changes, which
+    running the handler again would repeat - so those conflicts are not retried.
+    """
+
+    def __init__(self, skus, after_commit=False):
+        super().__init__(f"Products {', '.join(skus)} were changed concurrently")
+        self.skus = skus
+        self.after_commit = after_commit
+        # filled in by the bus: the events of what was committed before the conflict
+        self.events = []  # type: List[events.Event]
+
+
 class AbstractUnitOfWork(abc.ABC):
     products: repository.AbstractRepository
+    # the names of the handlers each event type is delivered to through the outbox
+    outbox_handlers = {}  # type: Dict[Type[events.Event], List[str]]
 
     def __enter__(self) -> AbstractUnitOfWork:
         return self
@@ -22,6 +49,12 @@ class AbstractUnitOfWork(abc.ABC):
     def commit(self):
         self._commit()
 
+    def keep_loaded_on_commit(self):
+        """
+        Stops the commits in this `with uow:` block from expiring what it has loaded,
+        for handlers that commit several times and would otherwise load it again.
+        """
+
     def collect_new_events(self):
         for product in self.products.seen:
             while product.events:
@@ -36,32 +69,166 @@ class AbstractUnitOfWork(abc.ABC):
         raise NotImplementedError
 
 
-DEFAULT_SESSION_FACTORY = sessionmaker(
-    bind=create_engine(
-        # substituting POSTGRES with the in-memory sqlite
-        # config.get_postgres_uri(),
-        "sqlite+pysqlite:///:memory:",
-        echo=True,
-        isolation_level="REPEATABLE READ",
-    )
-)
+_session_factory = None  # type: Optional[sessionmaker]
+_session_factory_lock = threading.Lock()
+
+
+def default_session_factory() -> sessionmaker:
+    """
+    Returns the session factory for the default database, whose engine is created on
+    first use rather than when this module is imported.
+    """
+    global _session_factory
+    with _session_factory_lock:
+        if _session_factory is None:
+            _session_factory = sessionmaker(
+                bind=create_engine(
+                    # substituting POSTGRES with the in-memory sqlite
+                    # config.get_postgres_uri(),
+                    "sqlite+pysqlite:///:memory:",
+                    echo=True,
+                )
+            )
+        return _session_factory
+
+
+def reset_after_fork():
+    """
+    Makes a forked child open its own database connections instead of sharing the
+    parent's; registered with os.register_at_fork below.
+    """
+    global _session_factory_lock
+    _session_factory_lock = threading.Lock()
+    if _session_factory is not None:
+        # close=False leaves the parent's connections alone, just forgets them here
+        _session_factory.kw["bind"].dispose(close=False)
+
+
+os.register_at_fork(after_in_child=reset_after_fork)
+
+
+def _thread_local(name):
+    """
+    An attribute whose value is kept per thread, in the instance's _local.
+    """
+
+    def get(self):
+        try:
+            return getattr(self._local, name)
+        except AttributeError:
+            raise AttributeError(name) from None
+
+    def set(self, value):
+        setattr(self._local, name, value)
+
+    return property(get, set)
 
 
 class SqlAlchemyUnitOfWork(AbstractUnitOfWork):
-    def __init__(self, session_factory=DEFAULT_SESSION_FACTORY):
+    """
+    The one unit of work bootstrap injects into every handler. What a `with uow:` block
+    sets up is kept per thread, so threads handling messages through the same bus each
+    get their own session, repository and events.
+    """
+
+    session = _thread_local("session")  # type: Session
+    products = _thread_local("products")  # type: repository.SqlAlchemyRepository
+    _outboxed = _thread_local("_outboxed")
+    _commits = _thread_local("_commits")
+    _committed_events = _thread_local("_committed_events")
+    _unsaved = _thread_local("_unsaved")
+
+    def __init__(
+        self,
+        session_factory: Optional[sessionmaker] = None,
+        product_cache: Optional[repository.ProductCache] = None,
+    ):
         self.session_factory = session_factory
+        self.product_cache = product_cache
+        self._local = threading.local()
 
     def __enter__(self):
-        self.session = self.session_factory()  # type: Session
-        self.products = repository.SqlAlchemyRepository(self.session)
+        if self.session_factory is None:
+            self.session_factory = default_session_factory()
+        if self.product_cache is None:
+            self.session = self.session_factory()
+        else:
+            # cached products must keep their state once committed and detached
+            self.session = self.session_factory(expire_on_commit=False)
+            self._unsaved = False
+            event.listen(self.session, "after_flush", self._after_flush)
+            event.listen(self.session, "after_commit", self._after_commit)
+        self.products = repository.SqlAlchemyRepository(
+            self.session, cache=self.product_cache
+        )
+        self._outboxed = {}  # type: Dict[model.Product, int]
+        self._commits = 0
+        self._committed_events = {}  # type: Dict[model.Product, int]
         return super().__enter__()
 
     def __exit__(self, *args):
+        if self.product_cache is not None and not self._has_unsaved_changes():
+            # closing without a rollback detaches the products without expiring them,
+            # so they can be handed to the next unit of work as they are
+            self.session.close()
+            for product in self.products.seen:
+                self.product_cache.checkin(product)
+            return
+        # rolled back products are expired, so they are left out of the cache
         super().__exit__(*args)
         self.session.close()
 
+    def _has_unsaved_changes(self):
+        session = self.session
+        return bool(self._unsaved or session.new or session.dirty or session.deleted)
+
+    def _after_flush(self, *_):
+        self._unsaved = True
+
+    def _after_commit(self, _):
+        self._unsaved = False
+
+    def keep_loaded_on_commit(self):
+        # a product changed elsewhere meanwhile still fails its version check on commit
+        self.session.expire_on_commit = False
+
     def _commit(self):
-        self.session.commit()
+        self._write_outbox()
+        try:
+            self.session.commit()
+        except StaleDataError as e:
+            self.session.rollback()
+            # the events of the changes just rolled back never happened
+            for product in self.products.seen:
+                del product.events[self._committed_events.get(product, 0) :]
+            skus = sorted(product.sku for product in self.products.seen)
+            raise ConcurrencyConflict(skus, after_commit=self._commits > 0) from e
+        self._commits += 1
+        for product in self.products.seen:
+            self._committed_events[product] = len(product.events)
+
+    def _write_outbox(self):
+        """
+        Adds a row to the outbox for every new event that has outbox handlers, so the
+        side effects are recorded in the same transaction as the change that caused them.
+        """
+        rows = []
+        for product in self.products.seen:
+            # a unit of work may commit several times before the bus collects the events
+            written = self._outboxed.get(product, 0)
+            for event in product.events[written:]:
+                for handler in self.outbox_handlers.get(type(event), []):
+                    rows.append(
+                        dict(
+                            handler=handler,
+                            event_type=type(event).__name__,
+                            payload=json.dumps(asdict(event)),
+                            available_at=time.time(),
+                        )
+                    )
+            self._outboxed[product] = len(product.events)
+        if rows:
+            self.session.execute(orm.outbox.insert(), rows)
 
     def rollback(self):
         self.session.rollback()
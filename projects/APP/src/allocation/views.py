@@ -1,7 +1,23 @@
+from typing import Dict, Iterable, Optional
+
+from allocation.adapters.cache import AbstractCache
 from allocation.service_layer import unit_of_work
 
 
-def allocations(orderid: str, uow: unit_of_work.SqlAlchemyUnitOfWork):
+def allocations(
+    orderid: str,
+    uow: unit_of_work.SqlAlchemyUnitOfWork,
+    cache: Optional[AbstractCache] = None,
+):
+    # the read model handlers invalidate an order's entry whenever it changes
+    generation = None
+    if cache is not None:
+        cached = cache.get(orderid)
+        if cached is not None:
+            return cached
+        # taken before reading, so rows an invalidation overtakes are not cached
+        generation = cache.generation(orderid)
+
     with uow:
         results = uow.session.execute(
             """
@@ -9,4 +25,25 @@ def allocations(orderid: str, uow: unit_of_work.SqlAlchemyUnitOfWork):
             """,
             dict(orderid=orderid),
         )
-    return [dict(r) for r in results]
+    results = [dict(r) for r in results]
+    if cache is not None:
+        cache.set(orderid, results, generation=generation)
+    return results
+
+
+def batch_skus(
+    batchrefs: Iterable[str], uow: unit_of_work.SqlAlchemyUnitOfWork
+) -> Dict[str, str]:
+    """
+    Maps each of the batchrefs that exists to the sku of its product.
+    """
+    batchrefs = list(batchrefs)
+    if not batchrefs:
+        return {}
+    placeholders = ", ".join(f":ref{i}" for i in range(len(batchrefs)))
+    with uow:
+        results = uow.session.execute(
+            f"SELECT reference, sku FROM batches WHERE reference IN ({placeholders})",
+            {f"ref{i}": ref for i, ref in enumerate(batchrefs)},
+        )
+        return dict(results.fetchall())
@@ -2,6 +2,7 @@
 import shutil
 import subprocess
 import time
+from contextlib import contextmanager
 from pathlib import Path
 
 import pytest
@@ -9,7 +10,7 @@ import redis
 import requests
 from allocation import config
 from allocation.adapters.orm import mapper_registry, start_mappers
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import clear_mappers, sessionmaker
 from tenacity import retry, stop_after_delay
 
@@ -35,6 +36,29 @@ def mappers():
     clear_mappers()
 
 
+@pytest.fixture
+def assert_num_queries(in_memory_sqlite_db):
+    """
+    with assert_num_queries(3): ... fails unless exactly 3 statements reach the database
+    """
+
+    @contextmanager
+    def assert_num_queries(expected, engine=in_memory_sqlite_db):
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+        assert len(statements) == expected, "\n\n".join(statements)
+
+    return assert_num_queries
+
+
 @retry(stop=stop_after_delay(10))
 def wait_for_postgres_to_come_up(engine):
     return engine.connect()
@@ -40,3 +40,23 @@ def test_unhappy_path_returns_400_and_error_message():
 
     r = api_client.get_allocation(orderid)
     assert r.status_code == 404
+
+
+@pytest.mark.usefixtures("in_memory_sqlite_db")
+@pytest.mark.usefixtures("restart_api")
+def test_allocate_many_allocates_every_line():
+    orderid = random_orderid()
+    sku, othersku = random_sku(), random_sku("other")
+    batch, otherbatch = random_batchref(1), random_batchref(2)
+    api_client.post_to_add_batch(batch, sku, 100, None)
+    api_client.post_to_add_batch(otherbatch, othersku, 100, None)
+
+    r = api_client.post_to_allocate_many([(orderid, sku, 3), (orderid, othersku, 4)])
+    assert r.status_code == 202
+
+    r = api_client.get_allocation(orderid)
+    assert r.ok
+    assert sorted(r.json(), key=lambda row: row["batchref"]) == [
+        {"sku": sku, "batchref": batch},
+        {"sku": othersku, "batchref": otherbatch},
+    ]
@@ -0,0 +1,86 @@
+import fakeredis
+import pytest
+from allocation.adapters.cache import LocalCache, RedisCache, default_cache
+
+
+def test_local_cache_expires_entries():
+    now = [0.0]
+    cache = LocalCache(ttl=10, clock=lambda: now[0])
+    cache.set("o1", [{"sku": "sku1", "batchref": "b1"}])
+
+    now[0] += 9
+    assert cache.get("o1") == [{"sku": "sku1", "batchref": "b1"}]
+    now[0] += 1
+    assert cache.get("o1") is None
+
+
+def test_local_cache_drops_the_least_recently_used_entry():
+    cache = LocalCache(maxsize=2)
+    cache.set("o1", [])
+    cache.set("o2", [])
+    cache.get("o1")
+
+    cache.set("o3", [])
+
+    assert cache.get("o2") is None
+    assert cache.get("o1") == [] and cache.get("o3") == []
+
+
+def test_redis_cache_is_shared_between_instances():
+    client = fakeredis.FakeRedis()
+    writer, reader = RedisCache(client=client), RedisCache(client=client)
+
+    writer.set("o1", [{"sku": "sku1", "batchref": "b1"}])
+    assert reader.get("o1") == [{"sku": "sku1", "batchref": "b1"}]
+
+    writer.invalidate("o1")
+    assert reader.get("o1") is None
+
+
+def test_local_cache_does_not_store_values_read_before_an_invalidation():
+    cache = LocalCache(maxsize=2)
+    generation = cache.generation("o1")
+
+    cache.invalidate("o1")
+
+    assert not cache.set("o1", [], generation=generation)
+    assert cache.get("o1") is None
+    assert cache.set("o1", [], generation=cache.generation("o1"))
+    assert cache.get("o1") == []
+
+
+def test_local_cache_stays_careful_about_invalidations_it_forgot():
+    cache = LocalCache(maxsize=1)
+    generation = cache.generation("o1")
+
+    cache.invalidate("o1")
+    cache.invalidate("o2")  # pushes o1 out of the invalidations kept
+
+    assert not cache.set("o1", [], generation=generation)
+
+
+def test_redis_cache_does_not_store_values_read_before_an_invalidation():
+    client = fakeredis.FakeRedis()
+    reader, writer = RedisCache(client=client), RedisCache(client=client)
+    generation = reader.generation("o1")
+
+    writer.invalidate("o1")
+
+    assert not reader.set("o1", [], generation=generation)
+    assert reader.get("o1") is None
+    assert reader.set("o1", [], generation=reader.generation("o1"))
+    assert writer.get("o1") == []
+
+
+def test_default_cache_is_shared_through_redis_unless_configured_otherwise(
+    monkeypatch,
+):
+    monkeypatch.delenv("CACHE_BACKEND", raising=False)
+    assert isinstance(default_cache(), RedisCache)
+
+    monkeypatch.setenv("CACHE_BACKEND", "local")
+    assert isinstance(default_cache(), LocalCache)
+
+    monkeypatch.setenv("CACHE_BACKEND", "memcached")
+    with pytest.raises(ValueError, match="Unknown cache backend"):
+        default_cache()
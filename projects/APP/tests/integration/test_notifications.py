@@ -0,0 +1,190 @@
+# the SMTP server is faked, so these run without mailhog (see test_email.py)
+import os
+import smtplib
+import time
+
+import pytest
+from allocation.adapters import notifications
+
+
+class FakeSMTP:
+    connections = []
+    refused = set()
+
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.messages = []
+        self.drop_next = False
+        self.closed = False
+        FakeSMTP.connections.append(self)
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        if self.drop_next:
+            self.drop_next = False
+            raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+        if FakeSMTP.refused.intersection(to_addrs):
+            raise smtplib.SMTPRecipientsRefused(
+                {to: (550, b"Mailbox unavailable") for to in to_addrs}
+            )
+        self.messages.append((to_addrs, msg))
+
+    def close(self):
+        self.closed = True
+
+    def quit(self):
+        self.closed = True
+
+
+@pytest.fixture
+def clock():
+    return [0.0]
+
+
+@pytest.fixture
+def email(clock):
+    FakeSMTP.connections = []
+    FakeSMTP.refused = set()
+    return notifications.EmailNotifications(
+        "smtp.example.com",
+        25,
+        coalesce_window=60,
+        smtp_factory=FakeSMTP,
+        clock=lambda: clock[0],
+        digest_timer=False,
+    )
+
+
+def sent_messages():
+    return [msg for server in FakeSMTP.connections for _, msg in server.messages]
+
+
+def test_connects_lazily_and_reuses_the_connection(email):
+    assert FakeSMTP.connections == []
+
+    email.send("stock@made.com", "Out of stock for RED-CHAIR")
+    email.send("stock@made.com", "Out of stock for BLUE-CHAIR")
+
+    [server] = FakeSMTP.connections
+    assert (server.host, server.port) == ("smtp.example.com", 25)
+    assert len(server.messages) == 2
+    assert email.stats() == {"sent": 2, "coalesced": 0, "failed": 0}
+
+
+def test_reconnects_when_the_server_hung_up(email):
+    email.send("stock@made.com", "Out of stock for RED-CHAIR")
+    [first] = FakeSMTP.connections
+    first.drop_next = True
+
+    email.send("stock@made.com", "Out of stock for BLUE-CHAIR")
+
+    assert first.closed
+    [_, second] = FakeSMTP.connections
+    assert second.messages == [
+        (
+            ["stock@made.com"],
+            "Subject: allocation service notification\nOut of stock for BLUE-CHAIR",
+        )
+    ]
+    assert email.stats()["sent"] == 2
+
+
+def test_coalesces_repeats_into_one_digest(email, clock):
+    for _ in range(4):
+        email.send("stock@made.com", "Out of stock for RED-CHAIR")
+    assert len(sent_messages()) == 1
+
+    clock[0] += 61
+    email.send("stock@made.com", "Out of stock for BLUE-CHAIR")
+
+    assert sent_messages()[1:] == [
+        "Subject: allocation service notification\nOut of stock for RED-CHAIR"
+        "\n(repeated 3 more times within 60 seconds)",
+        "Subject: allocation service notification\nOut of stock for BLUE-CHAIR",
+    ]
+    assert email.stats() == {"sent": 3, "coalesced": 3, "failed": 0}
+
+
+def test_flush_sends_open_digests(email):
+    email.send("stock@made.com", "Out of stock for RED-CHAIR")
+    email.send("stock@made.com", "Out of stock for RED-CHAIR")
+
+    email.flush()
+
+    assert sent_messages()[-1].endswith("(repeated 1 more time within 60 seconds)")
+
+
+def test_keeps_a_failed_digest_without_failing_the_next_send(email, clock):
+    email.send("stock@made.com", "Out of stock for RED-CHAIR")
+    email.send("stock@made.com", "Out of stock for RED-CHAIR")
+    FakeSMTP.refused.add("stock@made.com")
+    clock[0] += 61
+
+    email.send("buyers@made.com", "Out of stock for BLUE-CHAIR")
+
+    assert sent_messages()[-1].endswith("Out of stock for BLUE-CHAIR")
+    FakeSMTP.refused.clear()
+    clock[0] += 61
+    email.send("buyers@made.com", "Out of stock for GREEN-CHAIR")
+    assert any(
+        message.endswith("RED-CHAIR\n(repeated 1 more time within 60 seconds)")
+        for message in sent_messages()
+    )
+    assert email.stats() == {"sent": 4, "coalesced": 1, "failed": 1}
+
+
+def test_close_sends_open_digests_and_hangs_up(email):
+    email.send("stock@made.com", "Out of stock for RED-CHAIR")
+    email.send("stock@made.com", "Out of stock for RED-CHAIR")
+
+    email.close()
+
+    assert sent_messages()[-1].endswith("(repeated 1 more time within 60 seconds)")
+    assert all(connection.closed for connection in FakeSMTP.connections)
+
+
+def test_timer_sends_digests_once_their_window_closes():
+    FakeSMTP.connections = []
+    email = notifications.EmailNotifications(
+        "smtp.example.com", 25, coalesce_window=0.05, smtp_factory=FakeSMTP
+    )
+    for _ in range(3):
+        email.send("stock@made.com", "Out of stock for RED-CHAIR")
+    assert len(sent_messages()) == 1
+
+    deadline = time.monotonic() + 5
+    while len(sent_messages()) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert sent_messages()[-1].endswith("(repeated 2 more times within 0.05 seconds)")
+    assert email._timer is None
+    email.close()
+
+
+def test_counts_failures(email):
+    def refuse(host, port):
+        raise ConnectionRefusedError()
+
+    email._smtp_factory = refuse
+
+    with pytest.raises(ConnectionRefusedError):
+        email.send("stock@made.com", "Out of stock for RED-CHAIR")
+    assert email.stats() == {"sent": 0, "coalesced": 0, "failed": 1}
+
+    email._smtp_factory = FakeSMTP
+    email.send("stock@made.com", "Out of stock for RED-CHAIR")
+    assert email.stats() == {"sent": 1, "coalesced": 0, "failed": 1}
+
+
+def test_forked_children_do_not_reuse_the_parents_connections(email):
+    email.send("stock@made.com", "Out of stock for RED-CHAIR")
+    email.send("stock@made.com", "Out of stock for RED-CHAIR")
+    assert email._idle.qsize() == 1
+
+    pid = os.fork()
+    if pid == 0:
+        # the parent still owns the pooled connection and the pending digest
+        os._exit(0 if email._idle.empty() and not email._windows else 1)
+    _, status = os.waitpid(pid, 0)
+
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert email._idle.qsize() == 1
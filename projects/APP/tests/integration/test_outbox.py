@@ -0,0 +1,123 @@
+# pylint: disable=redefined-outer-name
+import time
+from collections import defaultdict
+
+import pytest
+from allocation import bootstrap
+from allocation.domain import commands, events, model
+from allocation.service_layer import unit_of_work
+from sqlalchemy.orm import clear_mappers
+
+
+class FakeNotifications:
+    def __init__(self):
+        self.sent = defaultdict(list)
+
+    def send(self, destination, message):
+        self.sent[destination].append(message)
+
+
+@pytest.fixture
+def outbox_bus(sqlite_session_factory):
+    bus = bootstrap.bootstrap(
+        start_orm=True,
+        uow=unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory),
+        publish=lambda *args: pytest.fail("published in the request"),
+        use_outbox=True,
+    )
+    yield bus
+    clear_mappers()
+
+
+def outbox_rows(session_factory):
+    return (
+        session_factory()
+        .execute("SELECT handler, event_type, attempts FROM outbox ORDER BY id")
+        .fetchall()
+    )
+
+
+def test_side_effects_are_written_to_the_outbox(outbox_bus, sqlite_session_factory):
+    outbox_bus.handle(commands.CreateBatch("b1", "TALL-LAMP", 10, None))
+    outbox_bus.handle(
+        commands.AllocateMany(
+            [
+                commands.Allocate("o1", "TALL-LAMP", 5),
+                commands.Allocate("o2", "TALL-LAMP", 10),
+            ]
+        )
+    )
+
+    assert outbox_rows(sqlite_session_factory) == [
+        ("publish_allocated_event", "Allocated", 0),
+        ("send_out_of_stock_notification", "OutOfStock", 0),
+    ]
+
+
+def test_worker_delivers_and_clears_the_outbox(outbox_bus, sqlite_session_factory):
+    outbox_bus.handle(commands.CreateBatch("b1", "TALL-LAMP", 10, None))
+    outbox_bus.handle(commands.Allocate("o1", "TALL-LAMP", 5))
+    outbox_bus.handle(commands.Allocate("o2", "TALL-LAMP", 10))
+    notifications, published = FakeNotifications(), []
+    worker = bootstrap.outbox_worker(
+        sqlite_session_factory,
+        notifications=notifications,
+        publish=lambda channel, event: published.append((channel, event)),
+    )
+
+    assert worker.drain_once() == 2
+
+    assert published == [
+        ("line_allocated", events.Allocated("o1", "TALL-LAMP", 5, "b1"))
+    ]
+    assert notifications.sent["stock@made.com"] == ["Out of stock for TALL-LAMP"]
+    assert outbox_rows(sqlite_session_factory) == []
+    assert worker.drain_once() == 0
+
+
+def test_worker_retries_failed_deliveries_later(outbox_bus, sqlite_session_factory):
+    outbox_bus.handle(commands.CreateBatch("b1", "TALL-LAMP", 10, None))
+    outbox_bus.handle(commands.Allocate("o1", "TALL-LAMP", 5))
+    now, published = [time.time()], []
+
+    def flaky_publish(channel, event):
+        if not published:
+            published.append(None)
+            raise ConnectionError("redis went away")
+        published.append(event)
+
+    worker = bootstrap.outbox_worker(
+        sqlite_session_factory,
+        notifications=FakeNotifications(),
+        publish=flaky_publish,
+    )
+    worker._clock = lambda: now[0]
+
+    worker.drain_once()
+    assert outbox_rows(sqlite_session_factory) == [
+        ("publish_allocated_event", "Allocated", 1)
+    ]
+    assert worker.drain_once() == 0  # not due yet
+
+    now[0] += worker.retry_delay
+    assert worker.drain_once() == 1
+    assert published[-1] == events.Allocated("o1", "TALL-LAMP", 5, "b1")
+    assert outbox_rows(sqlite_session_factory) == []
+
+
+def test_nothing_reaches_the_outbox_without_a_commit(sqlite_session_factory):
+    bus = bootstrap.bootstrap(
+        start_orm=True,
+        uow=unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory),
+        use_outbox=True,
+    )
+    try:
+        bus.handle(commands.CreateBatch("b1", "TALL-LAMP", 10, None))
+        uow = bus.uow
+        with uow:
+            uow.products.get("TALL-LAMP").allocate(
+                model.OrderLine("o1", "TALL-LAMP", 50)
+            )
+        assert outbox_rows(sqlite_session_factory) == []
+    finally:
+        clear_mappers()
@@ -0,0 +1,167 @@
+# pylint: disable=redefined-outer-name
+import os
+import socket
+from contextlib import contextmanager
+from unittest import mock
+
+import fakeredis
+import pytest
+from allocation import bootstrap
+from allocation.adapters.orm import mapper_registry
+from allocation.domain import commands
+from allocation.entrypoints import redis_eventconsumer
+from allocation.service_layer import messagebus, unit_of_work
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+pytestmark = pytest.mark.usefixtures("mappers")
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    # a file, as every worker thread would get its own in-memory database
+    engine = create_engine(f"sqlite:///{tmp_path / 'allocation.db'}")
+    mapper_registry.metadata.create_all(engine)
+    return sessionmaker(bind=engine)
+
+
+@pytest.fixture
+def make_bus(session_factory):
+    return lambda: bootstrap.bootstrap(
+        start_orm=False,
+        uow=unit_of_work.SqlAlchemyUnitOfWork(session_factory),
+        notifications=mock.Mock(),
+        publish=lambda *args: None,
+    )
+
+
+@pytest.fixture
+def consumer(make_bus):
+    consumer = redis_eventconsumer.StreamConsumer(
+        fakeredis.FakeRedis(), make_bus, block=10
+    )
+    yield consumer
+    consumer.close()
+
+
+def batch_quantities(bus, sku):
+    with bus.uow:
+        product = bus.uow.products.get(sku)
+        return {b.reference: b.available_quantity for b in product.batches}
+
+
+def test_applies_the_last_change_for_each_batch(consumer, make_bus):
+    bus = make_bus()
+    bus.handle(commands.CreateBatch("b1", "RED-CHAIR", 100, None))
+    bus.handle(commands.CreateBatch("b2", "RED-CHAIR", 100, None))
+    bus.handle(commands.CreateBatch("b3", "BLUE-VASE", 100, None))
+    for batchref, qty in [("b1", 90), ("b3", 80), ("b1", 70), ("b2", 60), ("b1", 50)]:
+        consumer.client.xadd(consumer.stream, {"batchref": batchref, "qty": qty})
+
+    assert len(consumer.consume()) == 5
+
+    assert batch_quantities(bus, "RED-CHAIR") == {"b1": 50, "b2": 60}
+    assert batch_quantities(bus, "BLUE-VASE") == {"b3": 80}
+    assert consumer.client.xpending(consumer.stream, consumer.group)["pending"] == 0
+
+
+def test_leaves_failed_changes_pending_for_the_next_start(consumer, make_bus):
+    bus = make_bus()
+    bus.handle(commands.CreateBatch("b1", "RED-CHAIR", 100, None))
+    bus.handle(commands.CreateBatch("b2", "BLUE-VASE", 100, None))
+    consumer.client.xadd(consumer.stream, {"batchref": "b1", "qty": 90})
+    consumer.client.xadd(consumer.stream, {"batchref": "b2", "qty": 5})
+
+    with fail_changes_to("b2"):
+        consumer.consume()
+
+    assert batch_quantities(bus, "RED-CHAIR") == {"b1": 90}
+    assert consumer.client.xpending(consumer.stream, consumer.group)["pending"] == 1
+    [pending_id] = consumer.consume(start="0")
+    assert consumer.consume(start=pending_id) == []
+    assert batch_quantities(bus, "BLUE-VASE") == {"b2": 5}
+
+
+def test_dead_letters_changes_for_unknown_batches(consumer):
+    entry_id = consumer.client.xadd(
+        consumer.stream, {"batchref": "no-such-batch", "qty": 5}
+    )
+
+    consumer.consume()
+
+    assert consumer.client.xpending(consumer.stream, consumer.group)["pending"] == 0
+    [(_, fields)] = consumer.client.xrange(consumer.dead_letter_stream)
+    assert fields == {
+        b"batchref": b"no-such-batch",
+        b"qty": b"5",
+        b"id": entry_id,
+        b"reason": b"unknown batchref",
+    }
+
+
+def test_dead_letters_changes_that_keep_failing(consumer, make_bus):
+    make_bus().handle(commands.CreateBatch("b1", "RED-CHAIR", 100, None))
+    consumer.max_deliveries = 3
+    consumer.client.xadd(consumer.stream, {"batchref": "b1", "qty": 90})
+
+    with fail_changes_to("b1"):
+        consumer.consume()
+        consumer.consume(start="0")
+        assert consumer.client.xlen(consumer.dead_letter_stream) == 0
+        consumer.consume(start="0")
+
+    assert consumer.client.xpending(consumer.stream, consumer.group)["pending"] == 0
+    [(_, fields)] = consumer.client.xrange(consumer.dead_letter_stream)
+    assert fields[b"reason"] == b"failed 3 times"
+
+
+def test_reclaims_changes_another_consumer_left_pending(consumer, make_bus):
+    bus = make_bus()
+    bus.handle(commands.CreateBatch("b1", "RED-CHAIR", 100, None))
+    consumer.client.xadd(consumer.stream, {"batchref": "b1", "qty": 90})
+    # read by a process that died before handling it
+    consumer.client.xreadgroup(consumer.group, "crashed-host-1", {consumer.stream: ">"})
+    assert consumer.consume(start="0") == []
+
+    consumer.claim_idle = 0
+    assert len(consumer.reclaim()) == 1
+
+    assert batch_quantities(bus, "RED-CHAIR") == {"b1": 90}
+    assert consumer.client.xpending(consumer.stream, consumer.group)["pending"] == 0
+
+
+def test_does_not_apply_a_change_after_a_newer_one(consumer, make_bus):
+    bus = make_bus()
+    bus.handle(commands.CreateBatch("b1", "RED-CHAIR", 100, None))
+    consumer.client.xadd(consumer.stream, {"batchref": "b1", "qty": 10})
+    with fail_changes_to("b1"):
+        consumer.consume()
+    consumer.client.xadd(consumer.stream, {"batchref": "b1", "qty": 20})
+    consumer.consume()
+    assert batch_quantities(bus, "RED-CHAIR") == {"b1": 20}
+
+    consumer.claim_idle = 0
+    consumer.reclaim()
+
+    assert batch_quantities(bus, "RED-CHAIR") == {"b1": 20}
+    assert consumer.client.xpending(consumer.stream, consumer.group)["pending"] == 0
+
+
+def test_each_process_is_a_different_consumer(consumer):
+    assert consumer.consumer == f"{socket.gethostname()}-{os.getpid()}"
+
+
+@contextmanager
+def fail_changes_to(batchref):
+    handle = messagebus.MessageBus.handle
+
+    def failing_handle(bus, message):
+        if (
+            isinstance(message, commands.ChangeBatchQuantity)
+            and message.ref == batchref
+        ):
+            raise RuntimeError("database unavailable")
+        return handle(bus, message)
+
+    with mock.patch.object(messagebus.MessageBus, "handle", failing_handle):
+        yield
@@ -0,0 +1,134 @@
+# pylint: disable=redefined-outer-name
+import json
+import os
+
+import fakeredis
+import pytest
+from allocation import bootstrap
+from allocation.adapters import redis_eventpublisher
+from allocation.domain import commands, events
+from allocation.service_layer import unit_of_work
+from sqlalchemy.orm import clear_mappers
+
+
+@pytest.fixture
+def client():
+    return fakeredis.FakeRedis()
+
+
+def subscribe_to(client, channel):
+    pubsub = client.pubsub()
+    pubsub.subscribe(channel)
+    confirmation = pubsub.get_message(timeout=3)
+    assert confirmation["type"] == "subscribe"
+    return pubsub
+
+
+def received(pubsub):
+    messages = []
+    while True:
+        message = pubsub.get_message(timeout=0.1)
+        if message is None:
+            return messages
+        messages.append(message)
+
+
+def test_buffers_events_until_flushed(client):
+    pubsub = subscribe_to(client, "line_allocated")
+    publish = redis_eventpublisher.RedisPublisher(client=client)
+
+    publish("line_allocated", events.Allocated("o1", "RED-CHAIR", 1, "b1"))
+    publish("line_allocated", events.Allocated("o2", "RED-CHAIR", 2, "b1"))
+    assert received(pubsub) == []
+
+    publish.flush()
+
+    assert [json.loads(m["data"]) for m in received(pubsub)] == [
+        {"orderid": "o1", "sku": "RED-CHAIR", "qty": 1, "batchref": "b1"},
+        {"orderid": "o2", "sku": "RED-CHAIR", "qty": 2, "batchref": "b1"},
+    ]
+
+
+def test_forked_children_drop_the_parents_buffer_and_client(client):
+    publish = redis_eventpublisher.RedisPublisher(client=client)
+    publish("line_allocated", events.Allocated("o1", "RED-CHAIR", 1, "b1"))
+
+    pid = os.fork()
+    if pid == 0:
+        unbuffered = publish._buffer == [] and redis_eventpublisher._client is None
+        os._exit(0 if unbuffered else 1)
+    _, status = os.waitpid(pid, 0)
+
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert len(publish._buffer) == 1
+
+
+def test_codec_is_named_by_the_channel_suffix(client):
+    pubsub = subscribe_to(client, "line_allocated.orjson")
+    publish = redis_eventpublisher.RedisPublisher(codec="orjson", client=client)
+
+    publish("line_allocated", events.Allocated("o1", "RED-CHAIR", 1, "b1"))
+    publish.flush()
+
+    [message] = received(pubsub)
+    assert redis_eventpublisher.decode(message["channel"], message["data"]) == {
+        "orderid": "o1",
+        "sku": "RED-CHAIR",
+        "qty": 1,
+        "batchref": "b1",
+    }
+
+
+def test_decodes_non_json_codecs_by_the_suffix_of_a_bytes_channel(client, monkeypatch):
+    # a codec whose payloads are not valid JSON, so falling back to json would fail
+    monkeypatch.setitem(
+        redis_eventpublisher.CODECS,
+        "hex",
+        (
+            lambda value: json.dumps(value).encode().hex(),
+            lambda data: bytes.fromhex(data.decode()),
+        ),
+    )
+    pubsub = subscribe_to(client, "line_allocated.hex")
+    publish = redis_eventpublisher.RedisPublisher(codec="hex", client=client)
+
+    publish("line_allocated", events.Allocated("o1", "RED-CHAIR", 1, "b1"))
+    publish.flush()
+
+    [message] = received(pubsub)
+    assert message["channel"] == b"line_allocated.hex"
+    assert json.loads(
+        redis_eventpublisher.decode(message["channel"], message["data"])
+    ) == {"orderid": "o1", "sku": "RED-CHAIR", "qty": 1, "batchref": "b1"}
+
+
+def test_rejects_unknown_codecs():
+    with pytest.raises(ValueError, match="Unknown or unavailable codec 'xml'"):
+        redis_eventpublisher.RedisPublisher(codec="xml")
+
+
+def test_bus_publishes_bulk_allocations_in_one_round_trip(
+    client, sqlite_session_factory
+):
+    pipelines = []
+    pipeline = client.pipeline
+    client.pipeline = lambda **kwargs: pipelines.append(kwargs) or pipeline(**kwargs)
+    pubsub = subscribe_to(client, "line_allocated")
+    bus = bootstrap.bootstrap(
+        start_orm=True,
+        uow=unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory),
+        notifications=lambda *args: None,
+        publish=redis_eventpublisher.RedisPublisher(client=client),
+    )
+    try:
+        bus.handle(commands.CreateBatch("b1", "RED-CHAIR", 100, None))
+        bus.handle(
+            commands.AllocateMany(
+                [commands.Allocate(f"o{i}", "RED-CHAIR", 1) for i in range(50)]
+            )
+        )
+    finally:
+        clear_mappers()
+
+    assert len(received(pubsub)) == 50
+    assert len(pipelines) == 1
@@ -1,6 +1,7 @@
 import pytest
-from allocation.adapters import repository
+from allocation.adapters import orm, repository
 from allocation.domain import model
+from sqlalchemy.orm import clear_mappers
 
 pytestmark = pytest.mark.usefixtures("mappers")
 
@@ -17,3 +18,74 @@ def test_get_by_batchref(sqlite_session_factory):
     repo.add(p2)
     assert repo.get_by_batchref("b2") == p1
     assert repo.get_by_batchref("b3") == p2
+
+
+def test_loaded_batches_keep_counting_allocations(sqlite_session_factory):
+    session = sqlite_session_factory()
+    batch = model.Batch(ref="b1", sku="sku1", qty=100, eta=None)
+    batch.allocate(model.OrderLine("o1", "sku1", 10))
+    batch.allocate(model.OrderLine("o2", "sku1", 20))
+    session.add(model.Product(sku="sku1", batches=[batch]))
+    session.commit()
+
+    session = sqlite_session_factory()
+    repo = repository.SqlAlchemyRepository(session)
+    [loaded] = repo.get("sku1").batches
+    assert loaded.available_quantity == 70
+    loaded.allocate(model.OrderLine("o3", "sku1", 5))
+    loaded.deallocate_one()
+    assert loaded.allocated_quantity == sum(l.qty for l in loaded._allocations)
+
+
+def add_products(session, skus, batches=3, lines=2):
+    for sku in skus:
+        product = model.Product(sku=sku, batches=[])
+        for b in range(batches):
+            batch = model.Batch(ref=f"{sku}-b{b}", sku=sku, qty=100, eta=None)
+            for line in range(lines):
+                batch.allocate(model.OrderLine(f"{sku}-b{b}-o{line}", sku, 1))
+            product.batches.append(batch)
+        session.add(product)
+    session.commit()
+
+
+def allocated_quantities(products):
+    return sorted(b.allocated_quantity for p in products for b in p.batches)
+
+
+def test_get_loads_the_aggregate_in_three_queries(
+    sqlite_session_factory, assert_num_queries
+):
+    add_products(sqlite_session_factory(), ["sku1"])
+    repo = repository.SqlAlchemyRepository(sqlite_session_factory())
+
+    with assert_num_queries(3):
+        product = repo.get("sku1")
+        assert allocated_quantities([product]) == [2, 2, 2]
+
+
+def test_get_many_loads_every_aggregate_in_three_queries(
+    sqlite_session_factory, assert_num_queries
+):
+    add_products(sqlite_session_factory(), ["sku1", "sku2", "sku3"])
+    repo = repository.SqlAlchemyRepository(sqlite_session_factory())
+
+    with assert_num_queries(3):
+        products = repo.get_many(["sku1", "sku3", "unknown"])
+        assert sorted(p.sku for p in products) == ["sku1", "sku3"]
+        assert allocated_quantities(products) == [2] * 6
+    assert set(products) <= repo.seen
+
+
+@pytest.mark.parametrize("loading, queries", [("joined", 1), ("lazy", 1 + 2 + 2 * 3)])
+def test_loading_strategy_is_configurable(
+    sqlite_session_factory, assert_num_queries, loading, queries
+):
+    clear_mappers()
+    orm.start_mappers(loading=loading)
+    add_products(sqlite_session_factory(), ["sku1", "sku2"])
+    repo = repository.SqlAlchemyRepository(sqlite_session_factory())
+
+    with assert_num_queries(queries):
+        products = repo.get_many(["sku1", "sku2"])
+        assert allocated_quantities(products) == [2] * 6
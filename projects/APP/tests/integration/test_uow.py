@@ -6,8 +6,13 @@ from typing import List
 from unittest.mock import Mock
 
 import pytest
-from allocation.domain import model
-from allocation.service_layer import unit_of_work
+from allocation.adapters import repository
+from allocation.adapters.orm import mapper_registry
+from allocation.domain import commands, events, model
+from allocation.service_layer import handlers, messagebus, unit_of_work
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
 
 from ..random_refs import random_batchref, random_orderid, random_sku
 
@@ -55,6 +60,17 @@ def test_uow_can_retrieve_a_batch_and_allocate_to_it(sqlite_session_factory):
     assert batchref == "batch1"
 
 
+def test_default_session_factory_is_created_on_first_use(monkeypatch):
+    monkeypatch.setattr(unit_of_work, "_session_factory", None)
+    uow = unit_of_work.SqlAlchemyUnitOfWork()
+    assert uow.session_factory is None
+
+    with uow:
+        pass
+
+    assert uow.session_factory is unit_of_work.default_session_factory()
+
+
 def test_rolls_back_uncommitted_work_by_default(sqlite_session_factory):
     uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
     with uow:
@@ -80,6 +96,252 @@ def test_rolls_back_on_error(sqlite_session_factory):
     assert rows == []
 
 
+def test_cached_product_is_reused_after_a_version_check(
+    sqlite_session_factory, assert_num_queries
+):
+    session = sqlite_session_factory()
+    insert_batch(session, "batch1", "SMALL-TABLE", 100, None)
+    session.commit()
+    cache = repository.ProductCache()
+
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory, cache)
+    with uow:
+        product = uow.products.get(sku="SMALL-TABLE")
+        product.allocate(model.OrderLine("o1", "SMALL-TABLE", 10))
+        uow.commit()
+    product.events.clear()
+
+    with uow:
+        with assert_num_queries(1):
+            cached = uow.products.get(sku="SMALL-TABLE")
+            assert cached is product
+            assert cached.batches[0].available_quantity == 90
+        cached.allocate(model.OrderLine("o2", "SMALL-TABLE", 10))
+        uow.commit()
+
+    assert get_allocated_batch_ref(session, "o2", "SMALL-TABLE") == "batch1"
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 1, "stale": 0}
+
+
+def test_cached_product_is_reloaded_when_its_version_has_changed(
+    sqlite_session_factory,
+):
+    session = sqlite_session_factory()
+    insert_batch(session, "batch1", "SMALL-TABLE", 100, None)
+    session.commit()
+    cache = repository.ProductCache()
+
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory, cache)
+    with uow:
+        product = uow.products.get(sku="SMALL-TABLE")
+    session.execute("UPDATE products SET version_number = 5 WHERE sku = 'SMALL-TABLE'")
+    session.commit()
+
+    with uow:
+        reloaded = uow.products.get(sku="SMALL-TABLE")
+        assert reloaded is not product
+        assert reloaded.version_number == 5
+    assert cache.stats()["stale"] == 1
+
+
+def test_uncommitted_changes_are_not_cached(sqlite_session_factory):
+    session = sqlite_session_factory()
+    insert_batch(session, "batch1", "SMALL-TABLE", 100, None)
+    session.commit()
+    cache = repository.ProductCache()
+
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory, cache)
+    with uow:
+        product = uow.products.get(sku="SMALL-TABLE")
+        product.allocate(model.OrderLine("o1", "SMALL-TABLE", 10))
+
+    assert len(cache) == 0
+    with uow:
+        product = uow.products.get(sku="SMALL-TABLE")
+        assert product.batches[0].available_quantity == 100
+
+
+def test_allocate_many_loads_each_product_once(
+    sqlite_session_factory, assert_num_queries
+):
+    session = sqlite_session_factory()
+    batchrefs = {random_sku(str(i)): random_batchref(str(i)) for i in range(4)}
+    skus = list(batchrefs)
+    for sku, batchref in batchrefs.items():
+        insert_batch(session, batchref, sku, 100, None)
+    session.commit()
+    cmd = commands.AllocateMany([commands.Allocate("o1", sku, 10) for sku in skus])
+
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    with assert_num_queries(3 + 3 * len(skus)) as statements:
+        handlers.allocate_many(cmd, uow)
+
+    # products, their batches and their allocations, then a commit per product
+    assert sum(s.startswith("SELECT") for s in statements) == 3
+    for sku in skus:
+        assert get_allocated_batch_ref(session, "o1", sku) == batchrefs[sku]
+
+
+def test_product_cache_evicts_the_least_recently_used():
+    cache = repository.ProductCache(maxsize=2)
+    for sku in ("SKU1", "SKU2", "SKU3"):
+        cache.checkin(model.Product(sku, batches=[]))
+
+    assert len(cache) == 2
+    assert cache.checkout("SKU1") is None
+    assert cache.checkout("SKU3").sku == "SKU3"
+
+
+def test_concurrent_updates_to_version_are_not_allowed(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/allocation.db")
+    mapper_registry.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine)
+    session = session_factory()
+    insert_batch(session, "batch1", "SMALL-TABLE", 100, None)
+    session.commit()
+
+    uow1 = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    uow2 = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    with pytest.raises(unit_of_work.ConcurrencyConflict) as conflict:
+        with uow1:
+            product1 = uow1.products.get(sku="SMALL-TABLE")
+            with uow2:
+                product2 = uow2.products.get(sku="SMALL-TABLE")
+                product2.allocate(model.OrderLine("o2", "SMALL-TABLE", 10))
+                uow2.commit()
+            product1.allocate(model.OrderLine("o1", "SMALL-TABLE", 10))
+            uow1.commit()
+
+    assert conflict.value.skus == ["SMALL-TABLE"]
+    assert not conflict.value.after_commit
+    [[version]] = session.execute(
+        "SELECT version_number FROM products WHERE sku='SMALL-TABLE'"
+    )
+    assert version == 2
+    [[orderid]] = session.execute("SELECT orderid FROM order_lines")
+    assert orderid == "o2"
+
+
+def test_expired_batches_recount_lines_committed_elsewhere(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/allocation.db")
+    mapper_registry.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine)
+    session = session_factory()
+    insert_batch(session, "batch1", "SMALL-TABLE", 10, None)
+    session.commit()
+
+    uow1 = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    uow2 = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    with uow1:
+        product1 = uow1.products.get(sku="SMALL-TABLE")
+        [batch1] = product1.batches
+        assert batch1.available_quantity == 10
+        uow1.commit()  # expires product1 and batch1
+        with uow2:
+            product2 = uow2.products.get(sku="SMALL-TABLE")
+            product2.allocate(model.OrderLine("o2", "SMALL-TABLE", 8))
+            uow2.commit()
+
+        assert product1.allocate(model.OrderLine("o1", "SMALL-TABLE", 8)) is None
+        assert batch1.available_quantity == 2
+
+
+def test_one_uow_can_be_shared_by_threads_handling_messages(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/allocation.db")
+    mapper_registry.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine)
+    session = session_factory()
+    for sku in ("RED-CHAIR", "BLUE-CHAIR"):
+        insert_batch(session, f"{sku}-batch", sku, 100, None)
+    session.commit()
+
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    both_loaded = threading.Barrier(2)
+    handled = []
+
+    def allocate(cmd):
+        with uow:
+            product = uow.products.get(sku=cmd.sku)
+            # both threads are inside `with uow:` before either allocates or commits
+            both_loaded.wait(timeout=5)
+            product.allocate(model.OrderLine(cmd.orderid, cmd.sku, cmd.qty))
+            uow.commit()
+
+    bus = messagebus.MessageBus(
+        uow=uow,
+        event_handlers={
+            events.Allocated: [
+                lambda e: handled.append((threading.current_thread().name, e.sku))
+            ]
+        },
+        command_handlers={commands.Allocate: allocate},
+    )
+    threads = [
+        threading.Thread(
+            target=bus.handle, args=(commands.Allocate("o1", sku, 10),), name=sku
+        )
+        for sku in ("RED-CHAIR", "BLUE-CHAIR")
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert sorted(handled) == [
+        ("BLUE-CHAIR", "BLUE-CHAIR"),
+        ("RED-CHAIR", "RED-CHAIR"),
+    ]
+    for sku in ("RED-CHAIR", "BLUE-CHAIR"):
+        assert get_allocated_batch_ref(session, "o1", sku) == f"{sku}-batch"
+
+
+def test_events_committed_before_a_conflict_are_still_handled(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/allocation.db")
+    mapper_registry.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine)
+    session = session_factory()
+    for sku in ("RED-CHAIR", "BLUE-CHAIR"):
+        insert_batch(session, f"{sku}-batch", sku, 100, None)
+    session.commit()
+
+    commits = []
+
+    def change_blue_chair_elsewhere(_):
+        commits.append(True)
+        if len(commits) > 1:
+            return
+        with engine.begin() as connection:
+            connection.execute(
+                "UPDATE products SET version_number = version_number + 1"
+                " WHERE sku = 'BLUE-CHAIR'"
+            )
+
+    # once RED-CHAIR is committed, BLUE-CHAIR loses its version check
+    event.listen(session_factory, "after_commit", change_blue_chair_elsewhere)
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    handled = []
+    bus = messagebus.MessageBus(
+        uow=uow,
+        event_handlers={events.Allocated: [lambda e: handled.append(e.sku)]},
+        command_handlers={
+            commands.AllocateMany: lambda cmd: handlers.allocate_many(cmd, uow)
+        },
+    )
+
+    with pytest.raises(unit_of_work.ConcurrencyConflict) as conflict:
+        bus.handle(
+            commands.AllocateMany(
+                [
+                    commands.Allocate("o1", "RED-CHAIR", 10),
+                    commands.Allocate("o1", "BLUE-CHAIR", 10),
+                ]
+            )
+        )
+
+    assert conflict.value.after_commit
+    assert handled == ["RED-CHAIR"]
+
+
 def try_to_allocate(orderid, sku, exceptions, session_factory):
     line = model.OrderLine(orderid, sku, 10)
     try:
@@ -4,6 +4,7 @@ from unittest import mock
 
 import pytest
 from allocation import bootstrap, views
+from allocation.adapters.cache import LocalCache
 from allocation.domain import commands
 from allocation.service_layer import unit_of_work
 from sqlalchemy.orm import clear_mappers
@@ -48,3 +49,91 @@ def test_deallocation(sqlite_bus):
     assert views.allocations("o1", sqlite_bus.uow) == [
         {"sku": "sku1", "batchref": "b2"},
     ]
+
+
+def test_allocations_view_with_batched_events(sqlite_session_factory):
+    bus = bootstrap.bootstrap(
+        start_orm=True,
+        uow=unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory),
+        notifications=mock.Mock(),
+        publish=lambda *args: None,
+        batch_events=True,
+    )
+    try:
+        bus.handle(commands.CreateBatch("sku1batch", "sku1", 50, None))
+        bus.handle(commands.CreateBatch("sku2batch", "sku2", 50, None))
+        bus.handle(
+            commands.AllocateMany(
+                [commands.Allocate(f"order{i}", "sku1", 1) for i in range(3)]
+                + [commands.Allocate("order3", "sku1", 100)]  # out of stock
+                + [commands.Allocate("order1", "sku2", 1)]
+            )
+        )
+
+        # products hand over their events in no particular order
+        results = views.allocations("order1", bus.uow)
+        assert sorted(results, key=lambda row: row["sku"]) == [
+            {"sku": "sku1", "batchref": "sku1batch"},
+            {"sku": "sku2", "batchref": "sku2batch"},
+        ]
+        assert views.allocations("order2", bus.uow) == [
+            {"sku": "sku1", "batchref": "sku1batch"},
+        ]
+    finally:
+        clear_mappers()
+
+
+def test_allocations_view_is_cached_until_the_order_changes(sqlite_session_factory):
+    cache = LocalCache()
+    bus = bootstrap.bootstrap(
+        start_orm=True,
+        uow=unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory),
+        notifications=mock.Mock(),
+        publish=lambda *args: None,
+        cache=cache,
+    )
+    try:
+        bus.handle(commands.CreateBatch("b1", "sku1", 50, None))
+        bus.handle(commands.CreateBatch("b2", "sku1", 50, today))
+        bus.handle(commands.Allocate("o1", "sku1", 40))
+        assert views.allocations("o1", bus.uow, cache) == [
+            {"sku": "sku1", "batchref": "b1"}
+        ]
+
+        # served from the cache, without opening the unit of work
+        assert views.allocations("o1", mock.Mock(), cache) == [
+            {"sku": "sku1", "batchref": "b1"}
+        ]
+
+        bus.handle(commands.ChangeBatchQuantity("b1", 10))
+        assert views.allocations("o1", bus.uow, cache) == [
+            {"sku": "sku1", "batchref": "b2"}
+        ]
+        assert (cache.hits, cache.misses) == (1, 2)
+    finally:
+        clear_mappers()
+
+
+def test_allocations_view_is_indexed_by_orderid(sqlite_session_factory):
+    session = sqlite_session_factory()
+    [plan] = session.execute(
+        "EXPLAIN QUERY PLAN SELECT sku, batchref FROM allocations_view"
+        " WHERE orderid = 'o1'"
+    ).fetchall()
+    assert "USING INDEX" in plan[-1]
+
+
+def test_allocations_view_does_not_cache_rows_an_invalidation_overtook():
+    cache = LocalCache()
+    uow = mock.MagicMock()
+    uow.__enter__.return_value = uow
+
+    def read_then_get_invalidated(*_):
+        # the read model handler commits and invalidates after the view has read
+        cache.invalidate("o1")
+        return [{"sku": "sku1", "batchref": "b1"}]
+
+    uow.session.execute.side_effect = read_then_get_invalidated
+
+    assert views.allocations("o1", uow, cache) == [{"sku": "sku1", "batchref": "b1"}]
+    assert cache.get("o1") is None
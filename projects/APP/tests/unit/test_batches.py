@@ -45,3 +45,22 @@ def test_allocation_is_idempotent():
     batch.allocate(line)
     batch.allocate(line)
     assert batch.available_quantity == 18
+
+
+def test_deallocating_returns_the_quantity_to_the_batch():
+    batch, line = make_batch_and_line("ANGULAR-DESK", 20, 2)
+    batch.allocate(line)
+
+    assert batch.deallocate_one() == line
+    assert batch.allocated_quantity == 0
+    assert batch.available_quantity == 20
+
+
+def test_allocated_quantity_is_counted_once_after_load():
+    batch, line = make_batch_and_line("ANGULAR-DESK", 20, 2)
+    batch._allocations = {line, OrderLine("order-456", "ANGULAR-DESK", 3)}
+    batch._allocated_quantity = None  # as left by the ORM load hook
+
+    assert batch.available_quantity == 15
+    batch.allocate(OrderLine("order-789", "ANGULAR-DESK", 5))
+    assert batch.available_quantity == 10
@@ -34,9 +34,11 @@ class FakeUnitOfWork(unit_of_work.AbstractUnitOfWork):
     def __init__(self):
         self.products = FakeRepository([])
         self.committed = False
+        self.commits = 0
 
     def _commit(self):
         self.committed = True
+        self.commits += 1
 
     def rollback(self):
         pass
@@ -109,6 +111,77 @@ class TestAllocate:
         ]
 
 
+class TestAllocateMany:
+    def test_allocates_every_line(self):
+        bus = bootstrap_test_app()
+        bus.handle(commands.CreateBatch("batch1", "ROUND-TABLE", 100, None))
+        bus.handle(commands.CreateBatch("batch2", "TALL-LAMP", 100, None))
+        bus.handle(
+            commands.AllocateMany(
+                [
+                    commands.Allocate("o1", "ROUND-TABLE", 10),
+                    commands.Allocate("o1", "TALL-LAMP", 20),
+                    commands.Allocate("o2", "ROUND-TABLE", 30),
+                ]
+            )
+        )
+        [table_batch] = bus.uow.products.get("ROUND-TABLE").batches
+        [lamp_batch] = bus.uow.products.get("TALL-LAMP").batches
+        assert table_batch.available_quantity == 60
+        assert lamp_batch.available_quantity == 80
+
+    def test_commits_once_per_product(self):
+        bus = bootstrap_test_app()
+        bus.handle(commands.CreateBatch("batch1", "ROUND-TABLE", 100, None))
+        bus.handle(commands.CreateBatch("batch2", "TALL-LAMP", 100, None))
+        commits = bus.uow.commits
+
+        lines = [commands.Allocate(f"o{i}", "ROUND-TABLE", 1) for i in range(50)]
+        lines += [commands.Allocate(f"o{i}", "TALL-LAMP", 1) for i in range(50)]
+        bus.handle(commands.AllocateMany(lines))
+
+        assert bus.uow.commits == commits + 2
+
+    def test_sends_email_on_out_of_stock_error(self):
+        fake_notifs = FakeNotifications()
+        bus = bootstrap.bootstrap(
+            start_orm=False,
+            uow=FakeUnitOfWork(),
+            notifications=fake_notifs,
+            publish=lambda *args: None,
+        )
+        bus.handle(commands.CreateBatch("b1", "POPULAR-CURTAINS", 9, None))
+        bus.handle(
+            commands.AllocateMany(
+                [
+                    commands.Allocate("o1", "POPULAR-CURTAINS", 5),
+                    commands.Allocate("o2", "POPULAR-CURTAINS", 5),
+                ]
+            )
+        )
+        assert fake_notifs.sent["stock@made.com"] == [
+            f"Out of stock for POPULAR-CURTAINS",
+        ]
+
+    def test_errors_for_invalid_sku_without_committing(self):
+        bus = bootstrap_test_app()
+        bus.handle(commands.CreateBatch("b1", "AREALSKU", 100, None))
+        commits = bus.uow.commits
+
+        with pytest.raises(handlers.InvalidSku, match="Invalid sku NONEXISTENTSKU"):
+            bus.handle(
+                commands.AllocateMany(
+                    [
+                        commands.Allocate("o1", "AREALSKU", 10),
+                        commands.Allocate("o1", "NONEXISTENTSKU", 10),
+                    ]
+                )
+            )
+        assert bus.uow.commits == commits
+        [batch] = bus.uow.products.get("AREALSKU").batches
+        assert batch.available_quantity == 100
+
+
 class TestChangeBatchQuantity:
     def test_changes_available_quantity(self):
         bus = bootstrap_test_app()
@@ -0,0 +1,315 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from allocation import bootstrap
+from allocation.domain import commands, events
+from allocation.service_layer import handlers, messagebus, unit_of_work
+
+
+class FakeUnitOfWorkWithEvents:
+    def __init__(self):
+        self.new_events = []
+
+    def collect_new_events(self):
+        while self.new_events:
+            yield self.new_events.pop(0)
+
+
+def make_bus(uow, handled, batch_event_handlers=None):
+    def allocate(cmd):
+        uow.new_events.extend(
+            events.Allocated(line.orderid, line.sku, line.qty, "batch1")
+            for line in cmd.lines
+        )
+        uow.new_events.append(events.OutOfStock("LAST-SKU"))
+
+    return messagebus.MessageBus(
+        uow=uow,
+        event_handlers={
+            events.Allocated: [lambda e: handled.append(("each", e.orderid))],
+            events.OutOfStock: [lambda e: handled.append(("each", e.sku))],
+        },
+        command_handlers={commands.AllocateMany: allocate},
+        batch_event_handlers=batch_event_handlers,
+    )
+
+
+def allocate_many(*orderids):
+    return commands.AllocateMany(
+        [commands.Allocate(orderid, "SKU", 1) for orderid in orderids]
+    )
+
+
+def test_handles_events_one_at_a_time_by_default():
+    uow, handled = FakeUnitOfWorkWithEvents(), []
+    bus = make_bus(uow, handled)
+
+    bus.handle(allocate_many("o1", "o2"))
+
+    assert handled == [("each", "o1"), ("each", "o2"), ("each", "LAST-SKU")]
+
+
+def test_batches_consecutive_events_of_the_same_type():
+    uow, handled = FakeUnitOfWorkWithEvents(), []
+    bus = make_bus(
+        uow,
+        handled,
+        batch_event_handlers={
+            events.Allocated: [
+                lambda batch: handled.append(("batch", [e.orderid for e in batch]))
+            ],
+        },
+    )
+
+    bus.handle(allocate_many("o1", "o2", "o3"))
+
+    assert handled == [("batch", ["o1", "o2", "o3"]), ("each", "LAST-SKU")]
+
+
+def test_each_call_gets_its_own_queue():
+    uow, handled = FakeUnitOfWorkWithEvents(), []
+    bus = make_bus(uow, handled)
+
+    bus.handle(allocate_many("o1"))
+    bus.handle(allocate_many("o2"))
+
+    assert not hasattr(bus, "queue")
+    assert handled == [
+        ("each", "o1"),
+        ("each", "LAST-SKU"),
+        ("each", "o2"),
+        ("each", "LAST-SKU"),
+    ]
+
+
+def make_async_bus(uow, event_handlers, command_handlers=None, **kwargs):
+    return messagebus.AsyncMessageBus(
+        uow=uow,
+        event_handlers=event_handlers,
+        command_handlers=command_handlers or {},
+        **kwargs,
+    )
+
+
+def test_async_bus_runs_event_handlers_concurrently():
+    uow, handled = FakeUnitOfWorkWithEvents(), []
+
+    async def publish(event):
+        await asyncio.sleep(0.2)
+        handled.append("published")
+
+    def send_email(event):
+        time.sleep(0.2)
+        handled.append(("emailed", threading.current_thread().name))
+
+    bus = make_async_bus(uow, {events.OutOfStock: [publish, send_email]})
+
+    start = time.perf_counter()
+    asyncio.run(bus.handle(events.OutOfStock("SKU")))
+
+    assert time.perf_counter() - start < 0.35
+    assert "published" in handled
+    [(_, thread_name)] = [h for h in handled if h != "published"]
+    assert thread_name.startswith("messagebus")
+    bus.close()
+
+
+def test_async_bus_gives_up_on_slow_handlers():
+    uow, handled = FakeUnitOfWorkWithEvents(), []
+
+    async def hang(event):
+        await asyncio.sleep(10)
+
+    def fail(event):
+        raise ValueError("boom")
+
+    bus = make_async_bus(
+        uow,
+        {events.OutOfStock: [hang, fail, lambda e: handled.append(e.sku)]},
+        handler_timeout=0.1,
+    )
+
+    start = time.perf_counter()
+    asyncio.run(bus.handle(events.OutOfStock("SKU")))
+
+    assert time.perf_counter() - start < 1
+    assert handled == ["SKU"]
+    bus.close()
+
+
+def test_async_bus_takes_turns_on_the_unit_of_work():
+    uow, running, overlaps = FakeUnitOfWorkWithEvents(), [], []
+
+    def uses_the_uow(event):
+        running.append(event)
+        overlaps.append(len(running))
+        time.sleep(0.05)
+        running.remove(event)
+
+    uses_the_uow.uses_uow = True
+    bus = make_async_bus(uow, {events.OutOfStock: [uses_the_uow, uses_the_uow]})
+
+    asyncio.run(bus.handle(events.OutOfStock("SKU")))
+
+    assert overlaps == [1, 1]
+    bus.close()
+
+
+def test_async_bus_handles_commands_in_order_and_raises():
+    uow, handled = FakeUnitOfWorkWithEvents(), []
+
+    async def allocate(cmd):
+        for line in cmd.lines:
+            await asyncio.sleep(0.01)
+            handled.append(line.orderid)
+            uow.new_events.append(events.OutOfStock(line.sku))
+
+    bus = make_async_bus(
+        uow,
+        {events.OutOfStock: [lambda e: handled.append(e.sku)]},
+        {commands.AllocateMany: allocate, commands.Allocate: lambda cmd: 1 / 0},
+    )
+
+    asyncio.run(bus.handle(allocate_many("o1", "o2")))
+    with pytest.raises(ZeroDivisionError):
+        asyncio.run(bus.handle(commands.Allocate("o3", "SKU", 1)))
+
+    assert handled == ["o1", "o2", "SKU", "SKU"]
+    bus.close()
+
+
+def make_conflicting_bus(conflicts, after_commit=False, max_attempts=3):
+    calls, delays = [], []
+
+    def allocate(cmd):
+        calls.append(cmd)
+        if len(calls) <= conflicts:
+            raise unit_of_work.ConcurrencyConflict(["SKU"], after_commit=after_commit)
+
+    bus = messagebus.MessageBus(
+        uow=FakeUnitOfWorkWithEvents(),
+        event_handlers={},
+        command_handlers={commands.AllocateMany: allocate},
+        retry_policy=messagebus.ConflictRetryPolicy(
+            max_attempts=max_attempts, base_delay=0.1, rng=lambda: 1.0
+        ),
+        sleep=delays.append,
+    )
+    return bus, calls, delays
+
+
+def test_retries_commands_that_lose_a_version_race_with_backoff():
+    bus, calls, delays = make_conflicting_bus(conflicts=2)
+
+    bus.handle(allocate_many("o1"))
+
+    assert len(calls) == 3
+    assert delays == [0.1, 0.2]
+    assert bus.retry_policy.stats() == {
+        "commands": 1,
+        "conflicts": 2,
+        "retries": 2,
+        "gave_up": 0,
+        "conflict_rate": 2 / 3,
+    }
+
+
+def test_gives_up_after_max_attempts():
+    bus, calls, _ = make_conflicting_bus(conflicts=5, max_attempts=3)
+
+    with pytest.raises(unit_of_work.ConcurrencyConflict):
+        bus.handle(allocate_many("o1"))
+
+    assert len(calls) == 3
+    assert bus.retry_policy.stats()["gave_up"] == 1
+
+
+def test_does_not_retry_conflicts_after_a_commit():
+    bus, calls, delays = make_conflicting_bus(conflicts=1, after_commit=True)
+
+    with pytest.raises(unit_of_work.ConcurrencyConflict):
+        bus.handle(allocate_many("o1"))
+
+    assert len(calls) == 1
+    assert delays == []
+
+
+def test_async_bus_retries_conflicts_too():
+    calls = []
+
+    async def allocate(cmd):
+        calls.append(cmd)
+        if len(calls) == 1:
+            raise unit_of_work.ConcurrencyConflict(["SKU"])
+
+    bus = messagebus.AsyncMessageBus(
+        uow=FakeUnitOfWorkWithEvents(),
+        event_handlers={},
+        command_handlers={commands.AllocateMany: allocate},
+        retry_policy=messagebus.ConflictRetryPolicy(rng=lambda: 0.0),
+    )
+    try:
+        asyncio.run(bus.handle(allocate_many("o1")))
+    finally:
+        bus.close()
+
+    assert len(calls) == 2
+    assert bus.retry_policy.stats()["retries"] == 1
+
+
+def test_dispatches_subclasses_through_their_mro_once():
+    class UrgentAllocateMany(commands.AllocateMany):
+        pass
+
+    handled = []
+    bus = messagebus.MessageBus(
+        uow=FakeUnitOfWorkWithEvents(),
+        event_handlers={},
+        command_handlers={UrgentAllocateMany: handled.append},
+    )
+
+    bus.handle(UrgentAllocateMany([]))
+    bus.handle(UrgentAllocateMany([]))
+
+    assert len(handled) == 2
+    assert bus._dispatch == {UrgentAllocateMany: bus.handle_command}
+
+
+def test_rejects_messages_that_are_neither_events_nor_commands():
+    bus = make_bus(FakeUnitOfWorkWithEvents(), [])
+
+    with pytest.raises(Exception, match="was not an Event or Command"):
+        bus.handle("allocate everything")
+
+
+def test_injected_handlers_keep_their_names():
+    uow = FakeUnitOfWorkWithEvents()
+    injected = bootstrap.inject_dependencies(handlers.allocate, {"uow": uow})
+
+    assert injected.__name__ == "allocate"
+    assert injected.keywords == {"uow": uow}
+    assert injected.uses_uow
+
+
+def test_async_bus_handles_events_committed_before_a_conflict():
+    uow = FakeUnitOfWorkWithEvents()
+    handled = []
+
+    def allocate(cmd):
+        uow.new_events.append(events.Allocated("o1", "RED-CHAIR", 1, "batch1"))
+        raise unit_of_work.ConcurrencyConflict(["BLUE-CHAIR"], after_commit=True)
+
+    bus = messagebus.AsyncMessageBus(
+        uow=uow,
+        event_handlers={events.Allocated: [lambda e: handled.append(e.sku)]},
+        command_handlers={commands.AllocateMany: allocate},
+    )
+    try:
+        with pytest.raises(unit_of_work.ConcurrencyConflict):
+            asyncio.run(bus.handle(allocate_many("o1")))
+    finally:
+        bus.close()
+
+    assert handled == ["RED-CHAIR"]
@@ -72,3 +72,42 @@ def test_increments_version_number():
     product.version_number = 7
     product.allocate(line)
     assert product.version_number == 8
+
+
+def test_skips_earlier_batches_without_enough_capacity():
+    batches = [
+        Batch(f"batch-{day}", "LONG-SOFA", 5, eta=today + timedelta(days=day))
+        for day in range(100)
+    ]
+    batches[60]._purchased_quantity = 50
+    product = Product(sku="LONG-SOFA", batches=list(reversed(batches)))
+
+    allocation = product.allocate(OrderLine("order1", "LONG-SOFA", 20))
+
+    assert allocation == "batch-60"
+
+
+def test_added_batches_take_their_place_in_eta_order():
+    product = Product(
+        sku="RED-CHAIR", batches=[Batch("later", "RED-CHAIR", 100, eta=later)]
+    )
+    product.allocate(OrderLine("order1", "RED-CHAIR", 10))
+
+    product.add_batch(Batch("tomorrow", "RED-CHAIR", 100, eta=tomorrow))
+    product.add_batch(Batch("in-stock", "RED-CHAIR", 5, eta=None))
+
+    assert [b.reference for b in product.eta_index] == ["in-stock", "tomorrow", "later"]
+    assert product.allocate(OrderLine("order2", "RED-CHAIR", 10)) == "tomorrow"
+    assert product.allocate(OrderLine("order3", "RED-CHAIR", 5)) == "in-stock"
+
+
+def test_allocates_around_a_batch_whose_quantity_was_reduced():
+    first = Batch("first", "BLUE-VASE", 20, eta=today)
+    second = Batch("second", "BLUE-VASE", 20, eta=tomorrow)
+    product = Product(sku="BLUE-VASE", batches=[first, second])
+    product.allocate(OrderLine("order1", "BLUE-VASE", 10))
+
+    product.change_batch_quantity(ref="first", qty=12)
+
+    assert product.allocate(OrderLine("order2", "BLUE-VASE", 5)) == "second"
+    assert product.allocate(OrderLine("order3", "BLUE-VASE", 2)) == "first"
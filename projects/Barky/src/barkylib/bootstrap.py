@@ -1,3 +1,4 @@
+import functools
 import inspect
 from typing import Callable
 
@@ -10,6 +11,7 @@ def bootstrap(
     uow: unit_of_work.AbstractUnitOfWork = unit_of_work.SqlAlchemyUnitOfWork(),
     # notifications: AbstractNotifications = None,
     # publish: Callable = redis_eventpublisher.publish,
+    batch_events: bool = False,
 ) -> messagebus.MessageBus:
     # if notifications is None:
     #     notifications = EmailNotifications()
@@ -29,17 +31,35 @@ def bootstrap(
         command_type: inject_dependencies(handler, dependencies)
         for command_type, handler in handlers.COMMAND_HANDLERS.items()
     }
+    injected_batch_event_handlers = None
+    if batch_events:
+        injected_batch_event_handlers = {
+            event_type: [
+                inject_dependencies(
+                    handlers.BATCH_EVENT_HANDLERS[handler], dependencies
+                )
+                if handler in handlers.BATCH_EVENT_HANDLERS
+                else None
+                for handler in event_handlers
+            ]
+            for event_type, event_handlers in handlers.EVENT_HANDLERS.items()
+        }
 
     return messagebus.MessageBus(
         uow=uow,
         event_handlers=injected_event_handlers,
         command_handlers=injected_command_handlers,
+        batch_event_handlers=injected_batch_event_handlers,
     )
 
 
 def inject_dependencies(handler, dependencies):
+    """
+    Binds the dependencies handler asks for with functools.partial, keeping its name
+    so profiles and logs show the handler instead of a lambda.
+    """
     params = inspect.signature(handler).parameters
     deps = {
         name: dependency for name, dependency in dependencies.items() if name in params
     }
-    return lambda message: handler(message, **deps)
+    return functools.update_wrapper(functools.partial(handler, **deps), handler)
@@ -5,7 +5,50 @@ def get_sqlite_memory_uri():
     pass
 
 
-def get_sqlite_file_url():
+# named durability/performance profiles for the sqlite engine, applied as PRAGMAs on connect
+# (kept in step with the profiles of the Barky2024 DatabaseManager)
+SQLITE_PROFILES = {
+    "safe": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "mmap_size": 0,
+        "cache_size": -2000,
+        "temp_store": "DEFAULT",
+    },
+    "balanced": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -16000,
+        "temp_store": "MEMORY",
+    },
+    "bulk-load": {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64000,
+        "temp_store": "MEMORY",
+    },
+}
+
+
+def get_sqlite_profile():
+    return os.environ.get("SQLITE_PROFILE", "safe")
+
+
+def get_sqlite_pragmas(profile=None):
+    profile = profile or get_sqlite_profile()
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(
+            f"Unknown profile {profile!r}, expected one of {', '.join(SQLITE_PROFILES)}"
+        )
+    return SQLITE_PROFILES[profile]
+
+
+def get_sqlite_file_url(profile=None):
+    # the pysqlite driver has no way to carry PRAGMAs in the URL, so the profile is
+    # validated here and applied by unit_of_work.create_sqlite_engine on connect
+    get_sqlite_pragmas(profile)
     return f"sqlite:///bookmarks.db"
 
 
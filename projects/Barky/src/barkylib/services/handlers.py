@@ -63,6 +63,9 @@ EVENT_HANDLERS = {
     events.BookmarkEdited: [edit_bookmark],
 }  # type: Dict[Type[events.Event], List[Callable]]
 
+# the batch-aware versions of event handlers, used when the bus batches events
+BATCH_EVENT_HANDLERS = {}  # type: Dict[Callable, Callable]
+
 COMMAND_HANDLERS = {
     commands.AddBookmarkCommand: add_bookmark,
     commands.ListBookmarksCommand: list_bookmarks,
@@ -1,7 +1,8 @@
 from __future__ import annotations
 
 import logging
-from typing import TYPE_CHECKING, Callable, Dict, List, Type, Union
+from collections import deque
+from typing import TYPE_CHECKING, Callable, Deque, Dict, List, Optional, Type, Union
 
 from barkylib.domain import commands, events
 
@@ -19,38 +20,85 @@ class MessageBus:
         uow: unit_of_work.AbstractUnitOfWork,
         event_handlers: Dict[Type[events.Event], List[Callable]],
         command_handlers: Dict[Type[commands.Command], Callable],
+        batch_event_handlers: Optional[
+            Dict[Type[events.Event], List[Optional[Callable]]]
+        ] = None,
     ):
         self.uow = uow
         self.event_handlers = event_handlers
         self.command_handlers = command_handlers
+        # when given, consecutive events of the same type are handled together:
+        # batch_event_handlers[event_type][i] takes the whole list of events in place
+        # of event_handlers[event_type][i], or is None to call that handler per event
+        self.batch_event_handlers = batch_event_handlers
+        # message type -> the method handling it, filled in as types are first seen
+        self._dispatch = (
+            {}
+        )  # type: Dict[type, Callable[[Message, Deque[Message]], None]]
 
     def handle(self, message: Message):
-        self.queue = [message]
-        while self.queue:
-            message = self.queue.pop(0)
-            if isinstance(message, events.Event):
-                self.handle_event(message)
-            elif isinstance(message, commands.Command):
-                self.handle_command(message)
-            else:
-                raise Exception(f"{message} was not an Event or Command")
+        # each call gets its own queue, so concurrent calls do not share messages
+        queue = deque([message])  # type: Deque[Message]
+        while queue:
+            message = queue.popleft()
+            self._dispatcher(message)(message, queue)
+
+    def _dispatcher(self, message: Message):
+        try:
+            return self._dispatch[type(message)]
+        except KeyError:
+            pass
+        # a type not seen before: walk its MRO once, then cache the answer
+        for base in type(message).__mro__:
+            if base is events.Event:
+                dispatcher = self._dispatch_event
+                break
+            if base is commands.Command:
+                dispatcher = self.handle_command
+                break
+        else:
+            raise Exception(f"{message} was not an Event or Command")
+        self._dispatch[type(message)] = dispatcher
+        return dispatcher
 
-    def handle_event(self, event: events.Event):
+    def _dispatch_event(self, event: events.Event, queue: Deque[Message]):
+        if self.batch_event_handlers is None:
+            self.handle_event(event, queue)
+        else:
+            batch = [event]
+            while queue and type(queue[0]) is type(event):
+                batch.append(queue.popleft())
+            self.handle_events(batch, queue)
+
+    def handle_event(self, event: events.Event, queue: Deque[Message]):
         for handler in self.event_handlers[type(event)]:
-            try:
-                logger.debug("handling event %s with handler %s", event, handler)
-                handler(event)
-                self.queue.extend(self.uow.collect_new_events())
-            except Exception:
-                logger.exception("Exception handling event %s", event)
-                continue
-
-    def handle_command(self, command: commands.Command):
+            self._call_event_handler(handler, event, queue)
+
+    def handle_events(self, batch: List[events.Event], queue: Deque[Message]):
+        handlers = self.event_handlers[type(batch[0])]
+        batch_handlers = self.batch_event_handlers.get(type(batch[0]), [])
+        for i, handler in enumerate(handlers):
+            batch_handler = batch_handlers[i] if i < len(batch_handlers) else None
+            if batch_handler is not None:
+                self._call_event_handler(batch_handler, batch, queue)
+            else:
+                for event in batch:
+                    self._call_event_handler(handler, event, queue)
+
+    def _call_event_handler(self, handler, event, queue: Deque[Message]):
+        try:
+            logger.debug("handling event %s with handler %s", event, handler)
+            handler(event)
+            queue.extend(self.uow.collect_new_events())
+        except Exception:
+            logger.exception("Exception handling event %s", event)
+
+    def handle_command(self, command: commands.Command, queue: Deque[Message]):
         logger.debug("handling command %s", command)
         try:
             handler = self.command_handlers[type(command)]
             handler(command)
-            self.queue.extend(self.uow.collect_new_events())
+            queue.extend(self.uow.collect_new_events())
         except Exception:
             logger.exception("Exception handling command %s", command)
             raise
@@ -5,7 +5,7 @@ from abc import ABC
 
 from barkylib import config
 from barkylib.adapters import repository
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm.session import Session
 
@@ -36,11 +36,26 @@ class AbstractUnitOfWork(ABC):
         raise NotImplementedError
 
 
+def create_sqlite_engine(url=None, profile=None, **kwargs):
+    """
+    Creates an engine that applies one of the config.SQLITE_PROFILES to every new connection
+    """
+    pragmas = config.get_sqlite_pragmas(profile)
+    engine = create_engine(url or config.get_sqlite_file_url(profile), **kwargs)
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, _):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in pragmas.items():
+            cursor.execute(f"PRAGMA {pragma} = {value}")
+        cursor.close()
+
+    return engine
+
+
+# SQLite only knows SERIALIZABLE and READ UNCOMMITTED, so the pysqlite default is kept
 DEFAULT_SESSION_FACTORY = sessionmaker(
-    bind=create_engine(
-        config.get_sqlite_file_url(),
-        isolation_level="REPEATABLE READ",
-    )
+    bind=create_sqlite_engine(config.get_sqlite_file_url())
 )
 
 
@@ -0,0 +1,32 @@
+import pytest
+from barkylib import config
+from barkylib.services import unit_of_work
+from barkylib.services.unit_of_work import create_sqlite_engine
+
+
+def test_sqlite_engine_applies_the_chosen_profile(tmp_path):
+    engine = create_sqlite_engine(f"sqlite:///{tmp_path / 'bookmarks.db'}", "balanced")
+
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert connection.exec_driver_sql("PRAGMA synchronous").scalar() == 1  # NORMAL
+        assert connection.exec_driver_sql("PRAGMA temp_store").scalar() == 2  # MEMORY
+
+
+def test_unknown_sqlite_profile_is_rejected():
+    with pytest.raises(ValueError, match="Unknown profile"):
+        config.get_sqlite_file_url("reckless")
+
+
+def test_default_session_factory_connects_with_the_default_profile(
+    tmp_path, monkeypatch
+):
+    # the default database is bookmarks.db in the working directory
+    monkeypatch.chdir(tmp_path)
+
+    session = unit_of_work.DEFAULT_SESSION_FACTORY()
+    try:
+        assert session.execute("PRAGMA journal_mode").scalar() == "wal"
+        assert session.execute("PRAGMA synchronous").scalar() == 2  # FULL
+    finally:
+        session.close()
@@ -7,6 +7,7 @@ This module facilitates an infinite loop that:
     (A) Add a bookmark
     (B) List bookmarks by date
     (T) List bookmarks by title
+    (S) Search bookmarks
     (D) Delete a bookmark
     (Q) Quit
 3. Gets the user’s choice
@@ -93,6 +94,10 @@ def get_new_bookmark_data():
     }
 
 
+def get_search_terms():
+    return get_user_input("Search for")
+
+
 def get_bookmark_id_for_deletion():
     return get_user_input("Enter a bookmark ID to delete")
 
@@ -131,6 +136,11 @@ def loop():
         "T": Option(
             "List bookmarks by title", commands.ListBookmarksCommand(order_by="title")
         ),
+        "S": Option(
+            "Search bookmarks",
+            commands.SearchBookmarksCommand(),
+            prep_call=get_search_terms,
+        ),
         "E": Option(
             "Edit a bookmark",
             commands.EditBookmarkCommand(),
@@ -158,7 +168,9 @@ def loop():
 
 # this ensures that this module runs first
 if __name__ == "__main__":
-    commands.CreateBookmarksTableCommand().execute()
+    report = commands.CreateBookmarksTableCommand().execute()
+    if report:
+        print(report)
 
     # endless program loop
     while True:
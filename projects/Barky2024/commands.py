@@ -3,18 +3,57 @@ This module utilizes the command pattern - https://en.wikipedia.org/wiki/Command
 specify and implement the business logic layer
 """
 import sys
+import threading
 from abc import ABC, abstractmethod
 from datetime import datetime
 
-import requests
-
 from database import DatabaseManager
+from github import GitHubStarsClient
+
+DATABASE_FILENAME = "bookmarks.db"
+
+# the columns of the bookmarks table that get an index by default
+BOOKMARK_INDEXES = ["date_added", "title"]
+# the text columns of the bookmarks table that re-adding (or re-importing) a url may change
+BOOKMARK_UPDATE_COLUMNS = ["title", "notes"]
+# the text columns of the bookmarks table covered by full-text search
+BOOKMARK_SEARCH_COLUMNS = ["title", "url", "notes"]
+
+
+# the DatabaseManager shared by every command; opened on first use instead of at import
+_database = None
+_database_lock = threading.Lock()
+
 
-# module scope
-db = DatabaseManager("bookmarks.db")
+def get_database():
+    """
+    Returns the shared DatabaseManager, creating it on first use. The manager hands each
+    thread its own pooled connection, so commands can run on any thread.
+    """
+    global _database
+    with _database_lock:
+        if _database is None:
+            _database = DatabaseManager(DATABASE_FILENAME)
+        return _database
+
+
+def set_database(database):
+    """
+    Swaps in another DatabaseManager (or None to go back to the default on next use),
+    closing the previous one.
+    """
+    global _database
+    with _database_lock:
+        previous, _database = _database, database
+    if previous is not None and previous is not database:
+        previous.close()
 
 
 class Command(ABC):
+    @property
+    def db(self):
+        return get_database()
+
     @abstractmethod
     def execute(self, data):
         raise NotImplementedError("A command must implement the execute method")
@@ -22,11 +61,12 @@ class Command(ABC):
 
 class CreateBookmarksTableCommand(Command):
     """
-    uses the DatabaseManager to create the bookmarks table
+    uses the DatabaseManager to create the bookmarks table and its default indexes;
+    returns a report of the duplicate bookmarks it merged, if it had to merge any
     """
 
     def execute(self, data=None):
-        db.create_table(
+        self.db.create_table(
             "bookmarks",
             {
                 "id": "integer primary key autoincrement",
@@ -36,6 +76,37 @@ class CreateBookmarksTableCommand(Command):
                 "date_added": "text not null",
             },
         )
+        # ListBookmarksCommand sorts on date_added or title
+        for column in BOOKMARK_INDEXES:
+            self.db.create_index("bookmarks", column)
+        # a bookmark is identified by its url, so adding one twice updates it instead
+        merged = []
+        if not self.db.schema_object_exists("uq_bookmarks_url", "index"):
+            # one-off migration: older databases had a plain url index and may already
+            # hold duplicates, which are folded together before the unique index goes on
+            merged = self.db.merge_duplicates("bookmarks", ["url"], merge_bookmarks)
+            self.db.drop_index("idx_bookmarks_url")
+            self.db.create_index(
+                "bookmarks", "url", index_name="uq_bookmarks_url", unique=True
+            )
+        self.db.create_search_index("bookmarks", BOOKMARK_SEARCH_COLUMNS)
+        if merged:
+            return "Merged duplicate bookmarks:\n" + "\n".join(
+                f"{rows[0]['url']} ({len(rows)} copies)" for rows in merged
+            )
+        return None
+
+
+def merge_bookmarks(rows):
+    """
+    Merges the bookmarks saved for one url, oldest first: the newest title wins and every
+    distinct note is kept, oldest first, so no note is lost to the merge.
+    """
+    notes = []
+    for row in rows:
+        if row["notes"] and row["notes"] not in notes:
+            notes.append(row["notes"])
+    return {"title": rows[-1]["title"], "notes": "\n".join(notes) or None}
 
 
 class AddBookmarkCommand(Command):
@@ -43,17 +114,44 @@ class AddBookmarkCommand(Command):
     This class will:
 
     1. Expect a dictionary containing the title, URL, and (optional) notes information for a bookmark.
-    2. Add the current datetime to the dictionary as date_added.
-    3. Insert the data into the bookmarks table using the DatabaseManager.add method.
+    2. Add the given timestamp (or else the current datetime) to the dictionary as date_added.
+    3. Insert the data into the bookmarks table using the DatabaseManager.upsert_many method - if the URL is already bookmarked, its title and notes are updated instead.
     4. Return a success message that will eventually be displayed by the presentation layer.
     """
 
     def execute(self, data, timestamp=None):
-        data["date_added"] = datetime.utcnow().isoformat()
-        db.add("bookmarks", data)
+        data["date_added"] = (timestamp or datetime.utcnow()).isoformat()
+        self.db.upsert_many(
+            "bookmarks", [data], ["url"], update_columns=BOOKMARK_UPDATE_COLUMNS
+        )
         return "Bookmark added!"
 
 
+class AddBookmarksCommand(Command):
+    """
+    The batch sibling of AddBookmarkCommand, meant for bulk loads. This class will:
+
+    1. Expect an iterable (a list or a generator) of bookmark dictionaries.
+    2. Add the given timestamp (or else the current datetime) as date_added to each dictionary that has none yet, one row at a time.
+    3. Upsert every row into the bookmarks table in one transaction using the DatabaseManager.upsert_many method, so URLs that are already bookmarked are updated only if their title or notes changed.
+    4. Return a success message with the number of bookmarks added or changed.
+    """
+
+    def execute(self, data, timestamp=None):
+        def stamped(bookmarks):
+            for bookmark in bookmarks:
+                if "date_added" not in bookmark:
+                    bookmark["date_added"] = (
+                        timestamp or datetime.utcnow()
+                    ).isoformat()
+                yield bookmark
+
+        bookmarks_added = self.db.upsert_many(
+            "bookmarks", stamped(data), ["url"], update_columns=BOOKMARK_UPDATE_COLUMNS
+        )
+        return f"{bookmarks_added} bookmarks added!"
+
+
 class ListBookmarksCommand(Command):
     """
     We need to review the bookmarks in the database.
@@ -61,13 +159,45 @@ class ListBookmarksCommand(Command):
     1. Accept the column to order by, and save it as an instance attribute.
     2. Pass this information along to db.select in its execute method.
     3. Return the result (using the cursor’s .fetchall() method) because select is a query.
+
+    For large tables, pass a page_size: execute then returns a generator of pages
+    (lists of at most page_size rows) fetched lazily with keyset pagination.
     """
 
-    def __init__(self, order_by="date_added"):
+    def __init__(self, order_by="date_added", page_size=None):
         self.order_by = order_by
+        self.page_size = page_size
 
     def execute(self, data=None):
-        return db.select("bookmarks", order_by=self.order_by).fetchall()
+        if self.page_size:
+            return self.db.select_pages(
+                "bookmarks", order_by=self.order_by, page_size=self.page_size
+            )
+        return self.db.select("bookmarks", order_by=self.order_by).fetchall()
+
+
+class SearchBookmarksCommand(Command):
+    """
+    Finding bookmarks by any words in their title, URL or notes.
+    To do so, this class will:
+    1. Turn the words typed by the user into a full-text query, matching every word as a prefix (so "pyth" finds "python").
+    2. Pass the query along to db.search, which ranks the matches best first.
+    3. Return the results, each ending with a snippet that highlights the matched words.
+    """
+
+    def __init__(self, limit=20):
+        self.limit = limit
+
+    def _to_match_query(self, text):
+        # quoting every word keeps punctuation in URLs (e.g. "http://") from being read as FTS5 syntax
+        words = text.split()
+        return " ".join('"{}"*'.format(word.replace('"', '""')) for word in words)
+
+    def execute(self, data):
+        match = self._to_match_query(data)
+        if not match:
+            return []
+        return self.db.search("bookmarks", match, limit=self.limit).fetchall()
 
 
 class DeleteBookmarkCommand(Command):
@@ -76,15 +206,27 @@ class DeleteBookmarkCommand(Command):
     """
 
     def execute(self, data):
-        db.delete("bookmarks", {"id": data})
+        self.db.delete("bookmarks", {"id": data})
         return "Bookmark deleted!"
 
 
 class ImportGitHubStarsCommand(Command):
     """
     Import starred repos in Github - credit Dane Hillard
+
+    The GitHubStarsClient fetches the pages of starred repos (concurrently, once it knows how
+    many there are), and each page is written in one transaction.
+    The ETag of every page written is kept in the github_etags table, so a re-import only
+    downloads and writes the pages that changed since.
+
+    Re-importing is idempotent: the URLs already bookmarked are loaded into a set in one query
+    up front, and every page is upserted on url, so known repos are only rewritten if their
+    name or description changed.
     """
 
+    def __init__(self, client=None):
+        self.client = client or GitHubStarsClient()
+
     def _extract_bookmark_info(self, repo):
         return {
             "title": repo["name"],
@@ -92,40 +234,63 @@ class ImportGitHubStarsCommand(Command):
             "notes": repo["description"],
         }
 
+    def _extract_timestamp(self, repo_info, preserve_timestamps):
+        if preserve_timestamps:
+            return datetime.strptime(repo_info["starred_at"], "%Y-%m-%dT%H:%M:%SZ")
+        return datetime.utcnow()
+
     def execute(self, data):
         bookmarks_imported = 0
+        bookmarks_updated = 0
+        pages_unchanged = 0
 
-        github_username = data["github_username"]
-        next_page_of_results = f"https://api.github.com/users/{github_username}/starred"
-        while next_page_of_results:
-            stars_response = requests.get(
-                next_page_of_results,
-                headers={"Accept": "application/vnd.github.v3.star+json"},
+        self.db.create_table(
+            "github_etags", {"url": "text primary key", "etag": "text not null"}
+        )
+        etags = dict(self.db.select("github_etags").fetchall())
+        known_urls = set(self.db.select_values("bookmarks", "url"))
+
+        for page in self.client.starred_pages(data["github_username"], etags):
+            if page.stars is None:
+                pages_unchanged += 1
+                continue
+
+            bookmarks = {}
+            for repo_info in page.stars:
+                bookmark = self._extract_bookmark_info(repo_info["repo"])
+                timestamp = self._extract_timestamp(
+                    repo_info, data["preserve_timestamps"]
+                )
+                bookmark["date_added"] = timestamp.isoformat()
+                bookmarks[bookmark["url"]] = bookmark
+
+            new_urls = bookmarks.keys() - known_urls
+            bookmarks_changed = self.db.upsert_many(
+                "bookmarks",
+                bookmarks.values(),
+                ["url"],
+                update_columns=BOOKMARK_UPDATE_COLUMNS,
             )
-            next_page_of_results = stars_response.links.get("next", {}).get("url")
-
-            for repo_info in stars_response.json():
-                repo = repo_info["repo"]
-
-                if data["preserve_timestamps"]:
-                    timestamp = datetime.strptime(
-                        repo_info["starred_at"], "%Y-%m-%dT%H:%M:%SZ"
-                    )
-                else:
-                    timestamp = None
-
-                bookmarks_imported += 1
-                AddBookmarkCommand().execute(
-                    self._extract_bookmark_info(repo),
-                    timestamp=timestamp,
+            bookmarks_imported += len(new_urls)
+            bookmarks_updated += bookmarks_changed - len(new_urls)
+            known_urls.update(new_urls)
+
+            if page.etag:
+                self.db.upsert_many(
+                    "github_etags", [{"url": page.url, "etag": page.etag}], ["url"]
                 )
 
-        return f"Imported {bookmarks_imported} bookmarks from starred repos!"
+        message = f"Imported {bookmarks_imported} bookmarks from starred repos!"
+        if bookmarks_updated:
+            message += f" ({bookmarks_updated} existing bookmarks updated)"
+        if pages_unchanged:
+            message += f" ({pages_unchanged} unchanged pages skipped)"
+        return message
 
 
 class EditBookmarkCommand(Command):
     def execute(self, data):
-        db.update(
+        self.db.update(
             "bookmarks",
             {"id": data["id"]},
             data["update"],
@@ -21,16 +21,298 @@ CREATE TABLE IF NOT EXISTS bookmarks
 """
 
 import sqlite3
+import threading
+import weakref
+from contextlib import contextmanager
+
+# how many rows are handed to a single executemany call during bulk inserts
+DEFAULT_CHUNK_SIZE = 1000
+# how many rows are pulled from a cursor (or returned in a page) at a time while streaming
+DEFAULT_BATCH_SIZE = 500
+# how many generated SQL strings (and sqlite3 prepared statements) are kept per connection
+DEFAULT_CACHED_STATEMENTS = 256
+
+# named durability/performance profiles, applied as PRAGMAs when the connection is opened
+# https://www.sqlite.org/pragma.html
+# all of them use write-ahead logging so readers never block on a writer (and vice versa);
+# they differ in how much durability they trade away for speed:
+# - safe: fsync on every commit, nothing that survives a crash is lost
+# - balanced: fsync at checkpoints only; a power cut may lose the last commits, but never corrupts
+# - bulk-load: no fsyncs at all - only for imports that can simply be re-run
+PROFILES = {
+    "safe": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "mmap_size": 0,
+        "cache_size": -2000,  # negative values are KiB, so ~2 MB
+        "temp_store": "DEFAULT",
+    },
+    "balanced": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -16000,
+        "temp_store": "MEMORY",
+    },
+    "bulk-load": {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64000,
+        "temp_store": "MEMORY",
+    },
+}
+DEFAULT_PROFILE = "safe"
+# how many threads may run queries at the same time (writes are always one at a time)
+DEFAULT_MAX_READERS = 4
+
+
+class ConnectionPool:
+    """
+    A sqlite3 connection can only be used by the thread that opened it, so the pool:
+    1. Opens one connection per thread, lazily, the first time that thread checks one out, and closes it once the thread has finished
+    2. Lets at most max_readers threads run queries at once (reader); a thread holds its reader slot until every cursor it is reading from has been used up or closed, and takes no second slot for a nested query
+    3. Lets exactly one thread write at a time (writer), so writers queue up in Python instead of failing with "database is locked"
+    4. Applies the current profile to each connection, including ones opened before a profile switch
+    """
+
+    def __init__(
+        self,
+        database_filename,
+        max_readers=DEFAULT_MAX_READERS,
+        cached_statements=DEFAULT_CACHED_STATEMENTS,
+        profile=DEFAULT_PROFILE,
+    ):
+        if profile not in PROFILES:
+            raise ValueError(
+                f"Unknown profile {profile!r}, expected one of {', '.join(PROFILES)}"
+            )
+
+        self.database_filename = database_filename
+        self.cached_statements = cached_statements
+        self.profile = profile
+        self._local = threading.local()
+        self._readers = threading.BoundedSemaphore(max_readers)
+        self._writer = threading.Lock()
+        self._connections_lock = threading.Lock()
+        self._connections = []
+
+    def connection(self):
+        """
+        Returns the calling thread's connection, opening it (or bringing its profile up to date) first.
+        """
+        owner = getattr(self._local, "owner", None)
+        if owner is None:
+            # each connection only ever runs statements on its own thread; turning off
+            # check_same_thread just lets it be closed from another one
+            connection = sqlite3.connect(
+                self.database_filename,
+                cached_statements=self.cached_statements,
+                check_same_thread=False,
+            )
+            owner = self._local.owner = _ConnectionOwner(connection)
+            with self._connections_lock:
+                self._connections.append(connection)
+            # a thread's locals are dropped when it finishes, and its connection with them
+            weakref.finalize(
+                owner,
+                _close_connection,
+                connection,
+                self._connections,
+                self._connections_lock,
+            )
+
+        connection = owner.connection
+        if owner.profile != self.profile and not connection.in_transaction:
+            for pragma, value in PROFILES[self.profile].items():
+                connection.execute(f"PRAGMA {pragma} = {value}")
+            owner.profile = self.profile
+
+        return connection
+
+    @contextmanager
+    def reader(self):
+        release = self.acquire_reader()
+        try:
+            yield self.connection()
+        finally:
+            release()
+
+    def acquire_reader(self):
+        """
+        Takes a reader slot for the calling thread, unless it already holds one, and returns
+        the function that gives it back (safe to call more than once, and from any thread).
+        """
+        state = getattr(self._local, "reads", None)
+        if state is None:
+            state = self._local.reads = [0]
+        if state[0] == 0:
+            self._readers.acquire()
+        state[0] += 1
+        released = []
+
+        def release():
+            if not released:
+                released.append(True)
+                state[0] -= 1
+                if state[0] == 0:
+                    self._readers.release()
+
+        return release
+
+    @contextmanager
+    def writer(self):
+        with self._writer:
+            yield self.connection()
+
+    def close(self):
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+        self._local = threading.local()
+
+
+class _ConnectionOwner:
+    """
+    Holds a thread's connection (and the profile applied to it) in the pool's thread-local
+    storage, so it can be closed once the thread is gone.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.profile = None
+
+
+def _close_connection(connection, connections, lock):
+    with lock:
+        if connection in connections:
+            connections.remove(connection)
+    connection.close()
+
+
+class ReaderCursor:
+    """
+    A sqlite3 cursor that keeps its thread's reader slot until it has been read to the end
+    (or closed), since SQLite does the work of a query as its rows are fetched.
+    Everything other than fetching is passed straight through to the cursor.
+    """
+
+    def __init__(self, cursor, release):
+        self._cursor = cursor
+        self._release = release
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __del__(self):
+        self._release()
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is None:
+            self._release()
+        return row
+
+    def fetchmany(self, size=None):
+        size = self._cursor.arraysize if size is None else size
+        rows = self._cursor.fetchmany(size)
+        if len(rows) < size:
+            self._release()
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._release()
+        return rows
+
+    def close(self):
+        self._release()
+        self._cursor.close()
 
 
 class DatabaseManager:
-    def __init__(self, database_filename) -> None:
+    def __init__(
+        self,
+        database_filename,
+        cached_statements=DEFAULT_CACHED_STATEMENTS,
+        profile=DEFAULT_PROFILE,
+        max_readers=DEFAULT_MAX_READERS,
+    ) -> None:
         # added this to persist the name of the database file
         self.database_filename = database_filename
-        self.connection = sqlite3.connect(database_filename)
+        # sqlite3 keeps its own cache of prepared statements keyed on the exact SQL text,
+        # so handing it the same string every time (see _statement) means it only compiles once
+        self.pool = ConnectionPool(
+            database_filename,
+            max_readers=max_readers,
+            cached_statements=cached_statements,
+            profile=profile,
+        )
+        self.cached_statements = cached_statements
+        self._statements = {}
+        self._statements_lock = threading.RLock()
+        self.statement_cache_hits = 0
+        self.statement_cache_misses = 0
+        # open this thread's connection right away, so a bad filename fails here
+        self.pool.connection()
 
     def __del__(self):
-        self.connection.close()
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        Closes the connection of every thread that used this manager.
+        """
+        self.pool.close()
+
+    @property
+    def connection(self):
+        """
+        The calling thread's connection - every thread gets its own from the pool.
+        """
+        return self.pool.connection()
+
+    @property
+    def profile(self):
+        return self.pool.profile
+
+    def apply_profile(self, profile):
+        """
+        Switches the connection to one of the named PROFILES:
+        1. Look up the PRAGMA settings for the profile
+        2. Execute each PRAGMA outside of a transaction (journal_mode cannot change inside one)
+        3. Remember the profile, so a bulk import can switch to "bulk-load" and back again afterwards
+        (other threads' connections pick it up on their next checkout)
+        """
+        if profile not in PROFILES:
+            raise ValueError(
+                f"Unknown profile {profile!r}, expected one of {', '.join(PROFILES)}"
+            )
+
+        self.pool.profile = profile
+        self.pool.connection()
 
     def _execute(self, statement, values=None):
         """
@@ -42,12 +324,60 @@ class DatabaseManager:
         4. Return the cursor, which has stored the result of the executed statement (if any)
 
         this is designed to use placeholders in SQL statements to insert values
+
+        statements run through _execute may write, so they hold the pool's writer lock
         """
-        with self.connection:  # https://www.pythonforbeginners.com/files/with-statement-in-python
-            cursor = self.connection.cursor()
+        # https://www.pythonforbeginners.com/files/with-statement-in-python
+        with self.pool.writer() as connection, connection:
+            cursor = connection.cursor()
             cursor.execute(statement, values or [])
             return cursor
 
+    def _query(self, statement, values=None):
+        """
+        The read-only sibling of _execute: it takes one of the pool's reader slots instead of
+        the writer lock, so queries from different threads run side by side. The slot is held
+        by the returned ReaderCursor until its rows have all been fetched or it is closed.
+        """
+        release = self.pool.acquire_reader()
+        try:
+            cursor = self.pool.connection().cursor()
+            cursor.execute(statement, values or [])
+        except BaseException:
+            release()
+            raise
+        return ReaderCursor(cursor, release)
+
+    def _statement(self, key, build):
+        """
+        The _statement method caches generated SQL text:
+        1. Accept a key - (operation, table, column tuple, order_by) - and a function that builds the SQL
+        2. Return the SQL already built for that key, counting a hit
+        3. Otherwise build it, remember it (forgetting the oldest entry when the cache is full) and count a miss
+        """
+        with self._statements_lock:
+            statement = self._statements.get(key)
+            if statement is not None:
+                self.statement_cache_hits += 1
+                return statement
+
+            self.statement_cache_misses += 1
+            if len(self._statements) >= self.cached_statements:
+                del self._statements[next(iter(self._statements))]
+            statement = self._statements[key] = build()
+            return statement
+
+    def statement_cache_info(self):
+        """
+        Reports how well the SQL text cache is doing.
+        """
+        return {
+            "hits": self.statement_cache_hits,
+            "misses": self.statement_cache_misses,
+            "size": len(self._statements),
+            "max_size": self.cached_statements,
+        }
+
     def create_table(self, table_name, columns):
         """
         The method offers a flexible way to pass data definition:
@@ -80,6 +410,134 @@ class DatabaseManager:
             """
         )
 
+    def create_index(self, table_name, columns, index_name=None, unique=False):
+        """
+        Indexes let SQLite find and sort rows without scanning the whole table:
+        CREATE INDEX IF NOT EXISTS idx_bookmarks_title
+        ON bookmarks (title);
+
+        This method:
+        1. Accepts the table name, a column name (or a list of them, for a composite index), an optional index name and whether the index is UNIQUE
+        2. Names the index idx_<table>_<columns> when no name is given
+        3. Executes the statement with _execute and returns the index name
+        """
+        if isinstance(columns, str):
+            columns = [columns]
+        index_name = index_name or f"idx_{table_name}_{'_'.join(columns)}"
+
+        self._execute(
+            f"""
+            CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {index_name}
+            ON {table_name} ({', '.join(columns)});
+            """
+        )
+        return index_name
+
+    def drop_index(self, index_name):
+        """
+        The method drops an index (the table and its rows are left alone).
+        """
+        self._execute(
+            f"""
+            DROP INDEX IF EXISTS {index_name};
+            """
+        )
+
+    def create_search_index(self, table_name, columns):
+        """
+        Full-text search with SQLite's FTS5 extension - https://www.sqlite.org/fts5.html
+        CREATE VIRTUAL TABLE IF NOT EXISTS bookmarks_fts
+        USING fts5(title, url, notes, content='bookmarks', content_rowid='id');
+
+        This method:
+        1. Accepts the table name and the list of text columns to search
+        2. Creates an "external content" FTS5 table named <table>_fts, which stores only the search index and reads the text itself from the original table
+        3. Creates triggers that keep the index in step with every INSERT, UPDATE and DELETE on the table
+        4. Builds the index when the FTS5 table was only just created, so rows that already existed become searchable too;
+           an existing index is kept in step by the triggers and left alone (see rebuild_search_index)
+        """
+        search_table = f"{table_name}_fts"
+        column_names = ", ".join(columns)
+        new_values = ", ".join(f"new.{column}" for column in columns)
+        old_values = ", ".join(f"old.{column}" for column in columns)
+        created = not self.schema_object_exists(search_table)
+
+        self._execute(
+            f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {search_table}
+            USING fts5({column_names}, content='{table_name}', content_rowid='id');
+            """
+        )
+        self._execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {search_table}_ai AFTER INSERT ON {table_name} BEGIN
+                INSERT INTO {search_table} (rowid, {column_names})
+                VALUES (new.id, {new_values});
+            END;
+            """
+        )
+        self._execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {search_table}_ad AFTER DELETE ON {table_name} BEGIN
+                INSERT INTO {search_table} ({search_table}, rowid, {column_names})
+                VALUES ('delete', old.id, {old_values});
+            END;
+            """
+        )
+        self._execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {search_table}_au AFTER UPDATE ON {table_name} BEGIN
+                INSERT INTO {search_table} ({search_table}, rowid, {column_names})
+                VALUES ('delete', old.id, {old_values});
+                INSERT INTO {search_table} (rowid, {column_names})
+                VALUES (new.id, {new_values});
+            END;
+            """
+        )
+        if created:
+            self.rebuild_search_index(table_name)
+
+    def rebuild_search_index(self, table_name):
+        """
+        Re-reads every row of the table into its FTS5 index - a full pass over the table, for
+        when the index was built before the triggers existed or is suspected to be out of step:
+        INSERT INTO bookmarks_fts(bookmarks_fts) VALUES('rebuild');
+        """
+        search_table = f"{table_name}_fts"
+        self._execute(
+            f"""
+            INSERT INTO {search_table} ({search_table}) VALUES ('rebuild');
+            """
+        )
+
+    def schema_object_exists(self, name, object_type="table"):
+        """
+        Looks a table, index or trigger up by name in the schema:
+        SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'uq_bookmarks_url';
+        """
+        with self._query(
+            "SELECT 1 FROM sqlite_master WHERE type = ? AND name = ?;",
+            [object_type, name],
+        ) as cursor:
+            return cursor.fetchone() is not None
+
+    def explain(self, query, values=None):
+        """
+        Shows how SQLite will run a query, to check that it walks an index instead of scanning:
+        EXPLAIN QUERY PLAN
+        SELECT * FROM bookmarks ORDER BY title;
+        -> SCAN bookmarks USING INDEX idx_bookmarks_title
+
+        Returns the detail line of each step of the plan.
+        """
+        # sqlite3 does not re-prepare a cached EXPLAIN after the schema changes (e.g. an index
+        # was dropped), so the schema version goes into the SQL text to keep the plan current
+        (schema_version,) = self.connection.execute("PRAGMA schema_version").fetchone()
+        cursor = self._query(
+            f"EXPLAIN QUERY PLAN /* schema {schema_version} */ {query}", values
+        )
+        return [detail for _, _, _, detail in cursor.fetchall()]
+
     def add(self, table_name, data):
         """
         Adding records using placeholders in SQL insert statements:
@@ -94,19 +552,137 @@ class DatabaseManager:
         4. Gets the column values as a tuple (A dictionary’s .values() returns a dict_ values object, which happens not to work with sqlite3’s execute method.)
         5. Executes the statement with _execute, passing the SQL statement with placeholders and the column values as separate arguments
         """
-        placeholders = ", ".join("?" * len(data))
-        column_names = ", ".join(data.keys())
+        columns = tuple(data.keys())
         column_values = tuple(data.values())
 
-        self._execute(
-            f"""
+        self._execute(self._insert_statement(table_name, columns), column_values)
+
+    def _insert_statement(self, table_name, columns):
+        def build():
+            placeholders = ", ".join("?" * len(columns))
+            column_names = ", ".join(columns)
+            return f"""
             INSERT INTO {table_name}
             ({column_names})
             VALUES ({placeholders});
-            """,
-            column_values,
+            """
+
+        return self._statement(("insert", table_name, columns, None), build)
+
+    def add_many(self, table_name, rows, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Adding many records at once, in a single transaction:
+        INSERT INTO bookmarks
+        (title, url, notes, date_added)
+        VALUES (?, ?, ?, ?);  -- executed once per row via executemany
+
+        This method:
+        1. Accepts the name of the table and an iterable (a list or a generator) of dictionaries that map column names to column values
+        2. Groups consecutive rows that share the same column names, since each group needs its own INSERT statement
+        3. Hands each group to the cursor's executemany in chunks of at most chunk_size rows, so a generator is never fully materialized
+        4. Runs every chunk inside one transaction, so the whole import is committed (or rolled back) once
+        5. Returns the number of rows inserted
+        """
+        return self._insert_rows(
+            rows,
+            chunk_size,
+            lambda columns: self._insert_statement(table_name, columns),
         )
 
+    def upsert_many(
+        self,
+        table_name,
+        rows,
+        conflict_columns,
+        update_columns=None,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+    ):
+        """
+        Inserting rows, or updating the ones that already exist ("upserting"), in a single transaction:
+        INSERT INTO bookmarks
+        (title, url, notes, date_added)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (url) DO UPDATE
+        SET title = excluded.title, notes = excluded.notes
+        WHERE title IS NOT excluded.title OR notes IS NOT excluded.notes;
+
+        This method:
+        1. Accepts the same arguments as add_many, plus the columns of a UNIQUE index that identify a row (e.g. ["url"]) and optionally which columns an existing row may have updated (by default, all of the others)
+        2. Inserts rows that do not exist yet
+        3. Updates existing rows only if one of their update columns actually changed, so unchanged rows cost no write at all (and fire no triggers)
+        4. Returns the number of rows inserted or changed
+        """
+        conflict_columns = tuple(conflict_columns)
+        if update_columns is not None:
+            update_columns = tuple(update_columns)
+
+        def statement(columns):
+            def build():
+                insert = (
+                    self._insert_statement(table_name, columns).rstrip().rstrip(";")
+                )
+                updates = [
+                    column
+                    for column in columns
+                    if column not in conflict_columns
+                    and (update_columns is None or column in update_columns)
+                ]
+                if not updates:
+                    return f"""{insert}
+            ON CONFLICT ({', '.join(conflict_columns)}) DO NOTHING;
+            """
+
+                assignments = ", ".join(
+                    f"{column} = excluded.{column}" for column in updates
+                )
+                changed = " OR ".join(
+                    f"{column} IS NOT excluded.{column}" for column in updates
+                )
+                return f"""{insert}
+            ON CONFLICT ({', '.join(conflict_columns)}) DO UPDATE
+            SET {assignments}
+            WHERE {changed};
+            """
+
+            key = (
+                "upsert",
+                table_name,
+                (columns, conflict_columns, update_columns),
+                None,
+            )
+            return self._statement(key, build)
+
+        return self._insert_rows(rows, chunk_size, statement)
+
+    def _insert_rows(self, rows, chunk_size, statement):
+        """
+        The shared loop behind add_many and upsert_many:
+        1. Groups consecutive rows that share the same column names
+        2. Executes the statement built for those columns with executemany, at most chunk_size rows at a time
+        3. Does all of it in one transaction and returns the number of rows changed
+        """
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+
+        changed = 0
+        with self.pool.writer() as connection, connection:
+            cursor = connection.cursor()
+            columns, chunk = None, []
+            for row in rows:
+                row_columns = tuple(row.keys())
+                if chunk and (row_columns != columns or len(chunk) >= chunk_size):
+                    cursor.executemany(statement(columns), chunk)
+                    changed += cursor.rowcount
+                    chunk = []
+                columns = row_columns
+                chunk.append(tuple(row.values()))
+
+            if chunk:
+                cursor.executemany(statement(columns), chunk)
+                changed += cursor.rowcount
+
+        return changed
+
     def delete(self, table_name, criteria):
         """
         We delete a record from the database in SQL using:
@@ -119,18 +695,145 @@ class DatabaseManager:
         3. Constructs the full DELETE FROM query and executes it with _execute.
 
         """
-        placeholders = [f"{column} = ?" for column in criteria.keys()]
-        delete_criteria = " AND ".join(placeholders)
-        self._execute(
-            f"""
+        columns = tuple(criteria.keys())
+
+        def build():
+            placeholders = [f"{column} = ?" for column in columns]
+            delete_criteria = " AND ".join(placeholders)
+            return f"""
             DELETE FROM {table_name}
             WHERE {delete_criteria};
-            """,
+            """
+
+        self._execute(
+            self._statement(("delete", table_name, columns, None), build),
             tuple(
                 criteria.values()
             ),  # https://www.w3schools.com/python/python_tuples.asp
         )
 
+    def merge_duplicates(self, table_name, columns, merge):
+        """
+        Folds rows that repeat the values of the given columns into the oldest (lowest id) of each group:
+        SELECT * FROM bookmarks
+        WHERE (url) IN (SELECT url FROM bookmarks GROUP BY url HAVING COUNT(*) > 1)
+        ORDER BY url, id;
+
+        This method:
+        1. Accepts the table name, the columns that should be unique, and a merge function
+        2. Calls merge with the rows of each group as dictionaries, oldest first; it returns the changes to make to the oldest row
+        3. Updates the oldest row and deletes the others, all in one transaction
+        4. Returns the merged groups, so the caller can report what was folded together
+        """
+        key = ", ".join(columns)
+        with self.pool.writer() as connection, connection:
+            cursor = connection.execute(
+                f"""
+                SELECT * FROM {table_name}
+                WHERE ({key}) IN (
+                    SELECT {key} FROM {table_name} GROUP BY {key} HAVING COUNT(*) > 1
+                )
+                ORDER BY {key}, id;
+                """
+            )
+            names = [description[0] for description in cursor.description]
+            groups = {}
+            for row in cursor.fetchall():
+                row = dict(zip(names, row))
+                groups.setdefault(tuple(row[column] for column in columns), []).append(
+                    row
+                )
+
+            for rows in groups.values():
+                changes = merge(rows)
+                if changes:
+                    assignments = ", ".join(f"{column} = ?" for column in changes)
+                    connection.execute(
+                        f"UPDATE {table_name} SET {assignments} WHERE id = ?;",
+                        [*changes.values(), rows[0]["id"]],
+                    )
+                connection.executemany(
+                    f"DELETE FROM {table_name} WHERE id = ?;",
+                    [(row["id"],) for row in rows[1:]],
+                )
+        return list(groups.values())
+
+    def update(self, table_name, criteria, changes):
+        """
+        We update records in SQL using:
+        UPDATE bookmarks
+        SET title = ?, notes = ?
+        WHERE id = ?;
+
+        This method:
+        1. Accepts the table name, a dictionary mapping column names to the value to match on (required, like delete), and a dictionary of the columns to change mapped to their new values
+        2. Only the columns in changes are touched, so partial updates leave every other column alone
+        3. Returns the number of rows changed
+        """
+        statement = self._update_statement(
+            table_name, tuple(criteria.keys()), tuple(changes.keys())
+        )
+        cursor = self._execute(
+            statement, tuple(changes.values()) + tuple(criteria.values())
+        )
+        return cursor.rowcount
+
+    def _update_statement(self, table_name, criteria_columns, change_columns):
+        def build():
+            assignments = ", ".join(f"{column} = ?" for column in change_columns)
+            update_criteria = " AND ".join(
+                f"{column} = ?" for column in criteria_columns
+            )
+            return f"""
+            UPDATE {table_name}
+            SET {assignments}
+            WHERE {update_criteria};
+            """
+
+        return self._statement(
+            ("update", table_name, (criteria_columns, change_columns), None), build
+        )
+
+    def update_many(self, table_name, updates, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Batched partial updates, e.g. re-tagging or rewriting the URLs of many bookmarks at once:
+        1. Accepts the table name and an iterable of (criteria, changes) pairs, each shaped like the arguments to update
+        2. Groups consecutive pairs that use the same criteria and change columns, since each group shares one UPDATE statement
+        3. Hands each group to the cursor's executemany in chunks of at most chunk_size pairs
+        4. Runs every chunk inside one transaction and returns the total number of rows changed
+        """
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+
+        updated = 0
+        with self.pool.writer() as connection, connection:
+            cursor = connection.cursor()
+            signature, chunk = None, []
+            for criteria, changes in updates:
+                update_signature = (tuple(criteria.keys()), tuple(changes.keys()))
+                if chunk and (
+                    update_signature != signature or len(chunk) >= chunk_size
+                ):
+                    updated += self._update_chunk(cursor, table_name, signature, chunk)
+                    chunk = []
+                signature = update_signature
+                chunk.append(tuple(changes.values()) + tuple(criteria.values()))
+
+            if chunk:
+                updated += self._update_chunk(cursor, table_name, signature, chunk)
+
+        return updated
+
+    def _update_chunk(self, cursor, table_name, signature, chunk):
+        """
+        Applies a chunk of updates that all share the same columns with one executemany call.
+        """
+        criteria_columns, change_columns = signature
+        cursor.executemany(
+            self._update_statement(table_name, criteria_columns, change_columns), chunk
+        )
+        return cursor.rowcount
+
     def select(self, table_name, criteria=None, order_by=None):
         """
         we commonly need to find, select, and sort data
@@ -144,17 +847,182 @@ class DatabaseManager:
         ORDER BY title;
         """
         criteria = criteria or {}
+        columns = tuple(criteria.keys())
 
-        query = f"SELECT * FROM {table_name}"
-        if criteria:
-            placeholders = [f"{column} = ?" for column in criteria.keys()]
-            select_criteria = " AND ".join(placeholders)
-            query += f" WHERE {select_criteria}"
+        def build():
+            query = f"SELECT * FROM {table_name}"
+            if columns:
+                placeholders = [f"{column} = ?" for column in columns]
+                select_criteria = " AND ".join(placeholders)
+                query += f" WHERE {select_criteria}"
 
-        if order_by:
-            query += f" ORDER BY {order_by}"
+            if order_by:
+                query += f" ORDER BY {order_by}"
+            return query
 
-        return self._execute(
-            query,
+        return self._query(
+            self._statement(("select", table_name, columns, order_by), build),
             tuple(criteria.values()),
         )
+
+    def select_iter(
+        self, table_name, criteria=None, order_by=None, batch_size=DEFAULT_BATCH_SIZE
+    ):
+        """
+        A streaming version of select, for tables too large to fetchall:
+        1. Accepts the same arguments as select, plus the number of rows to pull per round trip
+        2. Runs the query once and pulls rows from the cursor with fetchmany(batch_size)
+        3. Yields the rows one at a time, so at most batch_size rows are held in memory
+        """
+        cursor = self.select(table_name, criteria, order_by)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+
+    def select_values(self, table_name, column, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Streams the values of a single column of every row, e.g. to load all known URLs into a set in one query.
+        """
+        cursor = self._query(
+            self._statement(
+                ("select_values", table_name, (column,), None),
+                lambda: f"SELECT {column} FROM {table_name}",
+            )
+        )
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for (value,) in rows:
+                yield value
+
+    def select_page(
+        self,
+        table_name,
+        criteria=None,
+        order_by=None,
+        after_value=None,
+        after_id=None,
+        limit=DEFAULT_BATCH_SIZE,
+    ):
+        """
+        Keyset (a.k.a. seek) pagination - the next page starts after the last row seen rather than at an OFFSET:
+        SELECT * FROM bookmarks
+        WHERE (title, id) > (?, ?)
+        ORDER BY title, id
+        LIMIT 500;
+
+        This method:
+        1. Accepts the same arguments as select, plus the sort value and id of the last row of the previous page (leave both as None for the first page) and the page size
+        2. Always breaks ties on id, so every row has a unique position even when titles or dates repeat
+        3. Lets SQLite seek straight to the start of the page, so page 1000 costs the same as page 1 (the order_by column must be NOT NULL for this to hold)
+        4. Returns the cursor, just like select
+        """
+        criteria = criteria or {}
+        order_by = order_by or "id"
+        columns = tuple(criteria.keys())
+        seeking = after_id is not None
+
+        def build():
+            conditions = [f"{column} = ?" for column in columns]
+            if seeking:
+                if order_by == "id":
+                    conditions.append("id > ?")
+                else:
+                    conditions.append(f"({order_by}, id) > (?, ?)")
+
+            query = f"SELECT * FROM {table_name}"
+            if conditions:
+                query += f" WHERE {' AND '.join(conditions)}"
+
+            if order_by == "id":
+                query += " ORDER BY id"
+            else:
+                query += f" ORDER BY {order_by}, id"
+            return query + " LIMIT ?"
+
+        values = list(criteria.values())
+        if seeking:
+            if order_by != "id":
+                values.append(after_value)
+            values.append(after_id)
+        values.append(limit)
+
+        operation = "select_page_after" if seeking else "select_page"
+        return self._query(
+            self._statement((operation, table_name, columns, order_by), build),
+            tuple(values),
+        )
+
+    def select_pages(
+        self, table_name, criteria=None, order_by=None, page_size=DEFAULT_BATCH_SIZE
+    ):
+        """
+        Walks a whole table one keyset page at a time:
+        1. Fetches the first page with select_page
+        2. Remembers the sort value and id of the last row on the page
+        3. Yields the page, then asks select_page for the rows after that position, until a short page comes back
+        """
+        after_value = after_id = None
+        while True:
+            cursor = self.select_page(
+                table_name,
+                criteria,
+                order_by,
+                after_value=after_value,
+                after_id=after_id,
+                limit=page_size,
+            )
+            page = cursor.fetchall()
+            if page:
+                yield page
+            if len(page) < page_size:
+                break
+
+            columns = [description[0] for description in cursor.description]
+            last_row = page[-1]
+            after_id = last_row[columns.index("id")]
+            if order_by and order_by != "id":
+                after_value = last_row[columns.index(order_by)]
+
+    def search(
+        self,
+        table_name,
+        match,
+        limit=DEFAULT_BATCH_SIZE,
+        highlight=("[", "]"),
+        snippet_tokens=12,
+    ):
+        """
+        Ranked full-text search over the index built by create_search_index:
+        SELECT bookmarks.*, snippet(bookmarks_fts, -1, '[', ']', '…', 12)
+        FROM bookmarks_fts JOIN bookmarks ON bookmarks.id = bookmarks_fts.rowid
+        WHERE bookmarks_fts MATCH ?
+        ORDER BY bm25(bookmarks_fts)
+        LIMIT ?;
+
+        This method:
+        1. Accepts the table name, an FTS5 query (https://www.sqlite.org/fts5.html#full_text_query_syntax) and the most results to return
+        2. Ranks matches with bm25, best first
+        3. Returns the cursor; each row is a row of the table followed by a snippet of the best matching column, with the matched terms wrapped in the highlight markers
+        """
+        search_table = f"{table_name}_fts"
+
+        def build():
+            return f"""
+            SELECT {table_name}.*,
+                snippet({search_table}, -1, ?, ?, '…', ?)
+            FROM {search_table}
+            JOIN {table_name} ON {table_name}.id = {search_table}.rowid
+            WHERE {search_table} MATCH ?
+            ORDER BY bm25({search_table})
+            LIMIT ?;
+            """
+
+        start, end = highlight
+        return self._query(
+            self._statement(("search", table_name, (), None), build),
+            (start, end, snippet_tokens, match, limit),
+        )
@@ -0,0 +1,152 @@
+"""
+This module talks to the GitHub REST API - https://docs.github.com/en/rest - on behalf of
+the business logic layer, so commands.py only has to deal with bookmarks.
+
+Fetching someone's starred repos can take hundreds of requests, so the client:
+1. Reuses pooled connections through a single requests.Session
+2. Fetches the first page, reads the number of the last page from its Link header and then
+   prefetches the remaining pages concurrently
+3. Waits for the rate limit window to reset when the X-RateLimit-* headers say it is used up
+4. Sends the ETag of each page it has seen before as If-None-Match, so unchanged pages come
+   back as an empty 304 Not Modified (which GitHub does not count against the rate limit)
+"""
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+GITHUB_API_URL = "https://api.github.com"
+
+# one page of starred repos; stars is None when the page has not changed since its etag
+StarredPage = namedtuple("StarredPage", ["url", "etag", "stars"])
+
+
+class GitHubStarsClient:
+    def __init__(
+        self,
+        api_url=GITHUB_API_URL,
+        max_workers=4,
+        per_page=100,
+        max_retries=3,
+        session=None,
+        sleep=time.sleep,
+        clock=time.time,
+    ):
+        self.api_url = api_url.rstrip("/")
+        self.max_workers = max_workers
+        self.per_page = per_page
+        self.max_retries = max_retries
+        self._sleep = sleep
+        self._clock = clock
+
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        session.headers["Accept"] = "application/vnd.github.v3.star+json"
+        self.session = session
+
+        # the most recent rate limit state reported by GitHub, shared by the worker threads
+        self._rate_limit_lock = threading.Lock()
+        self.rate_limit_remaining = None
+        self.rate_limit_reset = None
+
+    def starred_pages(self, github_username, etags=None):
+        """
+        Yields a StarredPage for every page of repos starred by github_username, in order.
+
+        etags maps page URLs to the ETag they were last fetched with; those pages are
+        requested conditionally and yielded with stars=None when GitHub answers 304.
+        """
+        etags = etags or {}
+        first_url = (
+            f"{self.api_url}/users/{github_username}/starred?per_page={self.per_page}"
+        )
+        response = self._get(first_url, etags.get(first_url))
+        yield self._page(first_url, response)
+
+        last_url = response.links.get("last", {}).get("url")
+        if last_url is None and response.status_code == 304:
+            # a 304 need not carry a Link header, so count up to the last page seen before
+            last_url = self._last_known_page_url(first_url, etags)
+        if last_url:
+            urls = self._page_urls(last_url)
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                yield from pool.map(lambda url: self._fetch(url, etags), urls)
+        else:
+            # no last page to count up to, so fall back to following the next links
+            next_url = response.links.get("next", {}).get("url")
+            while next_url:
+                response = self._get(next_url, etags.get(next_url))
+                yield self._page(next_url, response)
+                next_url = response.links.get("next", {}).get("url")
+
+    def _page_urls(self, last_url):
+        """
+        Builds the URLs of pages 2 through the last one from the URL of the last page.
+        """
+        parts = urlsplit(last_url)
+        query = parse_qs(parts.query)
+        last_page = int(query["page"][0])
+
+        urls = []
+        for page in range(2, last_page + 1):
+            query["page"] = [str(page)]
+            urls.append(urlunsplit(parts._replace(query=urlencode(query, doseq=True))))
+        return urls
+
+    def _last_known_page_url(self, first_url, etags):
+        path = urlsplit(first_url).path
+        known_pages = {}
+        for url in etags:
+            parts = urlsplit(url)
+            page = parse_qs(parts.query).get("page")
+            if parts.path == path and page:
+                known_pages[int(page[0])] = url
+        return known_pages[max(known_pages)] if known_pages else None
+
+    def _fetch(self, url, etags):
+        return self._page(url, self._get(url, etags.get(url)))
+
+    def _page(self, url, response):
+        if response.status_code == 304:
+            return StarredPage(url, response.headers.get("ETag"), None)
+        return StarredPage(url, response.headers.get("ETag"), response.json())
+
+    def _get(self, url, etag=None):
+        headers = {"If-None-Match": etag} if etag else {}
+        for _ in range(self.max_retries):
+            self._wait_for_rate_limit()
+            response = self.session.get(url, headers=headers)
+            self._record_rate_limit(response)
+            exhausted = response.headers.get("X-RateLimit-Remaining") == "0"
+            if response.status_code in (403, 429) and exhausted:
+                continue  # rate limited - wait for the reset and try again
+            response.raise_for_status()
+            return response
+
+        response.raise_for_status()
+        return response
+
+    def _wait_for_rate_limit(self):
+        with self._rate_limit_lock:
+            remaining, reset = self.rate_limit_remaining, self.rate_limit_reset
+        if remaining == 0 and reset is not None:
+            delay = reset - self._clock()
+            if delay > 0:
+                self._sleep(delay)
+
+    def _record_rate_limit(self, response):
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        reset = response.headers.get("X-RateLimit-Reset")
+        if remaining is None:
+            return
+
+        with self._rate_limit_lock:
+            self.rate_limit_remaining = int(remaining)
+            self.rate_limit_reset = int(reset) if reset is not None else None
@@ -3,6 +3,12 @@
 # commands.py and database.py
 
 # we will use pytest: https://docs.pytest.org/en/stable/index.html
+import os
+
+import pytest
+
+import commands
+from database import DatabaseManager
 
 
 # should we test quit? No, its behavior is self-evident and not logic dependent
@@ -12,3 +18,88 @@ def test_quit_command():
 
 # okay, should I test the other commands?
 # not really, they are tighly coupled with sqlite3 and its use in the database.py module
+# that changed once the commands stopped opening bookmarks.db at import: set_database
+# points every command at a throwaway database instead
+
+
+@pytest.fixture
+def database():
+    filename = "test_commands.db"
+    commands.set_database(DatabaseManager(filename))
+    commands.CreateBookmarksTableCommand().execute()
+    yield commands.get_database()
+    commands.set_database(None)
+    os.remove(filename)
+
+
+def test_add_bookmark_command_uses_the_configured_database(database):
+    # act
+    commands.AddBookmarkCommand().execute(
+        {"title": "test_title", "url": "http://example.com", "notes": None}
+    )
+
+    # assert
+    assert [row[1:3] for row in commands.ListBookmarksCommand().execute()] == [
+        ("test_title", "http://example.com")
+    ]
+
+
+@pytest.fixture
+def old_database():
+    # a database from before the unique url index, holding the same url twice
+    filename = "test_commands_old.db"
+    database = DatabaseManager(filename)
+    database.create_table(
+        "bookmarks",
+        {
+            "id": "integer primary key autoincrement",
+            "title": "text not null",
+            "url": "text not null",
+            "notes": "text",
+            "date_added": "text not null",
+        },
+    )
+    database.create_index("bookmarks", "url")
+    database.add_many(
+        "bookmarks",
+        [
+            {
+                "title": "old",
+                "url": "http://a.com",
+                "notes": "first",
+                "date_added": "1",
+            },
+            {"title": "b", "url": "http://b.com", "notes": None, "date_added": "2"},
+            {
+                "title": "new",
+                "url": "http://a.com",
+                "notes": "second",
+                "date_added": "3",
+            },
+        ],
+    )
+    commands.set_database(database)
+    yield database
+    commands.set_database(None)
+    os.remove(filename)
+
+
+def test_create_bookmarks_table_merges_duplicates_once(old_database):
+    # act
+    report = commands.CreateBookmarksTableCommand().execute()
+    old_database.add(
+        "bookmarks",
+        {"title": "c", "url": "http://c.com", "notes": None, "date_added": "4"},
+    )
+    second_report = commands.CreateBookmarksTableCommand().execute()
+
+    # assert
+    assert report == "Merged duplicate bookmarks:\nhttp://a.com (2 copies)"
+    assert second_report is None
+    assert [row[1:4] for row in old_database.select("bookmarks", order_by="id")] == [
+        ("new", "http://a.com", "first\nsecond"),
+        ("b", "http://b.com", None),
+        ("c", "http://c.com", None),
+    ]
+    assert old_database.schema_object_exists("uq_bookmarks_url", "index")
+    assert not old_database.schema_object_exists("idx_bookmarks_url", "index")
@@ -2,9 +2,12 @@
 # that said, the database module could certain be refactored to achieve decoupling
 # in fact, either the implementation of the Unit of Work or just changing to sqlalchemy would be good.
 
+import gc
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import sqlite3
+import threading
 
 import pytest
 
@@ -174,3 +177,698 @@ def test_database_manager_select_bookmark(database_manager):
     cursor = conn.cursor()
     cursor.execute(""" SELECT * FROM bookmarks WHERE title='test_title' """)
     assert cursor.fetchone()[0] == 1
+
+
+def test_database_manager_add_many_bookmarks(database_manager):
+    # arrange
+    database_manager.create_table(
+        "bookmarks",
+        {
+            "id": "integer primary key autoincrement",
+            "title": "text not null",
+            "url": "text not null",
+            "notes": "text",
+            "date_added": "text not null",
+        },
+    )
+
+    # a generator, so nothing is materialized up front
+    data = (
+        {
+            "title": f"test_title_{i}",
+            "url": f"http://example.com/{i}",
+            "date_added": datetime.utcnow().isoformat(),
+        }
+        for i in range(25)
+    )
+
+    # act
+    inserted = database_manager.add_many("bookmarks", data, chunk_size=10)
+
+    # assert
+    assert inserted == 25
+    conn = database_manager.connection
+    cursor = conn.cursor()
+    cursor.execute(""" SELECT count(*) FROM bookmarks """)
+    assert cursor.fetchone()[0] == 25
+
+
+def test_database_manager_add_many_groups_rows_by_columns(database_manager):
+    # arrange
+    database_manager.create_table(
+        "bookmarks",
+        {
+            "id": "integer primary key autoincrement",
+            "title": "text not null",
+            "url": "text not null",
+            "notes": "text",
+            "date_added": "text not null",
+        },
+    )
+
+    now = datetime.utcnow().isoformat()
+    data = [
+        {"title": "one", "url": "http://example.com/1", "date_added": now},
+        {
+            "title": "two",
+            "url": "http://example.com/2",
+            "notes": "n",
+            "date_added": now,
+        },
+        {"title": "three", "url": "http://example.com/3", "date_added": now},
+    ]
+
+    # act
+    inserted = database_manager.add_many("bookmarks", data)
+
+    # assert
+    assert inserted == 3
+    conn = database_manager.connection
+    cursor = conn.cursor()
+    cursor.execute(""" SELECT title, notes FROM bookmarks ORDER BY id """)
+    assert cursor.fetchall() == [("one", None), ("two", "n"), ("three", None)]
+
+
+def test_database_manager_add_many_rolls_back_on_error(database_manager):
+    # arrange
+    database_manager.create_table(
+        "bookmarks",
+        {
+            "id": "integer primary key autoincrement",
+            "title": "text not null",
+            "url": "text not null",
+            "notes": "text",
+            "date_added": "text not null",
+        },
+    )
+
+    now = datetime.utcnow().isoformat()
+    data = [
+        {"title": "one", "url": "http://example.com/1", "date_added": now},
+        {"title": None, "url": "http://example.com/2", "date_added": now},
+    ]
+
+    # act
+    with pytest.raises(sqlite3.IntegrityError):
+        database_manager.add_many("bookmarks", data, chunk_size=1)
+
+    # assert
+    conn = database_manager.connection
+    cursor = conn.cursor()
+    cursor.execute(""" SELECT count(*) FROM bookmarks """)
+    assert cursor.fetchone()[0] == 0
+
+
+def test_database_manager_select_iter_streams_all_rows(database_manager):
+    # arrange
+    database_manager.create_table(
+        "bookmarks",
+        {
+            "id": "integer primary key autoincrement",
+            "title": "text not null",
+            "url": "text not null",
+            "notes": "text",
+            "date_added": "text not null",
+        },
+    )
+    database_manager.add_many(
+        "bookmarks",
+        (
+            {
+                "title": f"test_title_{i:02}",
+                "url": f"http://example.com/{i}",
+                "date_added": datetime.utcnow().isoformat(),
+            }
+            for i in range(25)
+        ),
+    )
+
+    # act
+    rows = database_manager.select_iter("bookmarks", order_by="title", batch_size=7)
+
+    # assert
+    titles = [row[1] for row in rows]
+    assert titles == [f"test_title_{i:02}" for i in range(25)]
+
+
+def test_database_manager_select_pages_uses_keyset_pagination(database_manager):
+    # arrange
+    database_manager.create_table(
+        "bookmarks",
+        {
+            "id": "integer primary key autoincrement",
+            "title": "text not null",
+            "url": "text not null",
+            "notes": "text",
+            "date_added": "text not null",
+        },
+    )
+    # duplicate titles make sure ties are broken on id
+    database_manager.add_many(
+        "bookmarks",
+        (
+            {
+                "title": f"test_title_{i % 5}",
+                "url": f"http://example.com/{i}",
+                "date_added": datetime.utcnow().isoformat(),
+            }
+            for i in range(23)
+        ),
+    )
+
+    # act
+    pages = list(
+        database_manager.select_pages("bookmarks", order_by="title", page_size=10)
+    )
+
+    # assert
+    assert [len(page) for page in pages] == [10, 10, 3]
+    rows = [row for page in pages for row in page]
+    assert len({row[0] for row in rows}) == 23
+    assert rows == sorted(rows, key=lambda row: (row[1], row[0]))
+
+
+def test_database_manager_select_page_starts_after_the_given_key(database_manager):
+    # arrange
+    database_manager.create_table(
+        "bookmarks",
+        {
+            "id": "integer primary key autoincrement",
+            "title": "text not null",
+            "url": "text not null",
+            "notes": "text",
+            "date_added": "text not null",
+        },
+    )
+    database_manager.add_many(
+        "bookmarks",
+        (
+            {
+                "title": f"test_title_{i}",
+                "url": f"http://example.com/{i}",
+                "date_added": datetime.utcnow().isoformat(),
+            }
+            for i in range(10)
+        ),
+    )
+
+    # act
+    page = database_manager.select_page("bookmarks", after_id=4, limit=3).fetchall()
+
+    # assert
+    assert [row[0] for row in page] == [5, 6, 7]
+
+
+def test_database_manager_reuses_cached_statements(database_manager):
+    # arrange
+    database_manager.create_table(
+        "bookmarks",
+        {
+            "id": "integer primary key autoincrement",
+            "title": "text not null",
+            "url": "text not null",
+            "notes": "text",
+            "date_added": "text not null",
+        },
+    )
+
+    data = {
+        "title": "test_title",
+        "url": "http://example.com",
+        "notes": "test notes",
+        "date_added": datetime.utcnow().isoformat(),
+    }
+
+    # act
+    for _ in range(3):
+        database_manager.add("bookmarks", data)
+        database_manager.select("bookmarks", {"title": "test_title"}, "date_added")
+
+    # assert
+    info = database_manager.statement_cache_info()
+    assert info["misses"] == 2
+    assert info["hits"] == 4
+    assert info["size"] == 2
+
+
+def test_database_manager_statement_cache_is_bounded():
+    filename = "test_bookmarks_bounded.db"
+    dbm = DatabaseManager(filename, cached_statements=2)
+    try:
+        dbm.create_table("bookmarks", {"id": "integer primary key", "title": "text"})
+
+        # act
+        dbm.select("bookmarks", order_by="id")
+        dbm.select("bookmarks", order_by="title")
+        dbm.select("bookmarks", {"id": 1})
+
+        # assert
+        assert dbm.statement_cache_info()["size"] == 2
+        assert dbm.statement_cache_info()["misses"] == 3
+    finally:
+        dbm.__del__()
+        os.remove(filename)
+
+
+def test_database_manager_applies_wal_profile(database_manager):
+    # arrange
+    conn = database_manager.connection
+
+    # assert
+    assert database_manager.profile == "safe"
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 2  # FULL
+
+    # act
+    database_manager.apply_profile("bulk-load")
+
+    # assert
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 0  # OFF
+    assert conn.execute("PRAGMA cache_size").fetchone()[0] == -64000
+    assert conn.execute("PRAGMA temp_store").fetchone()[0] == 2  # MEMORY
+
+
+def test_database_manager_rejects_unknown_profile(database_manager):
+    with pytest.raises(ValueError, match="Unknown profile"):
+        database_manager.apply_profile("reckless")
+
+
+def test_database_manager_update_bookmark(database_manager):
+    # arrange
+    database_manager.create_table(
+        "bookmarks",
+        {
+            "id": "integer primary key autoincrement",
+            "title": "text not null",
+            "url": "text not null",
+            "notes": "text",
+            "date_added": "text not null",
+        },
+    )
+
+    data = {
+        "title": "test_title",
+        "url": "http://example.com",
+        "notes": "test notes",
+        "date_added": datetime.utcnow().isoformat(),
+    }
+    database_manager.add("bookmarks", data)
+
+    # act
+    updated = database_manager.update("bookmarks", {"id": 1}, {"notes": "new notes"})
+
+    # assert
+    assert updated == 1
+    conn = database_manager.connection
+    cursor = conn.cursor()
+    cursor.execute(""" SELECT title, notes FROM bookmarks WHERE id=1 """)
+    assert cursor.fetchone() == ("test_title", "new notes")
+
+
+def test_database_manager_update_many_bookmarks(database_manager):
+    # arrange
+    database_manager.create_table(
+        "bookmarks",
+        {
+            "id": "integer primary key autoincrement",
+            "title": "text not null",
+            "url": "text not null",
+            "notes": "text",
+            "date_added": "text not null",
+        },
+    )
+    database_manager.add_many(
+        "bookmarks",
+        (
+            {
+                "title": f"test_title_{i}",
+                "url": f"http://example.com/{i}",
+                "date_added": datetime.utcnow().isoformat(),
+            }
+            for i in range(1, 11)
+        ),
+    )
+
+    updates = [
+        ({"id": i}, {"url": f"https://example.org/{i}"}) for i in range(1, 11)
+    ] + [({"title": "test_title_1"}, {"notes": "renamed", "title": "first"})]
+
+    # act
+    updated = database_manager.update_many("bookmarks", updates, chunk_size=4)
+
+    # assert
+    assert updated == 11
+    conn = database_manager.connection
+    cursor = conn.cursor()
+    cursor.execute(""" SELECT count(*) FROM bookmarks WHERE url LIKE 'https://%' """)
+    assert cursor.fetchone()[0] == 10
+    cursor.execute(""" SELECT title, notes FROM bookmarks WHERE id=1 """)
+    assert cursor.fetchone() == ("first", "renamed")
+
+
+def test_database_manager_create_and_drop_index(database_manager):
+    # arrange
+    database_manager.create_table(
+        "bookmarks",
+        {
+            "id": "integer primary key autoincrement",
+            "title": "text not null",
+            "url": "text not null",
+            "notes": "text",
+            "date_added": "text not null",
+        },
+    )
+    query = "SELECT * FROM bookmarks ORDER BY title"
+
+    # act
+    index_name = database_manager.create_index("bookmarks", "title")
+
+    # assert
+    assert index_name == "idx_bookmarks_title"
+    [plan] = database_manager.explain(query)
+    assert "USING INDEX idx_bookmarks_title" in plan
+
+    # act
+    database_manager.drop_index(index_name)
+
+    # assert
+    plan = database_manager.explain(query)
+    assert any("USE TEMP B-TREE FOR ORDER BY" in step for step in plan)
+
+
+def test_database_manager_keyset_page_walks_the_index(database_manager):
+    # arrange
+    database_manager.create_table(
+        "bookmarks",
+        {
+            "id": "integer primary key autoincrement",
+            "title": "text not null",
+            "url": "text not null",
+            "notes": "text",
+            "date_added": "text not null",
+        },
+    )
+    database_manager.create_index("bookmarks", "date_added")
+
+    # act
+    plan = database_manager.explain(
+        "SELECT * FROM bookmarks WHERE (date_added, id) > (?, ?)"
+        " ORDER BY date_added, id LIMIT ?",
+        ("2024-01-01", 1, 10),
+    )
+
+    # assert
+    assert any("idx_bookmarks_date_added" in step for step in plan)
+    assert not any("TEMP B-TREE" in step for step in plan)
+
+
+def test_database_manager_search_ranks_and_highlights_matches(database_manager):
+    # arrange
+    database_manager.create_table(
+        "bookmarks",
+        {
+            "id": "integer primary key autoincrement",
+            "title": "text not null",
+            "url": "text not null",
+            "notes": "text",
+            "date_added": "text not null",
+        },
+    )
+    now = datetime.utcnow().isoformat()
+    # this row exists before the index, so the rebuild has to pick it up
+    database_manager.add(
+        "bookmarks",
+        {
+            "title": "Flask",
+            "url": "https://flask.dev",
+            "notes": "python web framework",
+            "date_added": now,
+        },
+    )
+    database_manager.create_search_index("bookmarks", ["title", "url", "notes"])
+    database_manager.add(
+        "bookmarks",
+        {
+            "title": "Python",
+            "url": "https://python.org",
+            "notes": "python python",
+            "date_added": now,
+        },
+    )
+    database_manager.add(
+        "bookmarks",
+        {
+            "title": "Rust",
+            "url": "https://rust-lang.org",
+            "notes": None,
+            "date_added": now,
+        },
+    )
+
+    # act
+    results = database_manager.search("bookmarks", "python").fetchall()
+
+    # assert
+    assert [row[1] for row in results] == ["Python", "Flask"]
+    assert "[python]" in results[0][-1].lower()
+
+
+def test_database_manager_search_index_follows_updates_and_deletes(database_manager):
+    # arrange
+    database_manager.create_table(
+        "bookmarks",
+        {
+            "id": "integer primary key autoincrement",
+            "title": "text not null",
+            "url": "text not null",
+            "notes": "text",
+            "date_added": "text not null",
+        },
+    )
+    database_manager.create_search_index("bookmarks", ["title", "url", "notes"])
+    now = datetime.utcnow().isoformat()
+    database_manager.add_many(
+        "bookmarks",
+        [
+            {"title": "Django", "url": "https://djangoproject.com", "date_added": now},
+            {"title": "Flask", "url": "https://flask.dev", "date_added": now},
+        ],
+    )
+
+    # act
+    database_manager.update("bookmarks", {"id": 1}, {"notes": "batteries included"})
+    database_manager.delete("bookmarks", {"id": 2})
+
+    # assert
+    assert len(database_manager.search("bookmarks", "batteries").fetchall()) == 1
+    assert database_manager.search("bookmarks", "flask").fetchall() == []
+
+
+def test_database_manager_search_index_is_only_built_when_created(
+    database_manager, monkeypatch
+):
+    # arrange
+    database_manager.create_table(
+        "bookmarks",
+        {
+            "id": "integer primary key autoincrement",
+            "title": "text not null",
+            "url": "text not null",
+            "notes": "text",
+            "date_added": "text not null",
+        },
+    )
+    rebuilt = []
+    rebuild = database_manager.rebuild_search_index
+    monkeypatch.setattr(
+        database_manager,
+        "rebuild_search_index",
+        lambda table_name: rebuilt.append(table_name) or rebuild(table_name),
+    )
+
+    # act
+    database_manager.create_search_index("bookmarks", ["title", "url", "notes"])
+    database_manager.create_search_index("bookmarks", ["title", "url", "notes"])
+
+    # assert
+    assert rebuilt == ["bookmarks"]
+    assert database_manager.schema_object_exists("bookmarks_fts")
+    assert not database_manager.schema_object_exists("bookmarks_fts", "index")
+
+
+def test_database_manager_upsert_many_skips_unchanged_rows(database_manager):
+    # arrange
+    database_manager.create_table(
+        "bookmarks",
+        {
+            "id": "integer primary key autoincrement",
+            "title": "text not null",
+            "url": "text not null",
+            "notes": "text",
+            "date_added": "text not null",
+        },
+    )
+    database_manager.create_index("bookmarks", "url", unique=True)
+
+    def bookmarks(renamed=None):
+        return [
+            {
+                "title": renamed if renamed and i == 0 else f"test_title_{i}",
+                "url": f"http://example.com/{i}",
+                "date_added": f"2024-01-0{i + 1}",
+            }
+            for i in range(3)
+        ]
+
+    # act
+    first = database_manager.upsert_many(
+        "bookmarks", bookmarks(), ["url"], update_columns=["title"]
+    )
+    unchanged = database_manager.upsert_many(
+        "bookmarks", bookmarks(), ["url"], update_columns=["title"]
+    )
+    renamed = database_manager.upsert_many(
+        "bookmarks", bookmarks("renamed"), ["url"], update_columns=["title"]
+    )
+
+    # assert
+    assert (first, unchanged, renamed) == (3, 0, 1)
+    assert set(database_manager.select_values("bookmarks", "title")) == {
+        "renamed",
+        "test_title_1",
+        "test_title_2",
+    }
+
+
+def test_database_manager_gives_each_thread_its_own_connection(database_manager):
+    # arrange
+    database_manager.create_table(
+        "bookmarks",
+        {
+            "id": "integer primary key autoincrement",
+            "title": "text not null",
+            "url": "text not null",
+            "notes": "text",
+            "date_added": "text not null",
+        },
+    )
+    now = datetime.utcnow().isoformat()
+    connections = {}
+
+    def add_and_count(worker):
+        connections.setdefault(threading.get_ident(), set()).add(
+            database_manager.connection
+        )
+        database_manager.add_many(
+            "bookmarks",
+            (
+                {
+                    "title": f"worker {worker} bookmark {i}",
+                    "url": f"http://example.com/{worker}/{i}",
+                    "date_added": now,
+                }
+                for i in range(50)
+            ),
+        )
+        return len(database_manager.select("bookmarks").fetchall())
+
+    # act
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        counts = list(pool.map(add_and_count, range(8)))
+
+    # assert - no "SQLite objects created in a thread" errors and no lost writes
+    assert all(count >= 50 for count in counts)
+    assert len(database_manager.select("bookmarks").fetchall()) == 400
+    assert all(len(seen) == 1 for seen in connections.values())
+    opened = set.union(*connections.values())
+    assert len(opened) == len(connections)
+    assert database_manager.connection not in opened
+
+
+def test_database_manager_applies_profile_to_other_threads(database_manager):
+    # arrange - another thread opens its connection under the default profile
+    def synchronous_setting():
+        connection = database_manager.connection
+        return connection.execute("PRAGMA synchronous").fetchone()[0]
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        assert pool.submit(synchronous_setting).result() == 2  # FULL
+
+        # act
+        database_manager.apply_profile("bulk-load")
+
+        # assert
+        assert pool.submit(synchronous_setting).result() == 0  # OFF
+    assert synchronous_setting() == 0
+
+
+def test_database_manager_close_closes_every_connection():
+    # arrange
+    filename = "test_pool.db"
+    database_manager = DatabaseManager(filename)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        other = pool.submit(lambda: database_manager.connection).result()
+
+    # act
+    with database_manager:
+        this = database_manager.connection
+
+    # assert
+    for connection in (this, other):
+        with pytest.raises(sqlite3.ProgrammingError):
+            connection.execute("SELECT 1")
+    os.remove(filename)
+
+
+def test_database_manager_holds_the_reader_slot_until_the_rows_are_read():
+    # arrange
+    filename = "test_readers.db"
+    dbm = DatabaseManager(filename, max_readers=1)
+    dbm.create_table("numbers", {"id": "integer primary key", "n": "integer"})
+    dbm.add_many("numbers", ({"n": n} for n in range(10)))
+    other_reader_done = threading.Event()
+
+    def other_reader():
+        dbm.select("numbers").fetchall()
+        other_reader_done.set()
+
+    try:
+        # act
+        cursor = dbm.select("numbers", order_by="id")
+        first = cursor.fetchone()
+        # a nested query on the same thread reuses the slot instead of waiting for it
+        assert len(dbm.select("numbers").fetchall()) == 10
+        thread = threading.Thread(target=other_reader)
+        thread.start()
+        blocked = not other_reader_done.wait(0.2)
+        rest = cursor.fetchall()
+        thread.join(timeout=5)
+
+        # assert
+        assert first[1] == 0 and len(rest) == 9
+        assert blocked
+        assert other_reader_done.is_set()
+    finally:
+        dbm.close()
+        os.remove(filename)
+
+
+def test_database_manager_closes_the_connections_of_finished_threads(database_manager):
+    # arrange
+    database_manager.create_table(
+        "numbers", {"id": "integer primary key", "n": "integer"}
+    )
+
+    def query():
+        database_manager.select("numbers").fetchall()
+
+    # act
+    for _ in range(20):
+        thread = threading.Thread(target=query)
+        thread.start()
+        thread.join()
+    gc.collect()
+
+    # assert
+    # only the connection of this (still running) thread is left open
+    assert len(database_manager.pool._connections) == 1
@@ -0,0 +1,119 @@
+# the GitHub client is tested against a stub of the API served from a local HTTP server,
+# so no network access (or GitHub rate limit) is needed
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from github import GitHubStarsClient
+
+
+def starred_repo(number):
+    return {
+        "starred_at": "2024-01-01T00:00:00Z",
+        "repo": {
+            "name": f"repo-{number}",
+            "html_url": f"https://github.com/octocat/repo-{number}",
+            "description": f"repo number {number}",
+        },
+    }
+
+
+class StubGitHub(BaseHTTPRequestHandler):
+    pages = {}
+    rate_limit = None  # (remaining, reset) to report, if any
+    requests_seen = []
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        page = int(parse_qs(parts.query).get("page", ["1"])[0])
+        etag = f'"page-{page}"'
+        self.requests_seen.append((page, self.headers.get("If-None-Match")))
+
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        body = json.dumps(self.pages[page]).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        if page == 1 and len(self.pages) > 1:
+            base = f"http://{self.headers['Host']}{parts.path}?per_page=2"
+            self.send_header(
+                "Link",
+                f'<{base}&page=2>; rel="next", <{base}&page={len(self.pages)}>; rel="last"',
+            )
+        if self.rate_limit:
+            remaining, reset = self.rate_limit
+            self.send_header("X-RateLimit-Remaining", str(remaining))
+            self.send_header("X-RateLimit-Reset", str(reset))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_github():
+    StubGitHub.pages = {
+        1: [starred_repo(1), starred_repo(2)],
+        2: [starred_repo(3), starred_repo(4)],
+        3: [starred_repo(5)],
+    }
+    StubGitHub.rate_limit = None
+    StubGitHub.requests_seen = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubGitHub)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_client_fetches_every_page_in_order(stub_github):
+    client = GitHubStarsClient(api_url=stub_github, per_page=2)
+
+    pages = list(client.starred_pages("octocat"))
+
+    names = [star["repo"]["name"] for page in pages for star in page.stars]
+    assert names == [f"repo-{number}" for number in range(1, 6)]
+    assert [page.etag for page in pages] == ['"page-1"', '"page-2"', '"page-3"']
+
+
+def test_client_sends_etags_and_skips_unchanged_pages(stub_github):
+    client = GitHubStarsClient(api_url=stub_github, per_page=2)
+    etags = {page.url: page.etag for page in client.starred_pages("octocat")}
+
+    pages = list(client.starred_pages("octocat", etags))
+
+    assert [page.stars for page in pages] == [None, None, None]
+    assert sorted(StubGitHub.requests_seen[3:]) == [
+        (1, '"page-1"'),
+        (2, '"page-2"'),
+        (3, '"page-3"'),
+    ]
+
+
+def test_client_waits_for_the_rate_limit_to_reset(stub_github):
+    StubGitHub.rate_limit = (0, 1_000_060)
+    delays = []
+    client = GitHubStarsClient(
+        api_url=stub_github,
+        per_page=2,
+        max_workers=1,
+        sleep=delays.append,
+        clock=lambda: 1_000_000,
+    )
+
+    list(client.starred_pages("octocat"))
+
+    assert client.rate_limit_remaining == 0
+    assert delays == [60, 60]